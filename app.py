@@ -1,5 +1,9 @@
+import time
 import socket
 
+# Reference point for the import-to-first-response startup measurement
+_IMPORT_STARTED = time.perf_counter()
+
 def force_ipv4():
     old_getaddrinfo = socket.getaddrinfo
     def new_getaddrinfo(*args, **kwargs):
@@ -11,12 +15,15 @@ force_ipv4()
 
 import os
 import logging
+import threading
 import pytz
-from flask import Flask
+from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.pool import NullPool
+from sqlite_backend import is_sqlite_url, engine_options as sqlite_engine_options
+from invalidation_log import invalidation_log
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -49,15 +56,24 @@ def _build_database_url():
     return os.environ.get("DATABASE_URL")
 
 app.config["SQLALCHEMY_DATABASE_URI"] = _build_database_url()
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_pre_ping": True,
-    "poolclass": NullPool,
-    "connect_args": {
+_use_sqlite = is_sqlite_url(app.config["SQLALCHEMY_DATABASE_URI"])
+if _use_sqlite:
+    # Embedded single-node deployment: pooled local connections (see sqlite_backend.py)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+else:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_pre_ping": True,
+        "poolclass": NullPool,
+    }
+# libpq options
+if (app.config["SQLALCHEMY_DATABASE_URI"] or "").startswith("postgres"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
         "connect_timeout": 15,
         "application_name": "PodcastPal"
     }
-}
 app.config['TIMEZONE'] = TIMEZONE
+# Public base URL used in feed self-links, e.g. https://podcastpal.example.com
+app.config['CANONICAL_BASE_URL'] = os.environ.get('CANONICAL_BASE_URL')
 
 # Initialize extensions
 db.init_app(app)
@@ -67,54 +83,28 @@ login_manager.login_view = "google_auth.login"
 
 # Import routes after app initialization to avoid circular imports
 with app.app_context():
-    from models import User, Feed, Episode
-    db.create_all()
-    
-    # Run database migrations
-    def run_migrations():
-        """Run database migrations for schema updates"""
-        try:
-            # Add last_rss_access column if it doesn't exist
-            db.session.execute(db.text("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'feed' AND column_name = 'last_rss_access'
-                    ) THEN
-                        ALTER TABLE feed ADD COLUMN last_rss_access TIMESTAMP;
-                        RAISE NOTICE 'Added last_rss_access column to feed table';
-                    END IF;
-                END $$;
-            """))
-            
-            # Add retention_period column if it doesn't exist
-            db.session.execute(db.text("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name = 'feed' AND column_name = 'retention_period'
-                    ) THEN
-                        ALTER TABLE feed ADD COLUMN retention_period INTEGER DEFAULT 90;
-                        RAISE NOTICE 'Added retention_period column to feed table';
-                    END IF;
-                END $$;
-            """))
-            db.session.commit()
-            logger.info("Database migrations completed successfully")
-        except Exception as e:
-            logger.error(f"Error running migrations: {e}")
-            db.session.rollback()
-    
+    if _use_sqlite:
+        from sqlite_backend import install as install_sqlite_pragmas
+        install_sqlite_pragmas(db.engine)
+
+    from models import Feed, Episode
+    # Versioned migrations: one query at startup when the schema is current
+    from migrations import run_migrations
     run_migrations()
 
     from google_auth import google_auth
     app.register_blueprint(google_auth)
 
+    # Cached identities: authenticated page views don't query the user table
+    from identity_cache import identity_cache
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return identity_cache.load(int(user_id))
+
+    # Per-request query counts, for /db/status
+    from db_monitor import install_query_counter
+    install_query_counter(app)
 
     import routes
     
@@ -123,31 +113,79 @@ with app.app_context():
     def cleanup_db_connections(error):
         """Clean up database connections after each request"""
         db.session.remove()
-        
-    # Setup periodic maintenance (Flask 2.2+ compatible)
-    def setup_maintenance():
-        """Setup periodic database maintenance"""
-        from query_optimizer import MaintenanceQueries
-        import threading
-        import time
-        
-        def maintenance_worker():
-            """Background maintenance worker"""
-            while True:
-                time.sleep(3600)  # Run every hour
-                try:
-                    with app.app_context():
-                        MaintenanceQueries.analyze_tables()
-                except Exception as e:
-                    logger.error(f"Maintenance error: {e}")
-        
-        # Start maintenance in background thread
-        maintenance_thread = threading.Thread(target=maintenance_worker, daemon=True)
-        maintenance_thread.start()
-    
-    # Initialize maintenance on startup
-    setup_maintenance()
-    
-    # Start periodic cleanup
-    from session_manager import periodic_cleanup
-    periodic_cleanup()
\ No newline at end of file
+
+
+# Background services run in one process per host: every gunicorn worker calls
+# start_background_services() after fork and an exclusive flock elects the owner.
+# If the owner exits, the lock is released and another process takes over.
+BACKGROUND_LOCK_PATH = os.environ.get("BACKGROUND_LOCK_PATH", "/tmp/podcastpal-background.lock")
+BACKGROUND_LOCK_RETRY_SECONDS = 60
+_background_lock_file = None
+
+def _try_acquire_background_lock():
+    """Take the background services lock without blocking; the file stays open while held"""
+    global _background_lock_file
+    import fcntl
+
+    lock_file = open(BACKGROUND_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _background_lock_file = lock_file
+    return True
+
+def start_background_services():
+    """Start the background job scheduler in exactly one process"""
+    def start_services():
+        logger.info(f"Process {os.getpid()} owns background services")
+        from scheduler import scheduler, register_default_jobs
+        register_default_jobs(scheduler)
+        scheduler.start()
+
+    if _background_lock_file is not None:
+        return
+    if _try_acquire_background_lock():
+        start_services()
+        return
+
+    def wait_for_lock():
+        """Standby: take over if the owning process goes away"""
+        while not _try_acquire_background_lock():
+            time.sleep(BACKGROUND_LOCK_RETRY_SECONDS)
+        start_services()
+
+    threading.Thread(target=wait_for_lock, name="background-standby", daemon=True).start()
+
+# Deferred initialisation: nothing is started at import, so a cold start only pays
+# for imports and the migration version check before serving its first request
+_deferred_lock = threading.Lock()
+_deferred_started = False
+_first_response_logged = False
+
+@app.before_request
+def start_deferred_services():
+    """Start background services when the first request arrives"""
+    global _deferred_started
+    if _deferred_started:
+        return
+    with _deferred_lock:
+        if not _deferred_started:
+            _deferred_started = True
+            start_background_services()
+
+@app.before_request
+def apply_invalidations():
+    """Drop cache entries that another worker on this host invalidated"""
+    invalidation_log.poll()
+
+@app.after_request
+def log_first_response(response):
+    """Log how long this process took from import to its first response"""
+    global _first_response_logged
+    if not _first_response_logged:
+        _first_response_logged = True
+        logger.info(f"First response ({request.path} {response.status_code}) served "
+                    f"{time.perf_counter() - _IMPORT_STARTED:.2f}s after import")
+    return response
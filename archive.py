@@ -0,0 +1,192 @@
+"""
+Retention-driven episode archival
+
+Non-recurring episodes older than their feed's retention_period can never appear
+in RSS again, so they are moved in batches from episode to episode_archive. They
+stay searchable and exportable on request, and come back when a feed's retention
+window is widened.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from app import db
+from models import Feed, Episode, EpisodeArchive
+from sqlalchemy import select, insert, delete, func, literal, text
+from feed_renderer import TIMEZONE, DEFAULT_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+MAX_REPORTED_CONFLICTS = 20
+
+# Columns copied between the two tables, in the same order on both sides
+MOVED_COLUMNS = ('id', 'feed_id', 'title', 'description', 'audio_url', 'resolved_audio_url',
+                 'release_date', 'is_recurring', 'created_at', 'content_hash', 'enclosure_length',
+                 'enclosure_type', 'duration_seconds', 'bitrate', 'probed_at')
+
+
+def archive_cutoff(retention_period, now=None):
+    """Release dates before this fall outside the retention window (naive Pacific, like stored dates)"""
+    now = now or datetime.now(TIMEZONE)
+    days = retention_period or DEFAULT_RETENTION_DAYS
+    return (now - timedelta(days=days)).replace(tzinfo=None)
+
+
+def _dialect_insert(table):
+    """Dialect-specific INSERT so conflicts can be skipped on restore"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+
+class EpisodeArchiver:
+    """Moves episodes between the hot table and the archive"""
+
+    @staticmethod
+    def _archive_batch(feed_id, cutoff, batch_size, archived_at):
+        """Move one batch; returns the number of episodes moved"""
+        candidates = (select(Episode.id)
+                      .where(Episode.feed_id == feed_id,
+                             Episode.is_recurring.is_(False),
+                             Episode.release_date < cutoff)
+                      .order_by(Episode.release_date)
+                      .limit(batch_size))
+
+        source = [getattr(Episode, name) for name in MOVED_COLUMNS]
+        target = [getattr(EpisodeArchive, name) for name in MOVED_COLUMNS] + [EpisodeArchive.archived_at]
+
+        if db.engine.dialect.name == 'postgresql':
+            # One statement: DELETE ... RETURNING feeds the INSERT, so rows are never in both tables
+            moved = (delete(Episode)
+                     .where(Episode.id.in_(candidates.with_for_update(skip_locked=True).scalar_subquery()))
+                     .returning(*source)
+                     .cte('moved'))
+            statement = insert(EpisodeArchive).from_select(
+                target, select(*[moved.c[name] for name in MOVED_COLUMNS], literal(archived_at))
+            )
+            return db.session.execute(statement).rowcount
+
+        ids = db.session.execute(candidates).scalars().all()
+        if not ids:
+            return 0
+        db.session.execute(insert(EpisodeArchive).from_select(
+            target, select(*source, literal(archived_at)).where(Episode.id.in_(ids))
+        ))
+        db.session.execute(delete(Episode).where(Episode.id.in_(ids)))
+        return len(ids)
+
+    @staticmethod
+    def archive_feed(feed_id, retention_period, batch_size=BATCH_SIZE):
+        """Archive a feed's expired episodes, committing after each batch"""
+        cutoff = archive_cutoff(retention_period)
+        archived_at = datetime.utcnow()
+        total = 0
+        while True:
+            try:
+                moved = EpisodeArchiver._archive_batch(feed_id, cutoff, batch_size, archived_at)
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Error archiving episodes for feed {feed_id}: {e}")
+                db.session.rollback()
+                break
+            total += moved
+            if moved < batch_size:
+                break
+        if total:
+            logger.info(f"Archived {total} episodes of feed {feed_id} released before {cutoff}")
+        return total
+
+    @staticmethod
+    def archive_all(batch_size=BATCH_SIZE):
+        """Archive expired episodes of every feed; logs storage before and after"""
+        before = EpisodeArchiver.storage_stats()
+        start = time.perf_counter()
+
+        feeds = db.session.execute(select(Feed.id, Feed.retention_period)).all()
+        db.session.commit()
+        archived = {}
+        for feed_id, retention_period in feeds:
+            moved = EpisodeArchiver.archive_feed(feed_id, retention_period, batch_size)
+            if moved:
+                archived[feed_id] = moved
+
+        after = EpisodeArchiver.storage_stats()
+        logger.info(f"Episode archival moved {sum(archived.values())} episodes from {len(archived)} feeds "
+                    f"in {time.perf_counter() - start:.2f}s; storage before: {before}, after: {after}")
+        return {'archived': archived, 'storage_before': before, 'storage_after': after}
+
+    @staticmethod
+    def restore_feed(feed_id, retention_period):
+        """Move archived episodes back once they are inside the feed's retention window again
+
+        An archived episode whose id or audio URL is taken by a hot episode stays
+        in the archive and is logged; only the rows actually inserted are removed
+        from it.
+        """
+        cutoff = archive_cutoff(retention_period)
+        source = [getattr(EpisodeArchive, name) for name in MOVED_COLUMNS]
+        target = [getattr(Episode, name) for name in MOVED_COLUMNS]
+
+        try:
+            candidates = select(EpisodeArchive.id).where(EpisodeArchive.feed_id == feed_id,
+                                                         EpisodeArchive.release_date >= cutoff)
+            if db.engine.dialect.name == 'postgresql':
+                candidates = candidates.with_for_update()
+            ids = db.session.execute(candidates).scalars().all()
+            restored_ids = []
+            if ids:
+                restored_ids = db.session.execute(
+                    _dialect_insert(Episode)
+                    .from_select(target, select(*source).where(EpisodeArchive.id.in_(ids)))
+                    .on_conflict_do_nothing()
+                    .returning(Episode.id)
+                ).scalars().all()
+                if restored_ids:
+                    db.session.execute(delete(EpisodeArchive).where(EpisodeArchive.id.in_(restored_ids)))
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error restoring archived episodes for feed {feed_id}: {e}")
+            db.session.rollback()
+            return 0
+
+        kept = sorted(set(ids) - set(restored_ids))
+        if kept:
+            logger.warning(f"Kept {len(kept)} archived episodes of feed {feed_id} whose id or audio URL is "
+                           f"used by a current episode: {kept[:MAX_REPORTED_CONFLICTS]}")
+        if restored_ids:
+            logger.info(f"Restored {len(restored_ids)} archived episodes of feed {feed_id} released since {cutoff}")
+        return len(restored_ids)
+
+    @staticmethod
+    def archived_count(feed_id):
+        return db.session.execute(
+            select(func.count(EpisodeArchive.id)).where(EpisodeArchive.feed_id == feed_id)
+        ).scalar()
+
+    @staticmethod
+    def storage_stats():
+        """Table and index sizes in bytes for the hot and archive tables (PostgreSQL only)"""
+        if db.engine.dialect.name != 'postgresql':
+            return {}
+        try:
+            rows = db.session.execute(text("""
+                SELECT c.relname AS name, pg_relation_size(c.oid) AS table_bytes,
+                       pg_indexes_size(c.oid) AS index_bytes, c.reltuples::bigint AS est_rows
+                FROM pg_class c
+                WHERE c.relname IN ('episode', 'episode_archive') AND c.relkind = 'r'
+            """))
+            stats = {row.name: {'table_bytes': row.table_bytes, 'index_bytes': row.index_bytes,
+                                'est_rows': row.est_rows} for row in rows}
+            indexes = db.session.execute(text("""
+                SELECT indexrelid::regclass::text AS name, pg_relation_size(indexrelid) AS bytes
+                FROM pg_index WHERE indrelid = 'episode'::regclass
+            """))
+            stats.setdefault('episode', {})['indexes'] = {row.name: row.bytes for row in indexes}
+            db.session.commit()
+            return stats
+        except Exception as e:
+            logger.warning(f"Could not read storage stats: {e}")
+            db.session.rollback()
+            return {}
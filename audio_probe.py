@@ -0,0 +1,344 @@
+"""
+Audio metadata probing with HTTP Range requests
+
+Only the first and last few KB of an enclosure are fetched. MP3 (ID3v2, Xing/Info,
+VBRI or constant bitrate), M4A (moov/mvhd) and Ogg (Vorbis/Opus granule position)
+headers give the duration, bitrate and MIME type without downloading the file.
+The parsers are free of Flask and database imports; probe_pending_episodes is the
+background batch that stores results on episode rows.
+"""
+import logging
+import re
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from enclosure_probe import is_url_allowed, probe_get
+
+logger = logging.getLogger(__name__)
+
+HEAD_BYTES = 16 * 1024
+TAIL_BYTES = 16 * 1024
+MAX_ATOM_HOPS = 8           # top-level MP4 atoms followed before giving up on moov
+MOOV_READ_BYTES = 4096
+PROBE_BATCH_SIZE = 50
+PROBE_WORKERS = 4
+RETRY_FAILED_AFTER = timedelta(days=1)
+
+AudioMetadata = namedtuple('AudioMetadata', ['mime_type', 'duration_seconds', 'bitrate', 'length'])
+
+_CONTENT_RANGE_TOTAL = re.compile(r'/(\d+)\s*$')
+
+
+class RangeFetcher:
+    """Fetches byte ranges of one URL, never reading more than was asked for"""
+
+    def __init__(self, url):
+        self.url = url
+        self.length = None
+        self.content_type = None
+
+    def fetch(self, start, size):
+        """Bytes [start, start + size); a negative start fetches the last -start bytes"""
+        byte_range = f"bytes={start}" if start < 0 else f"bytes={start}-{start + size - 1}"
+        with probe_get(self.url, headers={'Range': byte_range}, stream=True) as response:
+            response.raise_for_status()
+            self._record_headers(response)
+            if response.status_code == 206:
+                # Never trust the server to honour the range size; a connection left with
+                # unread body is simply not reused
+                return response.raw.read(size if start >= 0 else -start, decode_content=True)
+            if start != 0:
+                # Range ignored: a ranged read away from the start would mean downloading the file
+                return None
+            return response.raw.read(size, decode_content=True)
+
+    def _record_headers(self, response):
+        content_range = response.headers.get('Content-Range')
+        match = _CONTENT_RANGE_TOTAL.search(content_range) if content_range else None
+        if match:
+            self.length = int(match.group(1))
+        elif response.status_code == 200 and response.headers.get('Content-Length'):
+            self.length = int(response.headers['Content-Length'])
+        content_type = response.headers.get('Content-Type')
+        if content_type:
+            self.content_type = content_type.split(';')[0].strip().lower()
+
+
+# MP3 frame header tables, indexed by [version][layer] and bitrate index (kbps)
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+Mp3Frame = namedtuple('Mp3Frame', ['offset', 'version', 'layer', 'bitrate', 'sample_rate',
+                                   'samples', 'length', 'mono'])
+
+
+def _parse_mp3_frame(data, offset):
+    """Decode the frame header at offset, or None if it is not a valid header"""
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = {3: 1, 2: 2, 0: 25}.get((b1 >> 3) & 3)
+    layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 3)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        samples, length = 576, 72 * bitrate // sample_rate + padding
+    else:
+        samples, length = 1152, 144 * bitrate // sample_rate + padding
+    return Mp3Frame(offset, version, layer, bitrate, sample_rate, samples, length, (b3 >> 6) == 3)
+
+
+def _id3v2_size(data):
+    """Bytes taken by a leading ID3v2 tag (0 when there is none)"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _first_mp3_frame(data):
+    """First frame header that is followed by another valid header (rules out false syncs)"""
+    offset = data.find(b'\xFF')
+    while 0 <= offset < len(data) - 4:
+        frame = _parse_mp3_frame(data, offset)
+        if frame is not None:
+            following = offset + frame.length
+            if following + 4 > len(data) or _parse_mp3_frame(data, following) is not None:
+                return frame
+        offset = data.find(b'\xFF', offset + 1)
+    return None
+
+
+def parse_mp3(head, audio_start, length, tail=None):
+    """Duration and bitrate from the first frame; head starts at audio_start"""
+    frame = _first_mp3_frame(head)
+    if frame is None:
+        return None
+
+    # Xing/Info (LAME) and VBRI headers carry the frame count of VBR files
+    side_info = (17 if frame.mono else 32) if frame.version == 1 else (9 if frame.mono else 17)
+    xing = frame.offset + 4 + side_info
+    frames = None
+    if head[xing:xing + 4] in (b'Xing', b'Info') and len(head) >= xing + 12:
+        flags = struct.unpack('>I', head[xing + 4:xing + 8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', head[xing + 8:xing + 12])[0]
+    elif head[frame.offset + 36:frame.offset + 40] == b'VBRI' and len(head) >= frame.offset + 54:
+        frames = struct.unpack('>I', head[frame.offset + 50:frame.offset + 54])[0]
+
+    audio_bytes = None
+    if length:
+        audio_bytes = length - audio_start - frame.offset
+        if tail and tail[-128:-125] == b'TAG':
+            audio_bytes -= 128
+
+    if frames:
+        duration = frames * frame.samples / frame.sample_rate
+        bitrate = int(audio_bytes * 8 / duration) if audio_bytes and duration else frame.bitrate
+    elif audio_bytes:
+        duration = audio_bytes * 8 / frame.bitrate
+        bitrate = frame.bitrate
+    else:
+        return AudioMetadata('audio/mpeg', None, frame.bitrate, length)
+    return AudioMetadata('audio/mpeg', duration, bitrate, length)
+
+
+def _atoms(data, offset=0, end=None):
+    """Yield (type, offset, header size, total size) for the MP4 atoms in data[offset:end]"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        if size < header:
+            return
+        yield kind, offset, header, size
+        offset += size
+
+
+def _parse_mvhd(data, offset):
+    """Duration in seconds from an mvhd atom's payload at offset"""
+    version = data[offset]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', data[offset + 20:offset + 32])
+    else:
+        timescale, duration = struct.unpack('>II', data[offset + 12:offset + 20])
+    return duration / timescale if timescale else None
+
+
+def _moov_metadata(moov, start, header, size, length):
+    for kind, offset, child_header, _ in _atoms(moov, start + header, min(len(moov), start + size)):
+        if kind == b'mvhd':
+            duration = _parse_mvhd(moov, offset + child_header)
+            bitrate = int(length * 8 / duration) if duration and length else None
+            return AudioMetadata('audio/x-m4a', duration, bitrate, length)
+    return None
+
+
+def parse_mp4(fetcher, head):
+    """Find moov (at the start for fast-start files, otherwise after mdat) and read mvhd"""
+    offset = 0
+    for _ in range(MAX_ATOM_HOPS):
+        if offset + 16 <= len(head):
+            data, base = head, 0
+        else:
+            # Only the 16-byte atom header is fetched to skip over mdat
+            data, base = fetcher.fetch(offset, 16), offset
+            if not data:
+                return None
+        atom = next(_atoms(data, offset - base), None)
+        if atom is None:
+            return None
+        kind, _, header, size = atom
+        if kind == b'moov':
+            if offset + size <= len(head):
+                return _moov_metadata(head, offset, header, size, fetcher.length)
+            # mvhd is the first child of moov, so its opening bytes are enough
+            moov = fetcher.fetch(offset, min(size, MOOV_READ_BYTES))
+            return _moov_metadata(moov, 0, header, size, fetcher.length) if moov else None
+        offset += size
+        if fetcher.length and offset >= fetcher.length:
+            return None
+    return None
+
+
+def _ogg_page_header(data, offset):
+    if data[offset:offset + 4] != b'OggS' or offset + 27 > len(data) or data[offset + 4] != 0:
+        return None
+    granule = struct.unpack('<q', data[offset + 6:offset + 14])[0]
+    payload = offset + 27 + data[offset + 26]
+    return granule, payload
+
+
+def parse_ogg(head, tail, length):
+    """Duration from the last page's granule position and the codec's sample rate"""
+    first = _ogg_page_header(head, 0)
+    if first is None:
+        return None
+    _, payload = first
+    pre_skip = 0
+    if head[payload:payload + 7] == b'\x01vorbis':
+        sample_rate = struct.unpack('<I', head[payload + 12:payload + 16])[0]
+    elif head[payload:payload + 8] == b'OpusHead':
+        # Opus granule positions always count 48 kHz samples
+        sample_rate = 48000
+        pre_skip = struct.unpack('<H', head[payload + 10:payload + 12])[0]
+    else:
+        return AudioMetadata('audio/ogg', None, None, length)
+
+    duration = None
+    offset = tail.rfind(b'OggS') if tail else -1
+    while offset >= 0:
+        page = _ogg_page_header(tail, offset)
+        if page is not None and page[0] > 0:
+            duration = (page[0] - pre_skip) / sample_rate
+            break
+        offset = tail.rfind(b'OggS', 0, offset)
+
+    bitrate = int(length * 8 / duration) if duration and length else None
+    return AudioMetadata('audio/ogg', duration, bitrate, length)
+
+
+def probe_audio(url):
+    """AudioMetadata for an enclosure URL, or None when it cannot be read or recognised"""
+    if not is_url_allowed(url):
+        logger.warning(f"Blocked audio probe of disallowed URL: {url}")
+        return None
+
+    fetcher = RangeFetcher(url)
+    try:
+        head = fetcher.fetch(0, HEAD_BYTES)
+        if not head:
+            return None
+
+        if head[4:8] == b'ftyp':
+            return parse_mp4(fetcher, head)
+
+        tail = fetcher.fetch(-TAIL_BYTES, TAIL_BYTES) if fetcher.length and fetcher.length > HEAD_BYTES else head
+        if head[:4] == b'OggS':
+            return parse_ogg(head, tail, fetcher.length)
+
+        audio_start = _id3v2_size(head)
+        if audio_start:
+            # Cover art can make the tag larger than the first read
+            head = head[audio_start:] if audio_start + 1024 < len(head) else fetcher.fetch(audio_start, HEAD_BYTES)
+        metadata = parse_mp3(head or b'', audio_start, fetcher.length, tail)
+        if metadata is not None:
+            return metadata
+    except Exception as e:
+        logger.warning(f"Audio probe failed for {url}: {e}")
+        return None
+
+    if fetcher.content_type and fetcher.content_type.startswith('audio/'):
+        return AudioMetadata(fetcher.content_type, None, None, fetcher.length)
+    return None
+
+
+def probe_pending_episodes(batch_size=PROBE_BATCH_SIZE):
+    """Probe episodes without enclosure metadata and store the results; returns the count probed"""
+    from app import db
+    from models import Episode
+    from sqlalchemy import select, update, or_, and_
+    from cache_manager import invalidate_feed_caches
+
+    now = datetime.utcnow()
+    rows = db.session.execute(
+        select(Episode.id, Episode.feed_id, Episode.resolved_audio_url, Episode.audio_url)
+        .where(or_(Episode.probed_at.is_(None),
+                   and_(Episode.enclosure_length.is_(None), Episode.probed_at < now - RETRY_FAILED_AFTER)))
+        .order_by(Episode.release_date.desc())
+        .limit(batch_size)
+    ).all()
+    db.session.commit()
+    if not rows:
+        return 0
+
+    urls = {row.resolved_audio_url or row.audio_url for row in rows}
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='audio-probe') as executor:
+        results = dict(zip(urls, executor.map(probe_audio, urls)))
+
+    updates = []
+    changed_feeds = set()
+    for row in rows:
+        metadata = results.get(row.resolved_audio_url or row.audio_url)
+        values = {'id': row.id, 'probed_at': now}
+        if metadata is not None:
+            values.update(enclosure_length=metadata.length, enclosure_type=metadata.mime_type,
+                          duration_seconds=round(metadata.duration_seconds) if metadata.duration_seconds else None,
+                          bitrate=metadata.bitrate)
+            changed_feeds.add(row.feed_id)
+        updates.append(values)
+
+    try:
+        db.session.execute(update(Episode), updates)
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error storing audio metadata: {e}")
+        db.session.rollback()
+        return 0
+
+    for feed_id in changed_feeds:
+        invalidate_feed_caches(feed_id)
+    logger.info(f"Probed audio metadata for {len(rows)} episodes ({len(urls)} URLs), "
+                f"{sum(1 for metadata in results.values() if metadata)} recognised")
+    return len(rows)
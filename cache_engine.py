@@ -0,0 +1,357 @@
+"""
+Byte-bounded, thread-safe in-process cache shared by every cache in the app
+
+Values are accounted by their estimated size in bytes rather than counted, so a
+budget holds thousands of small query results or a few dozen rendered feeds
+alike. Keys hash to one of several lock-striped segments, each an O(1) LRU
+with its own share of the budget. A new key is only admitted over the LRU
+victims it would evict if a TinyLFU frequency sketch has seen it more often
+than them, so a scan of one-off keys cannot flush the entries that keep being
+read. Entries may carry a TTL and expire lazily.
+
+Run `python cache_engine.py [threads] [seconds]` for contention and hit-rate
+microbenchmarks.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+ENTRY_OVERHEAD = 120  # bytes per entry for the OrderedDict node, entry tuple and bookkeeping
+_MISSING = object()
+
+Entry = namedtuple('Entry', ['value', 'size', 'expires_at'])
+
+# Every engine by name, for /cache/status
+_engines = {}
+
+
+def budget(name, default_mb):
+    """Byte budget for a cache, overridable with CACHE_<NAME>_MAX_MB"""
+    return int(float(os.environ.get(f'CACHE_{name.upper()}_MAX_MB', default_mb)) * MB)
+
+
+def estimate_size(value, _depth=0):
+    """Approximate bytes held by value, following containers a few levels deep"""
+    size = sys.getsizeof(value)
+    if _depth >= 4 or isinstance(value, (str, bytes, bytearray)):
+        return size
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return size + sum(estimate_size(item, _depth + 1) for item in value)
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    if hasattr(value, '__dict__'):
+        return size + estimate_size(vars(value), _depth + 1)
+    return size
+
+
+class FrequencySketch:
+    """Count-min sketch of recent key frequencies (TinyLFU)
+
+    Four 4-bit counters per key; after sample_size increments every counter is
+    halved, so the sketch favours keys that are popular now over keys that were.
+    """
+
+    DEPTH = 4
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    MAX_COUNT = 15
+
+    def __init__(self, width=1024):
+        self.width = 1 << max(4, (width - 1).bit_length())  # power of two, so indexes are a mask
+        self._mask = self.width - 1
+        self._table = bytearray(self.width * self.DEPTH)
+        self._additions = 0
+        self.sample_size = 10 * self.width
+
+    def _indexes(self, key):
+        h = hash(key)
+        for row, seed in enumerate(self.SEEDS):
+            mixed = ((h ^ (h >> 29)) * seed) & 0xFFFFFFFFFFFFFFFF
+            yield row * self.width + ((mixed >> 32) & self._mask)
+
+    def increment(self, key):
+        table = self._table
+        for i in self._indexes(key):
+            if table[i] < self.MAX_COUNT:
+                table[i] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._table = bytearray(count >> 1 for count in table)
+            self._additions //= 2
+
+    def frequency(self, key):
+        table = self._table
+        return min(table[i] for i in self._indexes(key))
+
+
+class _Segment:
+    """One lock, one LRU ordering and one slice of the byte budget"""
+
+    __slots__ = ('lock', 'entries', 'sketch', 'max_bytes', 'bytes', 'hits', 'misses', 'evictions',
+                 'expirations', 'rejections')
+
+    def __init__(self, max_bytes, sketch_width):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.sketch = FrequencySketch(sketch_width)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.rejections = 0
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        return entry
+
+
+class CacheEngine:
+    """Byte-bounded LRU with TinyLFU admission, lock striping and per-entry TTL
+
+    Reads feed the frequency sketch, so the usual get-miss-then-set pattern
+    counts a key once per request.
+
+    Also usable as a mapping: `key in cache`, `cache[key]`, `cache[key] = value`
+    and `cache.pop(key, default)`.
+    """
+
+    def __init__(self, name, max_bytes, stripes=8, default_ttl=None, sizeof=estimate_size, admission=True,
+                 sketch_width=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl  # seconds; None keeps entries until evicted
+        self.sizeof = sizeof
+        # False makes it a plain LRU: right for values that cost real work and are
+        # stored just as a reader asked for them, which TinyLFU would turn away
+        self.admission = admission
+        # Counters per sketch row: a few per entry that fits, so collisions stay rare
+        width = sketch_width or min(65536, max(64, max_bytes // stripes // 256))
+        self._segments = tuple(_Segment(max_bytes // stripes, width) for _ in range(stripes))
+        _engines[name] = self
+
+    def _segment(self, key):
+        return self._segments[hash(key) % len(self._segments)]
+
+    def get(self, key, default=None):
+        segment = self._segment(key)
+        with segment.lock:
+            segment.sketch.increment(key)
+            entry = segment.entries.get(key)
+            if entry is not None:
+                if entry.expires_at is None or entry.expires_at > time.monotonic():
+                    segment.entries.move_to_end(key)
+                    segment.hits += 1
+                    return entry.value
+                segment.remove(key)
+                segment.expirations += 1
+            segment.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store value; False if it was too large or not admitted over the entries it would evict"""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = self.sizeof(key) + self.sizeof(value) + ENTRY_OVERHEAD
+        segment = self._segment(key)
+        with segment.lock:
+            now = time.monotonic()
+            replacing = key in segment.entries
+            if replacing:
+                # The old value must not outlive a rejected replacement
+                segment.remove(key)
+
+            if size > segment.max_bytes:
+                segment.rejections += 1
+                return False
+
+            victims = self._victims(segment, size, now)
+            if self.admission and not replacing and victims:
+                # TinyLFU: a newcomer only displaces live entries it is more popular than
+                frequency = segment.sketch.frequency(key)
+                if any(not expired and segment.sketch.frequency(victim) >= frequency
+                       for victim, expired in victims):
+                    segment.rejections += 1
+                    return False
+
+            for victim, expired in victims:
+                segment.remove(victim)
+                if expired:
+                    segment.expirations += 1
+                else:
+                    segment.evictions += 1
+            segment.entries[key] = Entry(value, size, None if ttl is None else now + ttl)
+            segment.bytes += size
+            return True
+
+    @staticmethod
+    def _victims(segment, size, now):
+        """(key, expired) pairs from the LRU end that must go to make room for size bytes"""
+        needed = segment.bytes + size - segment.max_bytes
+        victims = []
+        for victim, entry in segment.entries.items():
+            if needed <= 0:
+                break
+            victims.append((victim, entry.expires_at is not None and entry.expires_at <= now))
+            needed -= entry.size
+        return victims
+
+    def pop(self, key, default=None):
+        segment = self._segment(key)
+        with segment.lock:
+            if key not in segment.entries:
+                return default
+            entry = segment.remove(key)
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            return default
+        return entry.value
+
+    def invalidate(self, key):
+        self.pop(key)
+
+    def clear(self):
+        for segment in self._segments:
+            with segment.lock:
+                segment.entries.clear()
+                segment.bytes = 0
+
+    def __contains__(self, key):
+        # A membership test neither counts as a use nor refreshes the LRU position
+        segment = self._segment(key)
+        with segment.lock:
+            entry = segment.entries.get(key)
+            return entry is not None and (entry.expires_at is None or entry.expires_at > time.monotonic())
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __len__(self):
+        return sum(len(segment.entries) for segment in self._segments)
+
+    def stats(self):
+        totals = {'entries': 0, 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                  'rejections': 0}
+        for segment in self._segments:
+            with segment.lock:
+                totals['entries'] += len(segment.entries)
+                totals['bytes'] += segment.bytes
+                for counter in ('hits', 'misses', 'evictions', 'expirations', 'rejections'):
+                    totals[counter] += getattr(segment, counter)
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = round(totals['hits'] / lookups, 3) if lookups else None
+        totals['max_bytes'] = self.max_bytes
+        totals['stripes'] = len(self._segments)
+        return totals
+
+
+def cache_stats():
+    return {name: engine.stats() for name, engine in _engines.items()}
+
+
+def _contention_benchmark(threads, seconds, stripes):
+    """Operations per second with threads hammering one engine, 90% reads over a Zipf-like key set"""
+    import random
+
+    engine = CacheEngine(f'bench-contention-{stripes}', 64 * MB, stripes=stripes)
+    keys = [f'key-{n}' for n in range(10000)]
+    for key in keys:
+        engine.set(key, b'x' * 256)
+    counts = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def worker(n):
+        rng = random.Random(n)
+        done = 0
+        while time.monotonic() < deadline:
+            for _ in range(1000):
+                key = keys[int(len(keys) * rng.random() ** 3)]
+                if rng.random() < 0.9:
+                    engine.get(key)
+                else:
+                    engine.set(key, b'x' * 256)
+            done += 1000
+        counts[n] = done
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    _engines.pop(engine.name, None)
+    return sum(counts) / seconds
+
+
+def _hit_rate_benchmark(admission):
+    """Hit rate on a skewed workload interrupted by scans of one-off keys"""
+    import random
+
+    rng = random.Random(1)
+    engine = CacheEngine(f'bench-hits-{admission}', 2 * MB, stripes=4, admission=admission)
+    hits = lookups = 0
+    for n in range(200000):
+        if n % 1000 < 200:
+            key = f'scan-{n}'  # crawler-style one-off keys
+        else:
+            key = f'hot-{int(20000 * rng.random() ** 4)}'
+        lookups += 1
+        if engine.get(key) is not None:
+            hits += 1
+        else:
+            engine.set(key, b'x' * 1024)
+    _engines.pop(engine.name, None)
+    return hits / lookups
+
+
+def _fresh_key_benchmark(admission):
+    """Renders per new key when new keys are read repeatedly right after they are stored
+
+    Models new or just-invalidated feeds: each is polled several times soon after
+    its first render while popular feeds keep the cache full.
+    """
+    import random
+
+    rng = random.Random(2)
+    engine = CacheEngine(f'bench-fresh-{admission}', 2 * MB, stripes=4, admission=admission)
+    value = b'x' * 16 * 1024  # a rendered feed
+    renders = fresh = 0
+    recent = []
+    for n in range(100000):
+        if n % 50 == 0:
+            recent = (recent + [f'new-{n}'])[-5:]
+            fresh += 1
+        if rng.random() < 0.3:
+            key = rng.choice(recent)
+            if engine.get(key) is None:
+                renders += 1
+                engine.set(key, value)
+        else:
+            key = f'hot-{int(500 * rng.random() ** 3)}'
+            if engine.get(key) is None:
+                engine.set(key, value)
+    _engines.pop(engine.name, None)
+    return renders / fresh
+
+
+def run_benchmark(threads=8, seconds=2.0):
+    print(f"Contention: {threads} threads for {seconds}s, 90% get / 10% set")
+    for stripes in (1, 4, 16):
+        print(f"  {stripes:>2} stripes: {_contention_benchmark(threads, seconds, stripes):>12,.0f} ops/s")
+    print("Hit rate: skewed reads with 20% one-off scan keys, 2 MB budget")
+    print(f"  LRU only:         {_hit_rate_benchmark(False):.3f}")
+    print(f"  LRU with TinyLFU: {_hit_rate_benchmark(True):.3f}")
+    print("Renders per new key polled right after its first render, 16 KB values, 2 MB budget")
+    print(f"  LRU only:         {_fresh_key_benchmark(False):.2f}")
+    print(f"  LRU with TinyLFU: {_fresh_key_benchmark(True):.2f}")
+
+
+if __name__ == '__main__':
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+                  float(sys.argv[2]) if len(sys.argv) > 2 else 2.0)
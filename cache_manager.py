@@ -3,62 +3,32 @@ Advanced caching to reduce database compute usage
 """
 import logging
 from functools import wraps, lru_cache
-from datetime import datetime, timedelta
 import pytz
 from flask import g
+from cache_engine import CacheEngine, budget
+from invalidation_log import invalidation_log
 
 logger = logging.getLogger(__name__)
 
 class CacheManager:
     """Manages application-level caching to reduce database queries"""
     
-    _cache = {}
-    _cache_timestamps = {}
+    _cache = CacheEngine('app', budget('app', 16), default_ttl=30 * 60)
     
     @classmethod
     def get(cls, key, default=None):
         """Get cached value if not expired"""
-        if key in cls._cache and key in cls._cache_timestamps:
-            # Check if cache is still valid (30 minutes default)
-            cache_time = cls._cache_timestamps[key]
-            if datetime.now() - cache_time < timedelta(minutes=30):
-                return cls._cache[key]
-            else:
-                # Remove expired cache
-                cls._cache.pop(key, None)
-                cls._cache_timestamps.pop(key, None)
-        return default
+        return cls._cache.get(key, default)
     
     @classmethod
     def set(cls, key, value, ttl_minutes=30):
         """Set cached value with TTL"""
-        cls._cache[key] = value
-        cls._cache_timestamps[key] = datetime.now()
-        
-        # Clean up old cache entries periodically
-        if len(cls._cache) > 100:
-            cls._cleanup_expired()
-    
-    @classmethod
-    def _cleanup_expired(cls):
-        """Remove expired cache entries"""
-        now = datetime.now()
-        expired_keys = [
-            key for key, timestamp in cls._cache_timestamps.items()
-            if now - timestamp > timedelta(minutes=10)
-        ]
-        
-        for key in expired_keys:
-            cls._cache.pop(key, None)
-            cls._cache_timestamps.pop(key, None)
-        
-        logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        cls._cache.set(key, value, ttl=ttl_minutes * 60)
     
     @classmethod
     def clear(cls):
         """Clear all cache"""
         cls._cache.clear()
-        cls._cache_timestamps.clear()
 
 def cache_result(ttl_minutes=5):
     """Decorator to cache function results"""
@@ -84,46 +54,68 @@ def cache_result(ttl_minutes=5):
 class RSSCacheManager:
     """Specialized caching for RSS feeds"""
     
-    _rss_cache = {}
-    _rss_timestamps = {}
+    # RSS feeds cached for 24 hours to minimize compute requests; a few large
+    # values per feed, so fewer stripes keep each stripe's budget roomy. Every value
+    # was just rendered for a reader, and a new or edited feed has too few reads to
+    # win TinyLFU admission, so this cache is plain LRU (`python cache_engine.py`)
+    _rss_cache = CacheEngine('rss', budget('rss', 64), stripes=4, default_ttl=24 * 60 * 60, admission=False)
     
     @classmethod
     def get_feed_cache(cls, feed_id):
-        """Get cached RSS feed content"""
-        if feed_id in cls._rss_cache and feed_id in cls._rss_timestamps:
-            cache_time = cls._rss_timestamps[feed_id]
-            # RSS feeds cached for 24 hours to minimize compute requests
-            if datetime.now() - cache_time < timedelta(hours=24):
-                return cls._rss_cache[feed_id]
-            else:
-                cls._rss_cache.pop(feed_id, None)
-                cls._rss_timestamps.pop(feed_id, None)
-        return None
+        """Get the cached RenderedFeed (plain and gzip bytes)"""
+        return cls._rss_cache.get(feed_id)
     
     @classmethod
     def set_feed_cache(cls, feed_id, content):
-        """Cache RSS feed content"""
-        cls._rss_cache[feed_id] = content
-        cls._rss_timestamps[feed_id] = datetime.now()
-        
-        # Limit cache size
-        if len(cls._rss_cache) > 50:
-            cls._cleanup_old_feeds()
-    
-    @classmethod
-    def _cleanup_old_feeds(cls):
-        """Remove oldest cached feeds"""
-        if not cls._rss_timestamps:
-            return
-            
-        # Remove oldest 10 entries
-        sorted_feeds = sorted(cls._rss_timestamps.items(), key=lambda x: x[1])
-        for feed_id, _ in sorted_feeds[:10]:
-            cls._rss_cache.pop(feed_id, None)
-            cls._rss_timestamps.pop(feed_id, None)
+        """Cache a RenderedFeed"""
+        cls._rss_cache.set(feed_id, content)
     
     @classmethod
     def invalidate_feed(cls, feed_id):
         """Invalidate specific feed cache"""
-        cls._rss_cache.pop(feed_id, None)
-        cls._rss_timestamps.pop(feed_id, None)
\ No newline at end of file
+        cls._rss_cache.invalidate(feed_id)
+
+    @classmethod
+    def clear(cls):
+        cls._rss_cache.clear()
+
+def invalidate_feed_caches(feed_id):
+    """Drop every cached rendering of a feed after its content changes
+
+    Call only after the change is committed: a render that snapshots the feed
+    between this call and the commit would read the old rows under the new
+    version and be cached as current. The other workers on this host drop
+    theirs on their next request (see invalidation_log.py).
+    """
+    from cdn_purge import purge_feed
+
+    _invalidate_local_feed_caches(feed_id)
+    invalidation_log.publish('feed', feed_id)
+    # Edge caches hold the feed until the next refresh unless told otherwise
+    purge_feed(feed_id)
+
+def _invalidate_local_feed_caches(feed_id):
+    """Drop a feed from this process's caches"""
+    from feed_generator import _feed_cache
+    from render_service import render_service
+    from slug_index import slug_index
+
+    # Renders already in the pool must not repopulate the caches with old content
+    render_service.invalidate(feed_id)
+    RSSCacheManager.invalidate_feed(feed_id)
+    slug_index.invalidate_feed(feed_id)
+    if _feed_cache.pop(feed_id, None) is not None:
+        logger.info(f"Cleared RSS feed cache for feed_id: {feed_id}")
+
+def _clear_local_feed_caches():
+    """Drop every feed from this process's caches"""
+    from feed_generator import _feed_cache
+    from render_service import render_service
+    from slug_index import slug_index
+
+    render_service.invalidate_all()
+    RSSCacheManager.clear()
+    slug_index.invalidate_all()
+    _feed_cache.clear()
+
+invalidation_log.subscribe('feed', lambda key: _invalidate_local_feed_caches(int(key)), _clear_local_feed_caches)
@@ -0,0 +1,141 @@
+"""
+Surrogate keys and purge hooks for edge caches in front of the RSS endpoint
+
+Feed responses carry a Surrogate-Key naming the feed and its owner. Whenever a
+feed's caches are invalidated its key is queued for purging, and a background
+thread hands batches of keys to every registered hook, so edits never wait on
+the CDN. With CDN_PURGE_URL set, the built-in hook POSTs the keys there.
+Run `python cdn_purge.py [port]` for a local purge endpoint that logs what it receives.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CDN_PURGE_URL = os.environ.get('CDN_PURGE_URL')
+CDN_PURGE_TOKEN = os.environ.get('CDN_PURGE_TOKEN')
+BATCH_WINDOW = 0.5  # seconds to gather keys, so a burst of edits becomes one purge
+MAX_BATCH = 256
+
+
+def feed_key(feed_id):
+    return f'feed-{feed_id}'
+
+
+def user_key(user_id):
+    return f'user-{user_id}'
+
+
+def surrogate_keys(header):
+    """Surrogate-Key header value for a feed's slug index header"""
+    return f'{feed_key(header.id)} {user_key(header.user_id)}'
+
+
+def post_purge(keys):
+    """Default hook: POST the keys to CDN_PURGE_URL (Fastly-style Surrogate-Key header plus a JSON body)"""
+    from http_client import http_client
+
+    headers = {'Surrogate-Key': ' '.join(keys), 'Content-Type': 'application/json'}
+    if CDN_PURGE_TOKEN:
+        headers['Authorization'] = f'Bearer {CDN_PURGE_TOKEN}'
+    response = http_client.post(CDN_PURGE_URL, headers=headers, data=json.dumps({'surrogate_keys': keys}))
+    response.raise_for_status()
+
+
+class PurgeQueue:
+    """Deduplicates surrogate keys and purges them from a background thread"""
+
+    def __init__(self):
+        self.hooks = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'purged': 0, 'batches': 0, 'failed': 0}
+
+    def register(self, hook):
+        """hook(keys) is called with a list of surrogate keys; exceptions are logged"""
+        self.hooks.append(hook)
+        return hook
+
+    def purge(self, *keys):
+        if not self.hooks:
+            return
+        self._ensure_thread()
+        for key in keys:
+            self._queue.put(key)
+        self.stats['queued'] += len(keys)
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork; each worker starts its own
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._loop, name='cdn-purge', daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+
+    def _loop(self):
+        while True:
+            keys = [self._queue.get()]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(keys) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    keys.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send(sorted(set(keys)))
+
+    def _send(self, keys):
+        self.stats['batches'] += 1
+        for hook in list(self.hooks):
+            try:
+                hook(keys)
+                self.stats['purged'] += len(keys)
+            except Exception as e:
+                self.stats['failed'] += len(keys)
+                logger.warning(f"CDN purge of {len(keys)} keys failed: {e}")
+
+
+# Global instance
+purge_queue = PurgeQueue()
+
+if CDN_PURGE_URL:
+    purge_queue.register(post_purge)
+
+
+def purge_feed(feed_id):
+    purge_queue.purge(feed_key(feed_id))
+
+
+def run_stub_server(port=8791):
+    """Local purge endpoint that logs each request's surrogate keys, for trying CDN_PURGE_URL out"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class PurgeHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            print(f"purge {self.path} keys={self.headers.get('Surrogate-Key')} body={body.decode('utf-8', 'replace')}",
+                  flush=True)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Stub purge endpoint on http://127.0.0.1:{port}/purge", flush=True)
+    ThreadingHTTPServer(('127.0.0.1', port), PurgeHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    import sys
+    run_stub_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8791)
@@ -30,9 +30,10 @@ class ConnectionManager:
         """Context manager for efficient database sessions"""
         session = db.session
         try:
-            # Enable query optimizations at session level
-            session.execute(text("SET SESSION statement_timeout = '30s'"))  # Prevent long-running queries
-            session.execute(text("SET SESSION idle_in_transaction_session_timeout = '60s'"))  # Close idle transactions
+            # Enable query optimizations at session level (PostgreSQL settings)
+            if db.engine.dialect.name == 'postgresql':
+                session.execute(text("SET SESSION statement_timeout = '30s'"))  # Prevent long-running queries
+                session.execute(text("SET SESSION idle_in_transaction_session_timeout = '60s'"))  # Close idle transactions
             yield session
             session.commit()
         except Exception as e:
@@ -0,0 +1,454 @@
+"""
+Streaming CSV episode import with incremental decoding and batched inserts
+"""
+import codecs
+import csv
+import io
+import logging
+import shutil
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from app import db
+from models import Episode, EpisodeArchive
+from sqlalchemy import bindparam, func, insert, inspect as sa_inspect, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from url_resolvers import normalize_url
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ('title', 'description', 'audio_url', 'release_date', 'is_recurring')
+
+# utf-8-sig also strips the BOM Excel adds; latin-1 decodes anything so it is the last resort
+ENCODING_CANDIDATES = ('utf-8-sig', 'windows-1252', 'latin-1')
+SNIFF_BYTES = 64 * 1024
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M')
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+# Rows repeating an audio URL within this many distinct URLs of its first use are
+# reported as errors; repeats further apart are left to the database
+SEEN_URL_WINDOW = 50000
+
+# Created by migration 4 once no feed has two episodes with one audio URL
+UNIQUE_AUDIO_URL_INDEX = 'uq_episode_feed_audio_url'
+
+# append: insert new episodes, skip ones already in the feed
+# upsert: also update existing episodes whose content changed
+IMPORT_MODES = ('append', 'upsert')
+
+TITLE_MAX_LENGTH = Episode.__table__.c.title.type.length
+AUDIO_URL_MAX_LENGTH = Episode.__table__.c.audio_url.type.length
+
+
+def _legacy_byte_fallback(error):
+    """Decode bytes a UTF-8 stream rejects as windows-1252 (latin-1 for its undefined bytes)"""
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    replacement = ''.join(
+        byte.to_bytes(1, 'big').decode('windows-1252', errors='ignore') or chr(byte)
+        for byte in error.object[error.start:error.end]
+    )
+    return replacement, error.end
+
+
+# Only the first SNIFF_BYTES decide the encoding; if a file that looked like UTF-8
+# later contains stray legacy bytes they are decoded as windows-1252 rather than dropped
+codecs.register_error('csv_import_legacy_fallback', _legacy_byte_fallback)
+
+
+def has_unique_audio_url_index():
+    """True once the (feed_id, audio_url) unique index exists, which ON CONFLICT needs"""
+    return any(index['name'] == UNIQUE_AUDIO_URL_INDEX
+               for index in sa_inspect(db.session.connection()).get_indexes('episode'))
+
+
+def detect_encoding(sample):
+    """Pick the first candidate encoding that decodes the sample without errors"""
+    for encoding in ENCODING_CANDIDATES:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            # final=False tolerates a multi-byte character cut off at the sample boundary
+            decoder.decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            logger.debug(f"CSV sample is not valid {encoding}, trying next encoding")
+    return ENCODING_CANDIDATES[-1]
+
+
+class DateFormatDetector:
+    """Parses release dates, locking onto the first format that matches"""
+
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = formats
+        self.locked_format = None
+
+    def parse(self, value):
+        if self.locked_format:
+            try:
+                return datetime.strptime(value, self.locked_format)
+            except ValueError:
+                pass
+
+        for date_format in self.formats:
+            if date_format == self.locked_format:
+                continue
+            try:
+                parsed = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            if self.locked_format is None:
+                self.locked_format = date_format
+                logger.info(f"CSV import locked date format to {date_format}")
+            return parsed
+
+        raise ValueError(f"Could not parse date: {value}")
+
+
+class ImportReport:
+    """Outcome of an import: counts plus the first few per-row errors"""
+
+    def __init__(self):
+        self.rows_processed = 0
+        self.added = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self.encoding = None
+        self.date_format = None
+
+    def record_error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def summary(self, limit=3):
+        """Short human-readable description of the first errors"""
+        return '; '.join(f"row {line}: {message}" for line, message in self.errors[:limit])
+
+    def to_dict(self):
+        return {
+            'rows_processed': self.rows_processed,
+            'added': self.added,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+            'encoding': self.encoding,
+            'date_format': self.date_format,
+        }
+
+
+class EpisodeCSVImporter:
+    """Imports episodes from a CSV byte stream without loading it into memory
+
+    Rows are written with set-based INSERT ... ON CONFLICT (feed_id, audio_url)
+    batches, so re-uploading the same file never duplicates episodes. Until
+    migration 4 has created the unique index ON CONFLICT cannot be used, so each
+    batch looks up the URLs the feed already has and inserts only the others.
+    """
+
+    def __init__(self, feed_id, mode='append', batch_size=BATCH_SIZE, progress_callback=None):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f"Unknown import mode: {mode}")
+        self.feed_id = feed_id
+        self.mode = mode
+        self.use_on_conflict = has_unique_audio_url_index()
+        if not self.use_on_conflict:
+            logger.warning(f"Index {UNIQUE_AUDIO_URL_INDEX} is missing (migration 4 deferred); importing "
+                           f"feed {feed_id} by looking up existing audio URLs per batch")
+        self.statement = self._build_statement()
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self.dates = DateFormatDetector()
+        self.report = ImportReport()
+        self._seen_urls = OrderedDict()  # audio URL -> first line that used it, last SEEN_URL_WINDOW only
+
+    def run(self, binary_stream):
+        """Decode, parse and insert every row of the stream; returns an ImportReport"""
+        spooled = None
+        if not binary_stream.seekable():
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(binary_stream, spooled)
+            binary_stream = spooled
+        binary_stream.seek(0)
+
+        try:
+            sample = binary_stream.read(SNIFF_BYTES)
+            binary_stream.seek(0)
+            self.report.encoding = detect_encoding(sample)
+            logger.info(f"Importing CSV for feed {self.feed_id} with {self.report.encoding} encoding")
+
+            text_stream = io.TextIOWrapper(binary_stream, encoding=self.report.encoding,
+                                           errors='csv_import_legacy_fallback', newline='')
+            try:
+                self._import_rows(csv.DictReader(text_stream))
+            finally:
+                # Leave the caller's stream open
+                text_stream.detach()
+        finally:
+            if spooled is not None:
+                spooled.close()
+
+        self.report.date_format = self.dates.locked_format
+        return self.report
+
+    def _import_rows(self, reader):
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+        batch = []
+        for row in reader:
+            self.report.rows_processed += 1
+            try:
+                batch.append((reader.line_num, self._row_values(row)))
+            except (ValueError, AttributeError) as e:
+                self.report.record_error(reader.line_num, str(e))
+
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+
+        if batch:
+            self._flush(batch)
+
+    def _row_values(self, row):
+        title = (row.get('title') or '').strip()
+        if not title:
+            raise ValueError("Missing title")
+        if len(title) > TITLE_MAX_LENGTH:
+            raise ValueError(f"Title longer than {TITLE_MAX_LENGTH} characters")
+
+        audio_url = normalize_url((row.get('audio_url') or '').strip())
+        if not audio_url:
+            raise ValueError("Missing audio_url")
+        if len(audio_url) > AUDIO_URL_MAX_LENGTH:
+            raise ValueError(f"audio_url longer than {AUDIO_URL_MAX_LENGTH} characters")
+
+        description = (row.get('description') or '').strip()
+        release_date = self.dates.parse((row.get('release_date') or '').strip())
+        is_recurring = (row.get('is_recurring') or '').strip().upper() == 'TRUE'
+
+        return {
+            'feed_id': self.feed_id,
+            'title': title,
+            'description': description,
+            'audio_url': audio_url,
+            'resolved_audio_url': normalize_url(audio_url),
+            'release_date': release_date,
+            'is_recurring': is_recurring,
+            'content_hash': Episode.compute_content_hash(title, description, release_date, is_recurring),
+        }
+
+    def _build_statement(self):
+        """INSERT ... ON CONFLICT (feed_id, audio_url) for the configured dialect"""
+        table = Episode.__table__
+        dialect = db.engine.dialect.name
+        if not self.use_on_conflict:
+            return insert(table)
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            logger.warning(f"No ON CONFLICT support for dialect {dialect}, using existing URL lookups")
+            self.use_on_conflict = False
+            return insert(table)
+
+        statement = dialect_insert(table)
+        conflict_key = [table.c.feed_id, table.c.audio_url]
+        if self.mode == 'upsert':
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=conflict_key,
+                set_={
+                    'title': excluded.title,
+                    'description': excluded.description,
+                    'resolved_audio_url': excluded.resolved_audio_url,
+                    'release_date': excluded.release_date,
+                    'is_recurring': excluded.is_recurring,
+                    'content_hash': excluded.content_hash,
+                },
+                # Unchanged rows are left alone: no write, no dead tuple, not returned
+                where=table.c.content_hash.is_distinct_from(excluded.content_hash),
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=conflict_key)
+        return statement.returning(table.c.audio_url)
+
+    def _dedupe(self, batch):
+        """Drop rows repeating an audio URL used earlier in the file, reporting each as a row error"""
+        unique = []
+        for line_number, values in batch:
+            first = self._seen_urls.get(values['audio_url'])
+            if first is not None:
+                self.report.record_error(line_number, f"audio_url is already used by row {first}; "
+                                                      "each episode in a feed needs its own audio URL")
+                continue
+            self._seen_urls[values['audio_url']] = line_number
+            if len(self._seen_urls) > SEEN_URL_WINDOW:
+                self._seen_urls.popitem(last=False)
+            unique.append((line_number, values))
+        return unique
+
+    def _skip_archived(self, batch):
+        """Skip rows whose episode was archived: a second hot copy would be archived twice later"""
+        if not batch:
+            return batch
+        archived = set(db.session.execute(
+            select(EpisodeArchive.audio_url).where(EpisodeArchive.feed_id == self.feed_id,
+                                                   EpisodeArchive.audio_url.in_([v['audio_url'] for _, v in batch]))
+        ).scalars())
+        if not archived:
+            return batch
+        self.report.skipped += sum(1 for _, values in batch if values['audio_url'] in archived)
+        return [(line_number, values) for line_number, values in batch if values['audio_url'] not in archived]
+
+    def _existing_urls(self, urls):
+        """Audio URLs from this chunk that the feed already has"""
+        if self.mode != 'upsert':
+            return set()
+        rows = db.session.execute(
+            select(Episode.audio_url).where(Episode.feed_id == self.feed_id, Episode.audio_url.in_(urls))
+        )
+        return {row[0] for row in rows}
+
+    def _apply(self, rows):
+        """Run the set-based statement for some rows and tally what it changed"""
+        if not self.use_on_conflict:
+            self._apply_without_index(rows)
+            return
+        existing = self._existing_urls([values['audio_url'] for _, values in rows])
+        result = db.session.execute(self.statement, [values for _, values in rows])
+        changed = {row[0] for row in result}
+
+        updated = len(changed & existing)
+        self.report.updated += updated
+        self.report.added += len(changed) - updated
+        self.report.skipped += len(rows) - len(changed)
+
+    def _apply_without_index(self, rows):
+        """Insert rows whose URL the feed lacks; upsert mode updates URLs held by exactly one episode"""
+        table = Episode.__table__
+        existing = {
+            row.audio_url: (row.episodes, row.content_hash)
+            for row in db.session.execute(
+                select(table.c.audio_url, func.count().label('episodes'),
+                       func.max(table.c.content_hash).label('content_hash'))
+                .where(table.c.feed_id == self.feed_id,
+                       table.c.audio_url.in_([values['audio_url'] for _, values in rows]))
+                .group_by(table.c.audio_url)
+            )
+        }
+
+        new_rows = [values for _, values in rows if values['audio_url'] not in existing]
+        if new_rows:
+            db.session.execute(self.statement, new_rows)
+            self.report.added += len(new_rows)
+
+        changed = []
+        for line_number, values in rows:
+            if values['audio_url'] not in existing:
+                continue
+            episodes, content_hash = existing[values['audio_url']]
+            if self.mode != 'upsert' or content_hash == values['content_hash']:
+                self.report.skipped += 1
+            elif episodes > 1:
+                self.report.record_error(line_number, f"audio_url is shared by {episodes} episodes of this feed; "
+                                                      "give them separate audio URLs before updating by import")
+            else:
+                changed.append(values)
+        if changed:
+            db.session.execute(
+                update(table)
+                .where(table.c.feed_id == bindparam('match_feed_id'),
+                       table.c.audio_url == bindparam('match_audio_url'))
+                .values(title=bindparam('title'), description=bindparam('description'),
+                        release_date=bindparam('release_date'), is_recurring=bindparam('is_recurring'),
+                        content_hash=bindparam('content_hash')),
+                [dict(values, match_feed_id=values['feed_id'], match_audio_url=values['audio_url'])
+                 for values in changed]
+            )
+            self.report.updated += len(changed)
+
+    def _flush(self, batch):
+        """Write one chunk inside a savepoint, isolating bad rows if the chunk fails"""
+        batch = self._skip_archived(self._dedupe(batch))
+        if batch:
+            try:
+                with db.session.begin_nested():
+                    self._apply(batch)
+            except SQLAlchemyError as e:
+                logger.warning(f"Batch import failed for feed {self.feed_id}, retrying row by row: {e}")
+                for line_number, values in batch:
+                    try:
+                        with db.session.begin_nested():
+                            self._apply([(line_number, values)])
+                    except SQLAlchemyError as row_err:
+                        self.report.record_error(line_number, str(getattr(row_err, 'orig', row_err)))
+
+        db.session.commit()
+
+        if self.progress_callback:
+            self.progress_callback(self.report)
+
+
+def _write_benchmark_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(REQUIRED_COLUMNS)
+        for n in range(rows):
+            writer.writerow([f'Episode {n}', f'Description of imported episode {n} with a few more words in it',
+                             f'https://www.dropbox.com/s/bench{n}/episode{n}.mp3?dl=0',
+                             f'2024-{1 + n % 12:02d}-{1 + n % 28:02d} 06:00', 'TRUE' if n % 50 == 0 else 'FALSE'])
+
+
+def run_benchmark(rows=100000):
+    """Import a generated CSV into a scratch feed of DATABASE_URL; reports throughput and peak memory"""
+    import os
+    import resource
+    import time
+    from app import app
+    from models import Feed, User
+    from sqlalchemy import delete
+
+    # The app logs at DEBUG; keep the report readable
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        path = os.path.join(directory, 'episodes.csv')
+        _write_benchmark_csv(path, rows)
+        print(f"{rows:,} rows, {os.path.getsize(path) / 1024 / 1024:.0f} MB CSV")
+
+        marker = f'csv-benchmark-{os.getpid()}'
+        user = User(name='CSV benchmark', email=f'{marker}@example.com', google_id=marker)
+        db.session.add(user)
+        db.session.flush()
+        feed = Feed(user_id=user.id, name='CSV benchmark', description='', url_slug=marker)
+        db.session.add(feed)
+        db.session.commit()
+        feed_id, user_id = feed.id, user.id
+
+        try:
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time.perf_counter()
+            with open(path, 'rb') as f:
+                report = EpisodeCSVImporter(feed_id).run(f)
+            elapsed = time.perf_counter() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            print(f"  {report.added:,} added, {report.failed} failed in {elapsed:.1f}s: {rows / elapsed:,.0f} rows/s")
+            # ru_maxrss is in KiB on Linux
+            print(f"  peak RSS {peak / 1024:.0f} MB, {(peak - baseline) / 1024:.0f} MB above the process before the import")
+        finally:
+            db.session.rollback()
+            db.session.execute(delete(Episode).where(Episode.feed_id == feed_id))
+            db.session.execute(delete(Feed).where(Feed.id == feed_id))
+            db.session.execute(delete(User).where(User.id == user_id))
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    import sys
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -2,8 +2,6 @@
 Database ping utility to keep Supabase active with daily health checks
 """
 import logging
-import threading
-import time
 from datetime import datetime, timedelta
 import pytz
 from app import app, db
@@ -12,43 +10,12 @@ from sqlalchemy import text
 logger = logging.getLogger(__name__)
 
 class DatabasePinger:
-    """Manages periodic database pings to prevent Supabase from going inactive"""
+    """Database pings to prevent Supabase from going inactive; scheduled by scheduler.py"""
     
     def __init__(self):
-        self.running = False
-        self.thread = None
         self.timezone = pytz.timezone('America/Los_Angeles')
-        
-    def start_daily_ping(self):
-        """Start the daily ping service in a background thread"""
-        if self.running:
-            return
-            
-        self.running = True
-        self.thread = threading.Thread(target=self._ping_loop, daemon=True)
-        self.thread.start()
-        logger.info("Database ping service started - pings every 24 hours")
-        
-    def stop_ping(self):
-        """Stop the ping service"""
-        self.running = False
-        if self.thread:
-            self.thread.join()
-        logger.info("Database ping service stopped")
-        
-    def _ping_loop(self):
-        """Main loop that pings the database every 24 hours"""
-        while self.running:
-            try:
-                self._perform_ping()
-                # Wait 24 hours (86400 seconds) before next ping
-                time.sleep(86400)
-            except Exception as e:
-                logger.error(f"Error in ping loop: {e}")
-                # Wait 1 hour before retrying on error
-                time.sleep(3600)
-                
-    def _perform_ping(self):
+
+    def perform_ping(self):
         """Perform a lightweight database ping"""
         try:
             with app.app_context():
@@ -113,11 +80,3 @@ class DatabasePinger:
 
 # Global instance
 database_pinger = DatabasePinger()
-
-def start_database_ping_service():
-    """Start the database ping service"""
-    database_pinger.start_daily_ping()
-
-def stop_database_ping_service():
-    """Stop the database ping service"""
-    database_pinger.stop_ping()
\ No newline at end of file
@@ -2,10 +2,12 @@
 Database monitoring and optimization utilities
 """
 import logging
+import threading
 import time
 from datetime import datetime, timedelta
+from flask import g, has_request_context, request
 from app import db
-from sqlalchemy import text
+from sqlalchemy import event, text
 
 logger = logging.getLogger(__name__)
 
@@ -54,6 +56,11 @@ class DatabaseMonitor:
     @classmethod
     def monitor_connections(cls):
         """Monitor active database connections"""
+        if db.engine.dialect.name != 'postgresql':
+            # Embedded SQLite: the connections this process has checked out of its pool
+            checkedout = getattr(db.engine.pool, 'checkedout', None)
+            cls._connection_count = checkedout() if checkedout else 0
+            return cls._connection_count
         try:
             result = db.session.execute(text("""
                 SELECT count(*) as active_connections 
@@ -76,6 +83,8 @@ class DatabaseMonitor:
     @classmethod
     def optimize_settings(cls):
         """Apply database optimization settings"""
+        if db.engine.dialect.name != 'postgresql':
+            return  # SQLite is tuned by pragmas on connect (sqlite_backend.py)
         try:
             # Apply session-level optimizations
             optimizations = [
@@ -96,6 +105,8 @@ class DatabaseMonitor:
     @classmethod
     def cleanup_idle_connections(cls):
         """Terminate idle connections to reduce compute usage"""
+        if db.engine.dialect.name != 'postgresql':
+            return
         try:
             # Find and terminate idle connections older than 5 minutes
             result = db.session.execute(text("""
@@ -113,6 +124,47 @@ class DatabaseMonitor:
         except Exception as e:
             logger.error(f"Error cleaning up connections: {e}")
 
+class RequestQueryStats:
+    """Queries issued per request, aggregated by endpoint"""
+
+    _lock = threading.Lock()
+    _endpoints = {}
+
+    @classmethod
+    def record(cls, endpoint, count):
+        with cls._lock:
+            requests, queries, peak = cls._endpoints.get(endpoint, (0, 0, 0))
+            cls._endpoints[endpoint] = (requests + 1, queries + count, max(peak, count))
+
+    @classmethod
+    def report(cls):
+        with cls._lock:
+            return {
+                endpoint: {
+                    'requests': requests,
+                    'avg_queries': round(queries / requests, 2),
+                    'max_queries': peak,
+                }
+                for endpoint, (requests, queries, peak) in sorted(cls._endpoints.items())
+            }
+
+
+def install_query_counter(app):
+    """Count statements per request with a before_cursor_execute hook; call inside an app context"""
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+    @app.after_request
+    def record_query_count(response):
+        count = g.get('query_count', 0)
+        RequestQueryStats.record(request.endpoint or 'unknown', count)
+        response.headers['X-DB-Queries'] = str(count)
+        return response
+
+
 def create_monitoring_report():
     """Create a database performance report"""
     monitor = DatabaseMonitor()
@@ -121,6 +173,7 @@ def create_monitoring_report():
         'average_query_time': monitor.get_average_query_time(),
         'slow_queries_count': len(monitor.get_slow_queries()),
         'active_connections': monitor.monitor_connections(),
+        'queries_per_request': RequestQueryStats.report(),
         'timestamp': datetime.now().isoformat()
     }
     
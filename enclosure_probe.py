@@ -0,0 +1,270 @@
+"""
+Enclosure size probing with a per-process size cache
+
+Free of Flask and database imports so render worker processes can use it.
+"""
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http_client import http_client
+from url_resolvers import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Enclosure sizes rarely change, so probe results are reused across renders
+ENCLOSURE_SIZE_TTL = 24 * 3600  # seconds
+ENCLOSURE_SIZE_MAX_ENTRIES = 5000
+_enclosure_sizes = {}
+_sizes_lock = threading.Lock()
+_probe_executor = None
+
+# Hosts a probe may fetch from, redirect hops included. Deliberately narrower than
+# the resolver registry: resolvers only rewrite links, while a probe is a request
+# from our servers, so wildcard hosts that anyone can claim (S3 buckets and website
+# endpoints, SharePoint and Box tenants) are never fetched
+PROBE_ALLOWED_HOSTS = frozenset([
+    'dl.dropboxusercontent.com',
+    'www.dropbox.com',
+    'dropbox.com',
+    'drive.google.com',
+    'drive.usercontent.google.com',
+])
+# Download redirects land on per-file content hosts these companies own
+PROBE_ALLOWED_SUFFIXES = ('.dl.dropboxusercontent.com', '.googleusercontent.com')
+MAX_REDIRECTS = 5
+
+# Self-hosted media (or a local stub server), as a host regex, e.g.
+# ENCLOSURE_ALLOWED_HOSTS='media\.example\.com'; read from the environment so
+# spawned render workers pick it up too
+_self_hosted = re.compile(os.environ['ENCLOSURE_ALLOWED_HOSTS'], re.IGNORECASE) \
+    if os.environ.get('ENCLOSURE_ALLOWED_HOSTS') else None
+
+
+class BlockedURL(Exception):
+    """A probe or one of its redirects pointed outside the allow-list"""
+
+
+def is_url_allowed(url):
+    """Validate that a URL points to an allow-listed host to prevent SSRF attacks"""
+    try:
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            return False
+        host = (parsed.hostname or '').lower()
+        return (host in PROBE_ALLOWED_HOSTS or host.endswith(PROBE_ALLOWED_SUFFIXES)
+                or (_self_hosted is not None and _self_hosted.fullmatch(host) is not None))
+    except Exception:
+        return False
+
+
+def probe_get(url, **kwargs):
+    """GET through the shared client, following redirects only to allow-listed hosts"""
+    for _ in range(MAX_REDIRECTS + 1):
+        if not is_url_allowed(url):
+            raise BlockedURL(url)
+        response = http_client.get(url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urllib.parse.urljoin(url, response.headers['Location'])
+    raise BlockedURL(f"too many redirects: {url}")
+
+
+def get_file_size(url):
+    """Get file size in bytes from URL"""
+    try:
+        if not is_url_allowed(url):
+            logger.warning(f"Blocked request to disallowed URL: {url}")
+            return "0"
+        # A one-byte range gets the size from Content-Range and leaves the
+        # connection reusable; servers that ignore Range are not read at all
+        with probe_get(url, headers={'Range': 'bytes=0-0'}, stream=True) as response:
+            if response.status_code == 206:
+                # Read at most the one byte asked for, whatever the server sends; a complete
+                # read lets the connection go back to the pool
+                response.raw.read(1)
+                size = response.headers.get('Content-Range', '').rpartition('/')[2]
+                size = size if size.isdigit() else None
+            elif response.ok:
+                size = response.headers.get('Content-Length')
+            else:
+                logger.error(f"HTTP {response.status_code} while getting file size for {url}")
+                return "0"
+        if size:
+            return size
+        logger.warning(f"No Content-Length header found for URL: {url}")
+        return "0"
+    except BlockedURL as e:
+        logger.warning(f"Blocked redirect to disallowed URL: {e}")
+        return "0"
+    except Exception as e:
+        logger.error(f"Failed to get file size for {url}: {str(e)}", exc_info=True)
+        return "0"
+
+
+def get_cached_file_size(url):
+    """Return a recently probed file size for url, or None"""
+    entry = _enclosure_sizes.get(url)
+    if entry and time.monotonic() - entry[0] < ENCLOSURE_SIZE_TTL:
+        return entry[1]
+    return None
+
+
+def remember_sizes(sizes):
+    """Store probed sizes ({url: size}); failed probes ("0") are not cached"""
+    now = time.monotonic()
+    with _sizes_lock:
+        for url, size in sizes.items():
+            if size == "0":
+                continue
+            _enclosure_sizes.pop(url, None)
+            _enclosure_sizes[url] = (now, size)
+        while len(_enclosure_sizes) > ENCLOSURE_SIZE_MAX_ENTRIES:
+            # Dicts keep insertion order, so this drops the oldest probe
+            _enclosure_sizes.pop(next(iter(_enclosure_sizes)))
+
+
+def cached_sizes(urls):
+    """Known sizes for the given URLs, to hand to a render worker"""
+    sizes = {}
+    for url in urls:
+        size = get_cached_file_size(url)
+        if size is not None:
+            sizes[url] = size
+    return sizes
+
+
+def probe_file_size(url):
+    """Probe a file size and remember it"""
+    size = get_file_size(url)
+    remember_sizes({url: size})
+    return size
+
+
+def probe_enclosures_async(audio_urls):
+    """Probe new enclosure URLs in the background so the next render finds their sizes cached"""
+    global _probe_executor
+    if _probe_executor is None:
+        _probe_executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix='enclosure-probe')
+
+    direct_urls = {normalize_url(url) for url in audio_urls if url}
+    for url in direct_urls:
+        _probe_executor.submit(probe_file_size, url)
+    if direct_urls:
+        logger.info(f"Queued {len(direct_urls)} enclosure probes")
+
+
+def fetch_file_sizes_concurrent(direct_urls):
+    """Fetch file sizes concurrently; returns {direct_url: size}"""
+    def get_size(url):
+        try:
+            cached_size = get_cached_file_size(url)
+            if cached_size is not None:
+                return url, cached_size
+            return url, probe_file_size(url)
+        except Exception as e:
+            logger.error(f"Error getting size for {url}: {e}")
+            return url, "0"
+
+    direct_urls = set(direct_urls)
+    if not direct_urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        return dict(executor.map(get_size, direct_urls))
+
+
+def _start_stub_server(file_bytes, connect_delay):
+    """Keep-alive HTTP/1.1 server on 127.0.0.1 that answers every path with a file of file_bytes"""
+    import socket
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out as separate writes; like real media servers, don't let
+            # Nagle hold the body back until the client's delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.server.connections += 1
+            # Stands in for the TCP and TLS handshake round trips to a remote host
+            time.sleep(connect_delay)
+
+        def do_GET(self):
+            self.server.requests += 1
+            if self.headers.get('Range') == 'bytes=0-0':
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes 0-0/{file_bytes}')
+                body = b'\0'
+            else:
+                self.send_response(200)
+                body = bytes(file_bytes)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.connections = server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _urlopen_file_size(url):
+    """The probe as it was before the shared client: a new connection per episode"""
+    import urllib.request
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.headers.get('Content-Length') or "0"
+
+
+def run_benchmark(episodes=100, connect_delay=0.0):
+    """Probe the enclosures of one feed regeneration against a local stub, per-request urlopen vs the pool"""
+    global _self_hosted
+    from http_client import HostRateLimiter
+
+    logging.getLogger().setLevel(logging.WARNING)
+    _self_hosted = re.compile(r'127\.0\.0\.1')
+    server = _start_stub_server(file_bytes=64 * 1024, connect_delay=connect_delay)
+    urls = [f'http://127.0.0.1:{server.server_port}/episode{n}.mp3' for n in range(episodes)]
+    print(f"{episodes} enclosures, {connect_delay * 1000:.0f} ms per new connection")
+
+    def report(label, probe):
+        _enclosure_sizes.clear()
+        server.connections = server.requests = 0
+        started = time.perf_counter()
+        # Five probes at a time, as fetch_file_sizes_concurrent does
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            sizes = list(executor.map(probe, urls))
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for size in sizes if size == "0")
+        print(f"  {label:<22} {elapsed * 1000:7.1f} ms  {server.connections:3d} connections  "
+              f"{server.requests:3d} requests  {failed} failed")
+
+    # Importing requests is a once-per-process cost, not part of a regeneration
+    http_client._get_session()
+    try:
+        report('urlopen per request', _urlopen_file_size)
+        for regeneration in ('shared client, cold', 'shared client, warm'):
+            # A fresh bucket each time, so the rate limit's burst covers the whole regeneration
+            http_client.limiter = HostRateLimiter()
+            report(regeneration, get_file_size)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import sys
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+                  float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0)
@@ -0,0 +1,227 @@
+"""
+Bulk episode create/update/delete applied with set-based SQL in one transaction
+"""
+import logging
+from datetime import datetime
+from app import db
+from models import Episode
+from sqlalchemy import select, insert, update, delete
+from url_resolvers import normalize_url
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 1000
+OPERATIONS = ('create', 'update', 'delete')
+EDITABLE_FIELDS = ('title', 'description', 'audio_url', 'release_date', 'is_recurring')
+
+TITLE_MAX_LENGTH = Episode.__table__.c.title.type.length
+AUDIO_URL_MAX_LENGTH = Episode.__table__.c.audio_url.type.length
+
+
+class BatchValidationError(Exception):
+    """Raised with every per-operation problem found while validating a batch"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid operations")
+        self.errors = errors
+
+
+def _parse_release_date(value):
+    if not isinstance(value, str):
+        raise ValueError("release_date must be an ISO 8601 string")
+    parsed = datetime.fromisoformat(value)
+    # Stored like form input: Pacific wall-clock time without tzinfo
+    if parsed.tzinfo is not None:
+        from feed_generator import TIMEZONE
+        parsed = parsed.astimezone(TIMEZONE).replace(tzinfo=None)
+    return parsed
+
+
+def _clean_fields(operation, required):
+    """Validate and normalise the editable fields present in an operation"""
+    fields = {}
+    for field in EDITABLE_FIELDS:
+        if field not in operation:
+            if required and field in ('title', 'audio_url', 'release_date'):
+                raise ValueError(f"Missing {field}")
+            continue
+        value = operation[field]
+        if field == 'title':
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError("title must be a non-empty string")
+            value = value.strip()
+            if len(value) > TITLE_MAX_LENGTH:
+                raise ValueError(f"title longer than {TITLE_MAX_LENGTH} characters")
+        elif field == 'description':
+            if value is not None and not isinstance(value, str):
+                raise ValueError("description must be a string")
+            value = (value or '').strip()
+        elif field == 'audio_url':
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError("audio_url must be a non-empty string")
+            value = normalize_url(value.strip())
+            if len(value) > AUDIO_URL_MAX_LENGTH:
+                raise ValueError(f"audio_url longer than {AUDIO_URL_MAX_LENGTH} characters")
+            fields['resolved_audio_url'] = normalize_url(value)
+            # A new file needs its metadata probed again
+            fields.update(enclosure_length=None, enclosure_type=None, duration_seconds=None,
+                          bitrate=None, probed_at=None)
+        elif field == 'release_date':
+            value = _parse_release_date(value)
+        elif field == 'is_recurring':
+            if not isinstance(value, bool):
+                raise ValueError("is_recurring must be a boolean")
+        fields[field] = value
+    return fields
+
+
+class EpisodeBatch:
+    """Validates a list of operations for one feed and applies them atomically"""
+
+    def __init__(self, feed_id, operations):
+        self.feed_id = feed_id
+        self.operations = operations
+        self.creates = []   # (index, values)
+        self.updates = []   # (index, episode_id, fields)
+        self.deletes = []   # (index, episode_id)
+
+    def validate(self):
+        """Check every operation up front; raises BatchValidationError listing all problems"""
+        if not isinstance(self.operations, list) or not self.operations:
+            raise BatchValidationError([{'index': None, 'error': 'operations must be a non-empty list'}])
+        if len(self.operations) > MAX_OPERATIONS:
+            raise BatchValidationError([{'index': None, 'error': f'at most {MAX_OPERATIONS} operations per batch'}])
+
+        errors = []
+        seen_ids = set()
+        for index, operation in enumerate(self.operations):
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError("operation must be an object")
+                op = operation.get('op')
+                if op not in OPERATIONS:
+                    raise ValueError(f"op must be one of {', '.join(OPERATIONS)}")
+
+                if op == 'create':
+                    fields = _clean_fields(operation, required=True)
+                    fields.setdefault('description', '')
+                    fields.setdefault('is_recurring', False)
+                    self.creates.append((index, fields))
+                    continue
+
+                episode_id = operation.get('id')
+                if not isinstance(episode_id, int) or isinstance(episode_id, bool):
+                    raise ValueError("id must be an integer")
+                if episode_id in seen_ids:
+                    raise ValueError(f"episode {episode_id} appears more than once")
+                seen_ids.add(episode_id)
+
+                if op == 'update':
+                    fields = _clean_fields(operation, required=False)
+                    if not fields:
+                        raise ValueError("update has no fields to change")
+                    self.updates.append((index, episode_id, fields))
+                else:
+                    self.deletes.append((index, episode_id))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        errors.extend(self._validate_against_feed())
+        if errors:
+            raise BatchValidationError(sorted(errors, key=lambda err: err['index']))
+
+    def _validate_against_feed(self):
+        """Ownership and uniqueness checks, two queries for the whole batch"""
+        errors = []
+
+        # Existing rows for every update/delete target, restricted to this feed
+        target_ids = [episode_id for _, episode_id, _ in self.updates] + [episode_id for _, episode_id in self.deletes]
+        self.current = {}
+        if target_ids:
+            rows = db.session.execute(
+                select(Episode.id, Episode.title, Episode.description, Episode.audio_url,
+                       Episode.release_date, Episode.is_recurring)
+                .where(Episode.feed_id == self.feed_id, Episode.id.in_(target_ids))
+            )
+            self.current = {row.id: row._asdict() for row in rows}
+        for index, episode_id, *_ in self.updates + self.deletes:
+            if episode_id not in self.current:
+                errors.append({'index': index, 'error': f"episode {episode_id} not found in this feed"})
+
+        # Audio URLs must stay unique within the feed once the batch is applied
+        deleted_ids = {episode_id for _, episode_id in self.deletes}
+        claimed = {}
+        for index, episode_id, fields in self.updates:
+            if 'audio_url' in fields:
+                claimed.setdefault(fields['audio_url'], []).append((index, episode_id))
+        for index, fields in self.creates:
+            claimed.setdefault(fields['audio_url'], []).append((index, None))
+
+        if claimed:
+            owners = {
+                row.audio_url: row.id for row in db.session.execute(
+                    select(Episode.id, Episode.audio_url)
+                    .where(Episode.feed_id == self.feed_id, Episode.audio_url.in_(list(claimed)))
+                )
+            }
+            for url, claimants in claimed.items():
+                owner = owners.get(url)
+                for index, episode_id in claimants[1:]:
+                    errors.append({'index': index, 'error': f"audio_url {url} is used more than once in this batch"})
+                index, episode_id = claimants[0]
+                if owner is not None and owner != episode_id and owner not in deleted_ids:
+                    errors.append({'index': index, 'error': f"audio_url {url} already belongs to episode {owner}"})
+        return errors
+
+    def apply(self):
+        """Apply the validated batch in a single transaction; returns a summary"""
+        created = []
+        if self.deletes:
+            db.session.execute(
+                delete(Episode)
+                .where(Episode.feed_id == self.feed_id, Episode.id.in_([episode_id for _, episode_id in self.deletes]))
+                .execution_options(synchronize_session=False)
+            )
+
+        if self.updates:
+            rows = []
+            for _, episode_id, fields in self.updates:
+                merged = {**self.current[episode_id], **fields}
+                merged['content_hash'] = Episode.compute_content_hash(
+                    merged['title'], merged['description'], merged['release_date'], merged['is_recurring']
+                )
+                rows.append(merged)
+            # ORM bulk UPDATE by primary key: one executemany for the whole list
+            db.session.execute(update(Episode), rows)
+
+        if self.creates:
+            values = []
+            for _, fields in self.creates:
+                values.append({
+                    **fields,
+                    'feed_id': self.feed_id,
+                    'content_hash': Episode.compute_content_hash(
+                        fields['title'], fields['description'], fields['release_date'], fields['is_recurring']
+                    ),
+                })
+            result = db.session.execute(
+                insert(Episode).returning(Episode.id, Episode.audio_url, sort_by_parameter_order=True),
+                values
+            )
+            created = [{'index': index, 'id': row.id} for (index, _), row in zip(self.creates, result)]
+
+        db.session.commit()
+        logger.info(f"Applied episode batch to feed {self.feed_id}: {len(created)} created, "
+                    f"{len(self.updates)} updated, {len(self.deletes)} deleted")
+
+        return {
+            'created': created,
+            'updated': len(self.updates),
+            'deleted': len(self.deletes),
+        }
+
+    def new_audio_urls(self):
+        """Audio URLs introduced by this batch, for background enclosure probing"""
+        urls = [fields['audio_url'] for _, fields in self.creates]
+        urls.extend(fields['audio_url'] for _, _, fields in self.updates if 'audio_url' in fields)
+        return urls
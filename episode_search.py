@@ -0,0 +1,332 @@
+"""
+Full-text episode search backed by Postgres tsvector/GIN with an SQLite FTS5 fallback
+"""
+import logging
+import re
+from collections import namedtuple
+from markupsafe import Markup, escape
+from app import db
+from sqlalchemy import text, or_, DateTime
+
+logger = logging.getLogger(__name__)
+
+# Control characters mark highlighted terms inside snippets; they never occur in
+# user text, so the snippet can be HTML-escaped before the markers become <mark>.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+SearchHit = namedtuple('SearchHit', ['id', 'feed_id', 'feed_name', 'title', 'release_date', 'rank', 'snippet'])
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def _tokenize(query):
+    """Split a raw search string into plain word tokens (drops any query operators)"""
+    return _TOKEN_PATTERN.findall(query.lower())[:16]
+
+
+def like_pattern(query):
+    """%query% for LIKE/ILIKE with the query's own wildcards matched literally (use escape='\\')"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def highlight_snippet(snippet):
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    if not snippet:
+        return Markup('')
+    return (escape(snippet)
+            .replace(HIGHLIGHT_START, Markup('<mark>'))
+            .replace(HIGHLIGHT_STOP, Markup('</mark>')))
+
+
+class SearchResults:
+    """Paginated search results, shaped like the pagination objects used by the templates"""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.pages = (total + per_page - 1) // per_page
+        self.has_prev = page > 1
+        self.has_next = page < self.pages
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if self.has_next else None
+
+
+class PostgresSearchBackend:
+    """Ranked search over a generated tsvector column with a GIN index"""
+
+    name = 'postgresql'
+
+    SEARCH_SQL = """
+        SELECT e.id, e.feed_id, f.name AS feed_name, e.title, e.release_date,
+               ts_rank_cd(e.search_vector, q) AS rank,
+               ts_headline('english', coalesce(e.description, ''), q, :headline_options) AS snippet,
+               count(*) OVER () AS total
+        FROM episode e
+        JOIN feed f ON f.id = e.feed_id
+        CROSS JOIN to_tsquery('english', :tsquery) q
+        WHERE f.user_id = :user_id AND e.search_vector @@ q
+        ORDER BY rank DESC, e.release_date DESC
+        LIMIT :limit OFFSET :offset
+    """
+
+    COUNT_SQL = """
+        SELECT count(*)
+        FROM episode e
+        JOIN feed f ON f.id = e.feed_id
+        WHERE f.user_id = :user_id AND e.search_vector @@ to_tsquery('english', :tsquery)
+    """
+
+    HEADLINE_OPTIONS = (f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+                        'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "')
+
+    @staticmethod
+    def install():
+        """Add the generated search_vector column and its GIN index if missing"""
+        db.session.execute(text("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'episode' AND column_name = 'search_vector'
+                ) THEN
+                    ALTER TABLE episode ADD COLUMN search_vector tsvector
+                        GENERATED ALWAYS AS (
+                            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+                        ) STORED;
+                    RAISE NOTICE 'Added search_vector column to episode table';
+                END IF;
+            END $$;
+        """))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_episode_search_vector ON episode USING GIN (search_vector)"
+        ))
+
+    @staticmethod
+    def build_query(tokens):
+        """Build a prefix-matching tsquery: every token must match, each as a prefix"""
+        return ' & '.join(f"{token}:*" for token in tokens)
+
+    def search(self, user_id, tokens, page, per_page):
+        result = db.session.execute(
+            text(self.SEARCH_SQL).columns(release_date=DateTime),
+            {
+                'tsquery': self.build_query(tokens),
+                'headline_options': self.HEADLINE_OPTIONS,
+                'user_id': user_id,
+                'limit': per_page,
+                'offset': (page - 1) * per_page,
+            }
+        )
+        return result.fetchall()
+
+    def count(self, user_id, tokens):
+        return db.session.execute(
+            text(self.COUNT_SQL), {'tsquery': self.build_query(tokens), 'user_id': user_id}
+        ).scalar()
+
+
+class SQLiteSearchBackend:
+    """Ranked search over an external-content FTS5 table kept in sync by triggers"""
+
+    name = 'sqlite'
+
+    # FTS5 auxiliary functions cannot share a SELECT with window functions, so
+    # ranking and snippets are computed in a CTE and the total counted outside it
+    SEARCH_SQL = """
+        WITH matches AS (
+            SELECT rowid AS episode_id,
+                   bm25(episode_fts, 10.0, 1.0) AS rank,
+                   snippet(episode_fts, 1, char(2), char(3), ' … ', 24) AS snippet
+            FROM episode_fts
+            WHERE episode_fts MATCH :match
+        )
+        SELECT e.id, e.feed_id, f.name AS feed_name, e.title, e.release_date,
+               m.rank, m.snippet, count(*) OVER () AS total
+        FROM matches m
+        JOIN episode e ON e.id = m.episode_id
+        JOIN feed f ON f.id = e.feed_id
+        WHERE f.user_id = :user_id
+        ORDER BY m.rank, e.release_date DESC
+        LIMIT :limit OFFSET :offset
+    """
+
+    COUNT_SQL = """
+        SELECT count(*)
+        FROM episode_fts
+        JOIN episode e ON e.id = episode_fts.rowid
+        JOIN feed f ON f.id = e.feed_id
+        WHERE episode_fts MATCH :match AND f.user_id = :user_id
+    """
+
+    @staticmethod
+    def install():
+        """Create the FTS5 index and its sync triggers, backfilling on first creation"""
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'episode_fts'"
+        )).first()
+
+        db.session.execute(text("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS episode_fts USING fts5(
+                title, description,
+                content='episode', content_rowid='id',
+                tokenize='porter unicode61', prefix='2 3'
+            )
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS episode_fts_ai AFTER INSERT ON episode BEGIN
+                INSERT INTO episode_fts(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS episode_fts_ad AFTER DELETE ON episode BEGIN
+                INSERT INTO episode_fts(episode_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END
+        """))
+        db.session.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS episode_fts_au AFTER UPDATE OF title, description ON episode BEGIN
+                INSERT INTO episode_fts(episode_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO episode_fts(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+        """))
+
+        if not exists:
+            db.session.execute(text("INSERT INTO episode_fts(episode_fts) VALUES ('rebuild')"))
+            logger.info("Built episode_fts index from existing episodes")
+
+    @staticmethod
+    def build_query(tokens):
+        """Build an FTS5 MATCH expression: implicit AND of quoted prefix terms"""
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, user_id, tokens, page, per_page):
+        result = db.session.execute(
+            text(self.SEARCH_SQL).columns(release_date=DateTime),
+            {
+                'match': self.build_query(tokens),
+                'user_id': user_id,
+                'limit': per_page,
+                'offset': (page - 1) * per_page,
+            }
+        )
+        return result.fetchall()
+
+    def count(self, user_id, tokens):
+        return db.session.execute(
+            text(self.COUNT_SQL), {'match': self.build_query(tokens), 'user_id': user_id}
+        ).scalar()
+
+
+_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    """Return the full-text backend for the configured database, or None"""
+    backend_class = _BACKENDS.get(db.engine.dialect.name)
+    return backend_class() if backend_class else None
+
+
+def install_search_schema():
+    """Create full-text search structures for the configured database"""
+    backend_class = _BACKENDS.get(db.engine.dialect.name)
+    if backend_class is None:
+        logger.warning(f"No full-text search backend for dialect {db.engine.dialect.name}, using ILIKE search")
+        return
+    backend_class.install()
+
+
+def ilike_query(user_id, query):
+    """Substring match over a user's episodes, newest first (also checked by query_plans.py)"""
+    from models import Feed, Episode
+
+    pattern = like_pattern(query)
+    return (Episode.query
+            .join(Feed)
+            .filter(Feed.user_id == user_id)
+            .filter(or_(
+                Episode.title.ilike(pattern, escape='\\'),
+                Episode.description.ilike(pattern, escape='\\')
+            ))
+            .order_by(Episode.release_date.desc()))
+
+
+def _ilike_search(user_id, query, page, per_page):
+    """Legacy substring search, used when no full-text backend is available"""
+    pagination = ilike_query(user_id, query).paginate(page=page, per_page=per_page, error_out=False)
+
+    items = [
+        SearchHit(ep.id, ep.feed_id, ep.feed.name, ep.title, ep.release_date, None,
+                  escape((ep.description or '')[:200]))
+        for ep in pagination.items
+    ]
+    return SearchResults(items, page, per_page, pagination.total or 0)
+
+
+def search_episodes(user_id, query, page=1, per_page=20):
+    """Search a user's episodes, ranked by relevance with highlighted snippets"""
+    page = max(page, 1)
+    tokens = _tokenize(query)
+    if not tokens:
+        return SearchResults([], page, per_page, 0)
+
+    backend = get_search_backend()
+    if backend is None:
+        return _ilike_search(user_id, query, page, per_page)
+
+    try:
+        rows = backend.search(user_id, tokens, page, per_page)
+        if rows:
+            total = rows[0].total
+        elif page > 1:
+            # Past the last page the window count has no row to ride on
+            total = backend.count(user_id, tokens)
+        else:
+            total = 0
+    except Exception as e:
+        logger.error(f"Full-text search failed on {backend.name}, falling back to ILIKE: {e}")
+        db.session.rollback()
+        return _ilike_search(user_id, query, page, per_page)
+
+    items = [
+        SearchHit(row.id, row.feed_id, row.feed_name, row.title, row.release_date,
+                  row.rank, highlight_snippet(row.snippet))
+        for row in rows
+    ]
+    return SearchResults(items, page, per_page, total)
+
+
+def search_archived_episodes(user_id, query, limit=50):
+    """Substring search over archived episodes; only run when the user asks for the archive"""
+    from models import Feed, EpisodeArchive
+
+    if not _tokenize(query):
+        return []
+
+    pattern = like_pattern(query)
+    rows = (db.session.query(EpisodeArchive, Feed.name)
+            .join(Feed, EpisodeArchive.feed_id == Feed.id)
+            .filter(Feed.user_id == user_id)
+            .filter(or_(
+                EpisodeArchive.title.ilike(pattern, escape='\\'),
+                EpisodeArchive.description.ilike(pattern, escape='\\')
+            ))
+            .order_by(EpisodeArchive.release_date.desc())
+            .limit(limit)
+            .all())
+
+    return [
+        SearchHit(ep.id, ep.feed_id, feed_name, ep.title, ep.release_date, None,
+                  escape((ep.description or '')[:200]))
+        for ep, feed_name in rows
+    ]
@@ -6,6 +6,7 @@ import json
 import os
 from datetime import datetime, timedelta
 from functools import wraps
+from cache_engine import CacheEngine, budget
 
 logger = logging.getLogger(__name__)
 
@@ -112,45 +113,27 @@ def long_term_cache(hours=24):
 class UltraLongCache:
     """Ultra-long term caching for rarely changing data"""
     
-    _ultra_cache = {}
-    _ultra_timestamps = {}
+    # Values are stored with their write time, since callers pick the maximum age when reading
+    _ultra_cache = CacheEngine('ultra_long', budget('ultra_long', 8), default_ttl=7 * 24 * 60 * 60)
     
     @classmethod
     def get(cls, key, max_age_days=7):
         """Get ultra-long cached value (default 7 days)"""
-        if key in cls._ultra_cache and key in cls._ultra_timestamps:
-            cache_time = cls._ultra_timestamps[key]
-            if datetime.now() - cache_time < timedelta(days=max_age_days):
-                return cls._ultra_cache[key]
-            else:
-                cls._ultra_cache.pop(key, None)
-                cls._ultra_timestamps.pop(key, None)
+        entry = cls._ultra_cache.get(key)
+        if entry is None:
+            return None
+        cache_time, value = entry
+        if datetime.now() - cache_time < timedelta(days=max_age_days):
+            return value
+        cls._ultra_cache.invalidate(key)
         return None
     
     @classmethod
     def set(cls, key, value):
         """Set ultra-long cached value"""
-        cls._ultra_cache[key] = value
-        cls._ultra_timestamps[key] = datetime.now()
-        
-        # Limit cache size
-        if len(cls._ultra_cache) > 50:
-            cls._cleanup_oldest()
-    
-    @classmethod
-    def _cleanup_oldest(cls):
-        """Remove oldest entries"""
-        if not cls._ultra_timestamps:
-            return
-        
-        # Remove oldest 10 entries
-        sorted_items = sorted(cls._ultra_timestamps.items(), key=lambda x: x[1])
-        for key, _ in sorted_items[:10]:
-            cls._ultra_cache.pop(key, None)
-            cls._ultra_timestamps.pop(key, None)
+        cls._ultra_cache.set(key, (datetime.now(), value))
     
     @classmethod
     def invalidate(cls, key):
         """Manually invalidate specific cache entry"""
-        cls._ultra_cache.pop(key, None)
-        cls._ultra_timestamps.pop(key, None)
\ No newline at end of file
+        cls._ultra_cache.invalidate(key)
@@ -1,26 +1,30 @@
-import pytz
 from datetime import datetime, timedelta
-from xml.etree import ElementTree as ET
-from utils import convert_url_to_dropbox_direct
-import urllib.request
-import urllib.error
-import urllib.parse
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
-from flask import request
-from models import Episode
+import os
+from flask import request, current_app, has_request_context
+from feed_renderer import TIMEZONE, DEFAULT_RETENTION_DAYS, FeedSnapshot, EpisodeSnapshot
+from render_service import render_service, RenderQueueFull, PRIORITY_MANUAL, PRIORITY_REQUEST
+from url_resolvers import normalize_url
+from cache_engine import CacheEngine, budget
 
 logger = logging.getLogger(__name__)
 
-_feed_cache = {}
-TIMEZONE = pytz.timezone('America/Los_Angeles')  # Pacific Time
+# feed id -> (rendered at, RenderedFeed); the RenderedFeed objects are shared with
+# RSSCacheManager, so the two budgets count the same bytes. Plain LRU like that
+# cache: a fresh render must be kept even though its feed has few reads yet
+_feed_cache = CacheEngine('feed', budget('feed', 64), stripes=4, admission=False)
 
 # Define refresh times (daily refresh to minimize autoscale requests)
 REFRESH_TIMES = [
     (3, 0),   # 3:00 AM PT - single daily refresh during low traffic
 ]
 
+# Shared caches are purged on every edit (cdn_purge.py), so they may keep a feed
+# until the next refresh; podcatchers can't be purged and revalidate sooner
+CLIENT_MAX_AGE = int(os.environ.get('FEED_CLIENT_MAX_AGE', '900'))
+STALE_WHILE_REVALIDATE = 300
+STALE_IF_ERROR = 86400
+
 def get_next_refresh_time(current_time):
     """Get the next refresh time based on current time"""
     current_time = current_time.astimezone(TIMEZONE)
@@ -44,15 +48,24 @@ def get_next_refresh_time(current_time):
 
     return next_refresh
 
-def should_update_cache(feed_id):
+def feed_cache_control(now=None, purgeable=True):
+    """Cache-Control for an RSS response: fresh until the next scheduled refresh"""
+    now = now or datetime.now(TIMEZONE)
+    until_refresh = max(60, int((get_next_refresh_time(now) - now).total_seconds()))
+    shared_max_age = until_refresh if purgeable else min(until_refresh, CLIENT_MAX_AGE)
+    return (f"public, max-age={min(until_refresh, CLIENT_MAX_AGE)}, s-maxage={shared_max_age}, "
+            f"stale-while-revalidate={STALE_WHILE_REVALIDATE}, stale-if-error={STALE_IF_ERROR}")
+
+def should_update_cache(feed_id, entry=None):
     """Check if the cache for this feed needs to be updated"""
     current_time = datetime.now(TIMEZONE)
 
-    if feed_id not in _feed_cache:
+    entry = entry or _feed_cache.get(feed_id)
+    if entry is None:
         logger.info(f"No cache entry found for feed_id: {feed_id}")
         return True
 
-    cache_time, _ = _feed_cache[feed_id]
+    cache_time, _ = entry
     cache_time = cache_time.astimezone(TIMEZONE)
 
     # Check if we've passed a refresh time since the last cache
@@ -71,8 +84,10 @@ def should_update_cache(feed_id):
 
 def get_cached_feed(feed_id):
     """Get cached feed content if available and not expired"""
-    if feed_id in _feed_cache and not should_update_cache(feed_id):
-        _, content = _feed_cache[feed_id]
+    # One lookup: the entry can be evicted between a membership test and a read
+    entry = _feed_cache.get(feed_id)
+    if entry is not None and not should_update_cache(feed_id, entry):
+        _, content = entry
         logger.info(f"Returning cached RSS feed for feed_id: {feed_id}")
         return content
     return None
@@ -83,260 +98,70 @@ def cache_feed(feed_id, content):
     _feed_cache[feed_id] = (current_time, content)
     logger.info(f"Updated RSS feed cache for feed_id: {feed_id} at {current_time}")
 
-ALLOWED_HOSTS = [
-    'dl.dropboxusercontent.com',
-    'www.dropbox.com',
-    'dropbox.com',
-    'drive.google.com',
-]
-
-def _is_url_allowed(url):
-    """Validate that a URL points to an allowed host to prevent SSRF attacks"""
-    try:
-        parsed = urllib.parse.urlparse(url)
-        if parsed.scheme not in ('http', 'https'):
-            return False
-        return parsed.hostname in ALLOWED_HOSTS
-    except Exception:
-        return False
-
-def get_file_size(url):
-    """Get file size in bytes from URL"""
-    try:
-        if not _is_url_allowed(url):
-            logger.warning(f"Blocked request to disallowed URL: {url}")
-            return "0"
-        response = urllib.request.urlopen(url)
-        size = response.headers.get('Content-Length')
-        if size:
-            return size
-        logger.warning(f"No Content-Length header found for URL: {url}")
-        return "0"
-    except urllib.error.URLError as url_err:
-        logger.error(f"URLError while getting file size for {url}: {url_err.reason}")
-        return "0"
-    except Exception as e:
-        logger.error(f"Failed to get file size for {url}: {str(e)}", exc_info=True)
-        return "0"
-
-def fetch_file_size_concurrent(episodes):
-    """Fetch file sizes concurrently for multiple episodes"""
-    def get_episode_size(episode):
-        try:
-            direct_url = convert_url_to_dropbox_direct(episode.audio_url)
-            return episode, get_file_size(direct_url)
-        except Exception as e:
-            logger.error(f"Error getting size for episode {getattr(episode, 'title', 'Unknown')}: {e}")
-            return episode, "0"
-
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        return list(executor.map(get_episode_size, episodes))
-
-def generate_rss_feed_force(feed):
-    """Force generate RSS feed XML, bypassing cache"""
-    return _generate_rss_content(feed, force=True)
+def get_base_url():
+    """Canonical external base URL for feed links, falling back to the request host"""
+    base_url = current_app.config.get('CANONICAL_BASE_URL')
+    if base_url:
+        return base_url
+    if has_request_context():
+        return request.host_url
+    raise RuntimeError("CANONICAL_BASE_URL must be set to render feeds outside a request")
+
+def build_feed_snapshot(header, base_url=None):
+    """Snapshot a feed from its slug index header plus one episodes query"""
+    from query_optimizer import QueryOptimizer
 
-def generate_rss_feed(feed):
-    """Generate RSS feed XML for a podcast feed"""
-    cached_content = get_cached_feed(feed.id)
+    # Stored release dates are naive Pacific wall-clock times, so bind the window the same way
+    now = datetime.now(TIMEZONE).replace(tzinfo=None)
+    lookback_days = header.retention_period or DEFAULT_RETENTION_DAYS
+    rows = QueryOptimizer.optimize_rss_query(header.id, now - timedelta(days=lookback_days), now)
+
+    # Rows written before resolution moved to write time may lack the resolved link
+    image_url = header.resolved_image_url or normalize_url(header.image_url)
+    return FeedSnapshot(
+        header.id, header.url_slug, header.name, header.description, image_url,
+        header.website_url, header.owner_name, header.retention_period,
+        base_url or get_base_url(),
+        tuple(EpisodeSnapshot(*row) for row in rows)
+    )
+
+def generate_rss_feed_force(header):
+    """Force generate RSS feed XML, bypassing cache; jumps ahead of other queued renders"""
+    return _generate_rss_content(header, PRIORITY_MANUAL)
+
+def generate_rss_feed(header):
+    """Generate RSS feed XML for a feed's slug index header; returns a RenderedFeed"""
+    cached_content = get_cached_feed(header.id)
     if cached_content:
         return cached_content
-    
-    return _generate_rss_content(feed, force=False)
 
-def _generate_rss_content(feed, force=False):
-    """Internal function to generate RSS content"""
-    from query_optimizer import QueryOptimizer
+    return _generate_rss_content(header, PRIORITY_REQUEST)
+
+def _generate_rss_content(header, priority):
+    """Snapshot the feed, then hand it to the render service, which also fills the caches"""
     from connection_manager import ConnectionManager
+    from slug_index import slug_index
 
     try:
-        logger.info(f"Starting RSS feed generation for: {feed.name}")
-        
-        # Use optimized query to limit database load
-        with ConnectionManager.efficient_session():
-            # Limit episodes to most recent 50 to reduce processing time
-            episodes_data = QueryOptimizer.optimize_rss_query(feed.id)
-            logger.debug(f"Total episodes to process: {len(episodes_data)}")
-
-        rss = ET.Element('rss', version='2.0')
-        rss.set('xmlns:itunes', 'http://www.itunes.com/dtds/podcast-1.0.dtd')
-        rss.set('xmlns:content', 'http://purl.org/rss/1.0/modules/content/')
-        rss.set('xmlns:atom', 'http://www.w3.org/2005/Atom')
-
-        channel = ET.SubElement(rss, 'channel')
-
-        title = ET.SubElement(channel, 'title')
-        title.text = feed.name
-
-        description = ET.SubElement(channel, 'description')
-        description.text = feed.description
-
-        if feed.website_url:
-            link = ET.SubElement(channel, 'link')
-            link.text = feed.website_url
-
-        language = ET.SubElement(channel, 'language')
-        language.text = 'en-us'
-
-        copyright_text = ET.SubElement(channel, 'copyright')
-        copyright_text.text = f'Copyright © {datetime.now(TIMEZONE).year} {feed.name}'
+        logger.info(f"Starting RSS feed generation for: {header.name}")
 
-        try:
-            itunes_author = ET.SubElement(channel, 'itunes:author')
-            itunes_author.text = feed.owner.name
+        # Read the version first: an edit committed while the snapshot is read
+        # bumps it, so this render is then discarded instead of cached
+        version = render_service.version(header.id)
 
-            itunes_category = ET.SubElement(channel, 'itunes:category')
-            itunes_category.set('text', 'Arts')
-        except AttributeError as attr_err:
-            logger.error(f"Missing required feed attributes: {attr_err}")
-            raise ValueError(f"Invalid feed configuration: {attr_err}")
-
-        if feed.image_url:
-            try:
-                direct_image_url = convert_url_to_dropbox_direct(feed.image_url)
-                itunes_image = ET.SubElement(channel, 'itunes:image')
-                itunes_image.set('href', direct_image_url)
-                logger.info(f"Successfully added podcast image for feed '{feed.name}'")
-            except Exception as img_err:
-                logger.warning(f"Failed to process image URL {feed.image_url}, continuing without image: {img_err}")
-
-        # Update the atom:link to use the actual host URL
-        feed_url = request.host_url.rstrip('/') + f"/feed/{feed.url_slug}/rss"
-        atom_link = ET.SubElement(channel, 'atom:link')
-        atom_link.set('href', feed_url)
-        atom_link.set('rel', 'self')
-        atom_link.set('type', 'application/rss+xml')
-
-        current_time = datetime.now(TIMEZONE)
-        # Use feed's retention period (in days)
-        lookback_days = feed.retention_period if hasattr(feed, 'retention_period') and feed.retention_period else 90
-        lookback_date = current_time - timedelta(days=lookback_days)
-        updated_episodes = []
-
-        # Convert raw data to episode-like objects for processing
-        from collections import namedtuple
-        EpisodeData = namedtuple('EpisodeData', ['id', 'title', 'description', 'audio_url', 'release_date', 'is_recurring'])
-        
-        episodes = [EpisodeData(*row) for row in episodes_data]
-        
-        for ep in episodes:
-            try:
-                ep_release_date = ep.release_date.replace(tzinfo=TIMEZONE) if ep.release_date.tzinfo is None else ep.release_date
-
-                # For recurring episodes, update the year to make them appear annually
-                if ep.is_recurring:
-                    try:
-                        # Calculate the date in the current year
-                        current_year_date = ep_release_date.replace(year=current_time.year)
-                        
-                        # If that date is in the future, use last year's date instead
-                        if current_year_date > current_time:
-                            ep_release_date = ep_release_date.replace(year=current_time.year - 1)
-                            logger.debug(f"Recurring episode '{ep.title}' updated to previous year: {ep_release_date}")
-                        else:
-                            ep_release_date = current_year_date
-                            logger.debug(f"Recurring episode '{ep.title}' updated to current year: {ep_release_date}")
-                    except ValueError:
-                        # Handle leap day (Feb 29) on non-leap years - move to Feb 28
-                        if ep_release_date.month == 2 and ep_release_date.day == 29:
-                            try:
-                                # Try current year with Feb 28
-                                current_year_date = ep_release_date.replace(year=current_time.year, day=28)
-                                if current_year_date > current_time:
-                                    ep_release_date = ep_release_date.replace(year=current_time.year - 1, day=28)
-                                    logger.debug(f"Recurring leap day episode '{ep.title}' moved to Feb 28 of previous year: {ep_release_date}")
-                                else:
-                                    ep_release_date = current_year_date
-                                    logger.debug(f"Recurring leap day episode '{ep.title}' moved to Feb 28 of current year: {ep_release_date}")
-                            except ValueError:
-                                # Fallback: keep original date if all adjustments fail
-                                logger.warning(f"Could not adjust recurring episode '{ep.title}' date, using original: {ep_release_date}")
-                        else:
-                            logger.warning(f"Unexpected date error for recurring episode '{ep.title}', using original: {ep_release_date}")
-                
-                # Only include episodes within the lookback window
-                if ep_release_date >= lookback_date and ep_release_date <= current_time:
-                    # Create a new episode object with the updated release_date since namedtuple is immutable
-                    updated_ep = EpisodeData(
-                        ep.id,
-                        ep.title,
-                        ep.description,
-                        ep.audio_url,
-                        ep_release_date,
-                        ep.is_recurring
-                    )
-                    updated_episodes.append(updated_ep)
-                else:
-                    logger.debug(f"Episode '{ep.title}' excluded - outside {lookback_days}-day window")
-
-            except AttributeError as attr_err:
-                logger.error(f"Invalid episode data for {getattr(ep, 'title', 'Unknown')}: {attr_err}")
-                continue
-
-        sorted_episodes = sorted(updated_episodes, key=lambda x: x.release_date, reverse=True)
-        
-        # Limit to maximum 100 episodes to save bandwidth and processing resources
-        if len(sorted_episodes) > 100:
-            sorted_episodes = sorted_episodes[:100]
-            logger.info(f"Limited to 100 most recent episodes for bandwidth optimization")
-
-        logger.info(f"Processing {len(sorted_episodes)} episodes for feed '{feed.name}' (from last {lookback_days} days)")
-
-        episode_sizes = dict(fetch_file_size_concurrent(sorted_episodes))
-
-        for episode in sorted_episodes:
-            try:
-                logger.debug(f"Processing episode: {episode.title}")
-                item = ET.SubElement(channel, 'item')
-
-                episode_title = ET.SubElement(item, 'title')
-                episode_title.text = episode.title
-
-                episode_desc = ET.SubElement(item, 'description')
-                episode_desc.text = episode.description
-
-                itunes_summary = ET.SubElement(item, 'itunes:summary')
-                itunes_summary.text = episode.description
-
-                pub_date = ET.SubElement(item, 'pubDate')
-                pub_date.text = episode.release_date.strftime('%a, %d %b %Y %H:%M:%S %z')
-
-                guid = ET.SubElement(item, 'guid')
-                guid.text = f"episode_{episode.id}_{episode.release_date.year}"
-                guid.set('isPermaLink', 'false')
-
-                try:
-                    direct_audio_url = convert_url_to_dropbox_direct(episode.audio_url)
-                    logger.debug(f"Processing audio URL for {episode.title}: {direct_audio_url}")
-
-                    file_size = episode_sizes.get(episode, "0")
-                    logger.debug(f"File size for {episode.title}: {file_size}")
-
-                    enclosure = ET.SubElement(item, 'enclosure')
-                    enclosure.set('url', direct_audio_url)
-                    enclosure.set('type', 'audio/mpeg')
-                    enclosure.set('length', file_size)
-                except (AttributeError, ValueError, urllib.error.URLError) as e:
-                    logger.error(f"Error processing enclosure for episode '{getattr(episode, 'title', 'Unknown')}': {e}")
-                    continue
-
-            except AttributeError as ep_err:
-                logger.error(f"Missing required episode attributes: {ep_err}")
-                continue
-            except Exception as item_err:
-                logger.error(f"Error processing episode {getattr(episode, 'title', 'Unknown')}: {item_err}", exc_info=True)
-                continue
-
-        result = ET.tostring(rss, encoding='unicode', xml_declaration=True)
-        logger.info(f"Successfully generated RSS feed for '{feed.name}' with {len(sorted_episodes)} episodes")
+        # The session is only held for the snapshot query; rendering happens in the pool
+        with ConnectionManager.efficient_session():
+            # The caller's header may predate an edit that landed before the version was read
+            header = slug_index.resolve(header.url_slug) or header
+            snapshot = build_feed_snapshot(header)
+        logger.debug(f"Total episodes to process: {len(snapshot.episodes)}")
 
-        # Only cache if not forced refresh
-        if not force:
-            cache_feed(feed.id, result)
-        else:
-            logger.info(f"Force refresh - not caching RSS feed for '{feed.name}'")
-            
+        result = render_service.render(snapshot, priority, version=version)
+        logger.info(f"Successfully generated RSS feed for '{header.name}'")
         return result
+    except RenderQueueFull:
+        logger.warning(f"Render queue full, could not generate RSS feed for '{header.name}'")
+        raise
     except Exception as e:
         logger.error(f"Critical error generating RSS feed: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,198 @@
+"""
+Immutable feed snapshots and a pure RSS renderer
+
+Nothing here touches Flask, the request or the database session, so a snapshot
+can be rendered in any thread or process.
+"""
+import logging
+from datetime import datetime, timedelta
+from xml.etree import ElementTree as ET
+import pytz
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = pytz.timezone('America/Los_Angeles')  # Pacific Time
+
+MAX_FEED_EPISODES = 100
+DEFAULT_RETENTION_DAYS = 90
+
+
+class _Snapshot:
+    """Base for immutable, slot-based value objects"""
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.__slots__):
+            raise TypeError(f"{type(self).__name__} expects {len(self.__slots__)} values, got {len(values)}")
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # Rebuild through __init__ so snapshots pickle across process boundaries
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def replace(self, **changes):
+        """Copy with some fields changed"""
+        return type(self)(*(changes.get(name, getattr(self, name)) for name in self.__slots__))
+
+
+class EpisodeSnapshot(_Snapshot):
+    # audio_url is the resolved direct link, ready for the enclosure; the enclosure_*
+    # and duration fields are None until the audio metadata probe has run
+    __slots__ = ('id', 'title', 'description', 'audio_url', 'release_date', 'is_recurring',
+                 'enclosure_length', 'enclosure_type', 'duration_seconds')
+
+
+class FeedSnapshot(_Snapshot):
+    # image_url is the resolved direct link
+    __slots__ = ('id', 'url_slug', 'name', 'description', 'image_url', 'website_url',
+                 'owner_name', 'retention_period', 'base_url', 'episodes')
+
+    @property
+    def feed_url(self):
+        return self.base_url.rstrip('/') + f"/feed/{self.url_slug}/rss"
+
+
+def _localize(value):
+    """Stored release dates are naive Pacific wall-clock times"""
+    return TIMEZONE.localize(value) if value.tzinfo is None else value
+
+
+def _recurring_release_date(ep, release_date, current_time):
+    """Move a recurring episode to its most recent anniversary"""
+    try:
+        # Calculate the date in the current year
+        current_year_date = release_date.replace(year=current_time.year)
+
+        # If that date is in the future, use last year's date instead
+        if current_year_date > current_time:
+            return release_date.replace(year=current_time.year - 1)
+        return current_year_date
+    except ValueError:
+        # Handle leap day (Feb 29) on non-leap years - move to Feb 28
+        if release_date.month == 2 and release_date.day == 29:
+            try:
+                current_year_date = release_date.replace(year=current_time.year, day=28)
+                if current_year_date > current_time:
+                    return release_date.replace(year=current_time.year - 1, day=28)
+                return current_year_date
+            except ValueError:
+                logger.warning(f"Could not adjust recurring episode '{ep.title}' date, using original: {release_date}")
+        else:
+            logger.warning(f"Unexpected date error for recurring episode '{ep.title}', using original: {release_date}")
+        return release_date
+
+
+def visible_episodes(snapshot, now=None):
+    """Episodes the feed shows at `now`: recurring ones moved to their latest anniversary,
+    everything limited to the retention window, newest first, at most MAX_FEED_EPISODES"""
+    current_time = (now or datetime.now(TIMEZONE)).astimezone(TIMEZONE)
+    lookback_days = snapshot.retention_period or DEFAULT_RETENTION_DAYS
+    lookback_date = current_time - timedelta(days=lookback_days)
+
+    visible = []
+    for ep in snapshot.episodes:
+        release_date = _localize(ep.release_date)
+        if ep.is_recurring:
+            release_date = _recurring_release_date(ep, release_date, current_time)
+
+        # Only include episodes within the lookback window
+        if lookback_date <= release_date <= current_time:
+            visible.append(ep.replace(release_date=release_date))
+
+    visible.sort(key=lambda ep: ep.release_date, reverse=True)
+    if len(visible) > MAX_FEED_EPISODES:
+        logger.info(f"Limited to {MAX_FEED_EPISODES} most recent episodes for bandwidth optimization")
+        visible = visible[:MAX_FEED_EPISODES]
+    return visible
+
+
+def format_duration(seconds):
+    """itunes:duration as HH:MM:SS"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def render_rss(snapshot, episodes, enclosure_lengths=None, now=None):
+    """Render RSS XML for a snapshot and its visible episodes.
+
+    enclosure_lengths maps direct audio URLs to byte sizes (as strings), for
+    episodes whose length has not been probed yet."""
+    enclosure_lengths = enclosure_lengths or {}
+    current_time = now or datetime.now(TIMEZONE)
+
+    rss = ET.Element('rss', version='2.0')
+    rss.set('xmlns:itunes', 'http://www.itunes.com/dtds/podcast-1.0.dtd')
+    rss.set('xmlns:content', 'http://purl.org/rss/1.0/modules/content/')
+    rss.set('xmlns:atom', 'http://www.w3.org/2005/Atom')
+
+    channel = ET.SubElement(rss, 'channel')
+
+    ET.SubElement(channel, 'title').text = snapshot.name
+    ET.SubElement(channel, 'description').text = snapshot.description
+
+    if snapshot.website_url:
+        ET.SubElement(channel, 'link').text = snapshot.website_url
+
+    ET.SubElement(channel, 'language').text = 'en-us'
+    ET.SubElement(channel, 'copyright').text = f'Copyright © {current_time.year} {snapshot.name}'
+
+    ET.SubElement(channel, 'itunes:author').text = snapshot.owner_name
+    ET.SubElement(channel, 'itunes:category').set('text', 'Arts')
+
+    if snapshot.image_url:
+        itunes_image = ET.SubElement(channel, 'itunes:image')
+        itunes_image.set('href', snapshot.image_url)
+
+    atom_link = ET.SubElement(channel, 'atom:link')
+    atom_link.set('href', snapshot.feed_url)
+    atom_link.set('rel', 'self')
+    atom_link.set('type', 'application/rss+xml')
+
+    for episode in episodes:
+        try:
+            item = ET.SubElement(channel, 'item')
+
+            ET.SubElement(item, 'title').text = episode.title
+            ET.SubElement(item, 'description').text = episode.description
+            ET.SubElement(item, 'itunes:summary').text = episode.description
+            ET.SubElement(item, 'pubDate').text = episode.release_date.strftime('%a, %d %b %Y %H:%M:%S %z')
+
+            guid = ET.SubElement(item, 'guid')
+            guid.text = f"episode_{episode.id}_{episode.release_date.year}"
+            guid.set('isPermaLink', 'false')
+
+            enclosure = ET.SubElement(item, 'enclosure')
+            enclosure.set('url', episode.audio_url)
+            enclosure.set('type', episode.enclosure_type or 'audio/mpeg')
+            if episode.enclosure_length:
+                enclosure.set('length', str(episode.enclosure_length))
+            else:
+                enclosure.set('length', enclosure_lengths.get(episode.audio_url, "0"))
+            if episode.duration_seconds:
+                ET.SubElement(item, 'itunes:duration').text = format_duration(episode.duration_seconds)
+        except (AttributeError, ValueError) as e:
+            logger.error(f"Error processing episode {getattr(episode, 'title', 'Unknown')}: {e}")
+            continue
+
+    return ET.tostring(rss, encoding='unicode', xml_declaration=True)
@@ -2,12 +2,14 @@ import json
 import os
 import logging
 import base64
-import requests
+import re
+import threading
+import time
+from collections import namedtuple
 from app import db
 from flask import Blueprint, redirect, request, url_for, session
 from flask_login import login_required, login_user, logout_user
 from models import User
-from oauthlib.oauth2 import WebApplicationClient
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -16,7 +18,123 @@ logger = logging.getLogger(__name__)
 # Initialize blueprint
 google_auth = Blueprint("google_auth", __name__)
 
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+# Overridable so the login flow can run against a local fake OpenID provider
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
+)
+
+# Used when the provider sends no max-age; bounds keep a bad header from pinning or thrashing the cache
+PROVIDER_CFG_TTL = 3600
+MIN_PROVIDER_CFG_TTL = 60
+MAX_PROVIDER_CFG_TTL = 24 * 3600
+
+ProviderEndpoints = namedtuple('ProviderEndpoints', ['authorization_endpoint', 'token_endpoint', 'userinfo_endpoint'])
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class DiscoveryCache:
+    """OpenID discovery document cached with HTTP semantics.
+
+    Freshness follows Cache-Control max-age; once stale the pinned endpoints keep
+    being served while one background thread revalidates with If-None-Match, so
+    only the very first login in a process waits for the network."""
+
+    def __init__(self, url):
+        self.url = url
+        self.endpoints = None
+        self._etag = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Pinned provider endpoints, fetching synchronously only when there are none yet"""
+        if self.endpoints is None:
+            with self._lock:
+                if self.endpoints is None:
+                    self._refresh()
+        elif time.monotonic() >= self._expires_at:
+            self._refresh_in_background()
+        return self.endpoints
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._refresh()
+            except Exception as e:
+                # Keep serving the endpoints we have; the next stale read retries
+                logger.warning(f"Background refresh of OpenID discovery document failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name='oidc-discovery-refresh', daemon=True).start()
+
+    def _refresh(self):
+        # The HTTP client is imported on first login rather than at app startup
+        from http_client import http_client
+
+        headers = {'If-None-Match': self._etag} if self._etag and self.endpoints else {}
+        response = http_client.get(self.url, headers=headers)
+        if response.status_code == 304:
+            self._expires_at = time.monotonic() + self._max_age(response)
+            return
+        response.raise_for_status()
+
+        document = response.json()
+        self.endpoints = ProviderEndpoints(
+            document["authorization_endpoint"], document["token_endpoint"], document["userinfo_endpoint"]
+        )
+        self._etag = response.headers.get('ETag')
+        self._expires_at = time.monotonic() + self._max_age(response)
+        logger.info(f"Loaded OpenID discovery document from {self.url}")
+
+    @staticmethod
+    def _max_age(response):
+        match = _MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else PROVIDER_CFG_TTL
+        return min(max(max_age, MIN_PROVIDER_CFG_TTL), MAX_PROVIDER_CFG_TTL)
+
+
+discovery_cache = DiscoveryCache(GOOGLE_DISCOVERY_URL)
+
+
+def get_google_provider_cfg():
+    """Google's OpenID Connect endpoints, cached in-process"""
+    return discovery_cache.get()
+
+
+def _secure_url(url):
+    """Force https, except when OAUTHLIB_INSECURE_TRANSPORT allows a local test provider"""
+    if os.environ.get('OAUTHLIB_INSECURE_TRANSPORT') == '1':
+        return url
+    return url.replace("http://", "https://", 1) if url.startswith("http://") else url
+
+
+def upsert_google_user(google_id, email, name):
+    """Find or create the user for a Google account in one statement; refreshes email and name"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+    statement = dialect_insert(User).values(google_id=google_id, email=email, name=name)
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.google_id],
+        set_={'email': statement.excluded.email, 'name': statement.excluded.name},
+    ).returning(User)
+    user = db.session.scalars(statement, execution_options={'populate_existing': True}).one()
+    db.session.commit()
+
+    # Core upserts bypass the ORM events that normally invalidate the identity cache
+    from identity_cache import identity_cache
+    identity_cache.invalidate(user.id)
+    return user
 
 def get_oauth_credentials():
     """Get OAuth credentials based on environment"""
@@ -51,12 +169,13 @@ def get_oauth_credentials():
 @google_auth.route("/google_login")
 def login():
     """Initiates the Google OAuth login flow"""
+    from oauthlib.oauth2 import WebApplicationClient
+
     try:
         client_id, _ = get_oauth_credentials()
 
         # Get Google provider configuration
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL, timeout=10).json()
-        authorization_endpoint = google_provider_cfg["authorization_endpoint"]
+        authorization_endpoint = get_google_provider_cfg().authorization_endpoint
 
         # Initialize client
         client = WebApplicationClient(client_id)
@@ -66,7 +185,7 @@ def login():
         session['oauth_state'] = state
 
         # Use https for callback URL
-        callback_url = f"https://{request.host}/google_login/callback"
+        callback_url = _secure_url(f"http://{request.host}/google_login/callback")
         logger.info(f"Login - Using callback URL: {callback_url}")
 
         request_uri = client.prepare_request_uri(
@@ -88,6 +207,9 @@ def login():
 @google_auth.route("/google_login/callback")
 def callback():
     """Handles the callback from Google OAuth"""
+    from http_client import http_client
+    from oauthlib.oauth2 import WebApplicationClient
+
     try:
         # Verify state parameter
         stored_state = session.pop('oauth_state', None)
@@ -101,7 +223,7 @@ def callback():
         client_id, client_secret = get_oauth_credentials()
         client = WebApplicationClient(client_id)
 
-        callback_url = f"https://{request.host}/google_login/callback"
+        callback_url = _secure_url(f"http://{request.host}/google_login/callback")
         logger.info(f"Callback - Using callback URL: {callback_url}")
 
         code = request.args.get("code")
@@ -109,27 +231,23 @@ def callback():
             logger.error("No code received from Google")
             return "Error: No code received from Google", 400
 
-        # Get token endpoint
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL, timeout=10).json()
-        token_endpoint = google_provider_cfg["token_endpoint"]
+        # Endpoints are pinned in memory, so this normally costs no round trip
+        endpoints = get_google_provider_cfg()
 
         # Prepare and send token request
         token_url, headers, body = client.prepare_token_request(
-            token_endpoint,
-            authorization_response=request.url.replace("http://", "https://"),
+            endpoints.token_endpoint,
+            authorization_response=_secure_url(request.url),
             redirect_url=callback_url,
             code=code
         )
+        token_url = _secure_url(token_url)
 
-        if not token_url.startswith("https://"):
-            token_url = token_url.replace("http://", "https://", 1)
-
-        token_response = requests.post(
+        token_response = http_client.post(
             token_url,
             headers=headers,
             data=body,
-            auth=(client_id, client_secret),
-            timeout=10
+            auth=(client_id, client_secret)
         )
 
         if not token_response.ok:
@@ -139,11 +257,9 @@ def callback():
         client.parse_request_body_response(json.dumps(token_response.json()))
 
         # Get user info
-        userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-        uri, headers, body = client.add_token(userinfo_endpoint)
-        if not uri.startswith("https://"):
-            uri = uri.replace("http://", "https://", 1)
-        userinfo_response = requests.get(uri, headers=headers, data=body, timeout=10)
+        uri, headers, body = client.add_token(endpoints.userinfo_endpoint)
+        uri = _secure_url(uri)
+        userinfo_response = http_client.get(uri, headers=headers, data=body)
 
         if not userinfo_response.ok:
             logger.error(f"Userinfo response error: {userinfo_response.text}")
@@ -159,15 +275,8 @@ def callback():
         email = userinfo["email"]
         name = userinfo.get("name", email.split("@")[0])
 
-        # Find or create user
-        user = User.query.filter_by(google_id=google_id).first()
-        if not user:
-            user = User(google_id=google_id, name=name, email=email)
-            db.session.add(user)
-            db.session.commit()
-            logger.info(f"New user created: {email}")
-        else:
-            logger.info(f"Existing user logged in: {email}")
+        user = upsert_google_user(google_id, email, name)
+        logger.info(f"User logged in: {email}")
 
         login_user(user)
         return redirect(url_for("dashboard"))
@@ -0,0 +1,56 @@
+"""
+Gunicorn configuration for production
+
+Concurrency model:
+- WEB_CONCURRENCY worker processes (default 2), each running GUNICORN_THREADS
+  request threads (gthread worker, default 4). Up to workers * threads requests
+  are served at once, and each holds at most one database connection (NullPool),
+  so keep workers * threads below the Supabase pooler's client limit. With the
+  embedded SQLite backend each worker keeps a small pool instead (sqlite_backend.py).
+- The app is preloaded in the master: create_all and migrations run once, and
+  workers fork with the code already imported. Each worker disposes the
+  inherited engines after fork so no connection is shared across processes.
+- The background job scheduler starts after a worker's first request and runs
+  in exactly one worker per host, elected by a file lock (see
+  app.start_background_services); each run of a leader-only job also holds
+  a PostgreSQL transaction advisory lock so it never overlaps a run on another
+  host (see scheduler.py).
+- Every worker has its own caches and, while rendering feeds, its own render
+  pool of RENDER_WORKERS processes (see render_service.py). Invalidations are
+  appended to a log file that every worker checks before each request, so an
+  edit or background job handled by one worker reaches the others before their
+  next response (see invalidation_log.py). Workers on other hosts only see it
+  once their caches expire.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+
+# Clear conflicting PostgreSQL environment variables to ensure Supabase is used
+for var in ['PGDATABASE', 'PGHOST', 'PGPORT', 'PGUSER', 'PGPASSWORD']:
+    os.environ.pop(var, None)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+preload_app = True
+
+# Feed renders can wait on enclosure probes, so allow well beyond RENDER_TIMEOUT
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Drop engine state inherited from the master"""
+    from app import app, db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the master's connections alone; the worker opens its own
+            engine.dispose(close=False)
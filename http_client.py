@@ -0,0 +1,194 @@
+"""
+Shared outbound HTTP client
+
+One requests.Session per process with keep-alive connection pools per host, so
+repeated probes and OAuth calls reuse connections (and their TLS handshakes)
+instead of opening one per request. Timeouts, retries and a per-host rate limit
+are configured in one place, and per-host metrics are kept for /http/status.
+requests is imported on first use so app startup does not pay for it.
+"""
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+POOL_HOSTS = 20                                              # hosts with a pool of their own
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))      # keep-alive connections per host
+HOST_RATE = float(os.environ.get('HTTP_HOST_RATE', '20'))    # requests per second per host
+HOST_BURST = int(os.environ.get('HTTP_HOST_BURST', '100'))  # one full feed regeneration
+MAX_RATE_WAIT = 5.0  # seconds a caller may wait for a host's rate limit before failing
+
+
+class RateLimited(Exception):
+    """Raised when a host's rate limit would make the caller wait too long"""
+
+
+class _TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+
+class HostRateLimiter:
+    """Token bucket per host; callers sleep until a token is available"""
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, max_wait=MAX_RATE_WAIT):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = _TokenBucket(self.burst)
+            now = time.monotonic()
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            # Reserve the token now, so concurrent callers queue behind each other
+            wait = max(0.0, (1 - bucket.tokens) / self.rate)
+            if wait > max_wait:
+                raise RateLimited(f"Rate limit for {host} would delay the request by {wait:.1f}s")
+            bucket.tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HostMetrics:
+    __slots__ = ('requests', 'failures', 'retries', 'rate_limited', 'total_time', 'rate_wait', 'statuses')
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.total_time = 0.0
+        self.rate_wait = 0.0
+        self.statuses = {}
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'retries': self.retries,
+            'rate_limited': self.rate_limited,
+            'avg_time': round(self.total_time / self.requests, 4) if self.requests else None,
+            'rate_wait': round(self.rate_wait, 3),
+            'statuses': dict(self.statuses),
+        }
+
+
+class HttpClient:
+    """Pooled requests.Session shared by every outbound call in the process"""
+
+    def __init__(self):
+        self._session = None
+        self._adapter = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.limiter = HostRateLimiter()
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _get_session(self):
+        # A session must not cross a fork: its pooled sockets belong to the parent
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._build_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=MAX_RETRIES,
+            connect=MAX_RETRIES,
+            read=MAX_RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),  # token exchanges are never replayed
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self._adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE,
+                                    max_retries=retry, pool_block=False)
+        session = requests.Session()
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        session.headers['User-Agent'] = 'PodcastPal/1.0'
+        return session
+
+    def _host_metrics(self, host):
+        metrics = self._metrics.get(host)
+        if metrics is None:
+            with self._metrics_lock:
+                metrics = self._metrics.setdefault(host, HostMetrics())
+        return metrics
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """requests-style call through the shared pool, rate limit and metrics"""
+        host = urllib.parse.urlsplit(url).hostname or ''
+        metrics = self._host_metrics(host)
+        try:
+            metrics.rate_wait += self.limiter.acquire(host)
+        except RateLimited:
+            metrics.rate_limited += 1
+            raise
+
+        start = time.perf_counter()
+        try:
+            response = self._get_session().request(
+                method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+            )
+        except Exception:
+            metrics.requests += 1
+            metrics.failures += 1
+            metrics.total_time += time.perf_counter() - start
+            raise
+
+        metrics.requests += 1
+        metrics.total_time += time.perf_counter() - start
+        metrics.statuses[response.status_code] = metrics.statuses.get(response.status_code, 0) + 1
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None:
+            metrics.retries += len(retries.history)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self):
+        """Per-host request stats plus how many connections each pool has opened"""
+        with self._metrics_lock:
+            hosts = {host: metrics.to_dict() for host, metrics in self._metrics.items()}
+        if self._adapter is not None and self._pid == os.getpid():
+            for key in list(self._adapter.poolmanager.pools.keys()):
+                pool = self._adapter.poolmanager.pools.get(key)
+                if pool is not None and pool.host in hosts:
+                    entry = hosts[pool.host]
+                    entry['connections_opened'] = entry.get('connections_opened', 0) + pool.num_connections
+                    entry['pooled_requests'] = entry.get('pooled_requests', 0) + pool.num_requests
+        return {'pid': os.getpid(), 'hosts': hosts}
+
+
+# Global instance
+http_client = HttpClient()
@@ -0,0 +1,114 @@
+"""
+Process-local user identity cache so authenticated page views skip the user query
+
+load_user rebuilds the User from cached column values and attaches it to the
+session without SQL, so relationships, edits and commits behave as if it had
+been loaded. ORM updates and deletes of a user invalidate its entry here and,
+through the invalidation log, in the other workers on this host; the TTL
+bounds staleness when another host changes the row.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import db
+from invalidation_log import invalidation_log
+from models import User
+
+logger = logging.getLogger(__name__)
+
+
+class IdentityCache:
+    """Bounded LRU map of user id -> (column values, loaded_at)"""
+
+    MAX_ENTRIES = 10000
+    MAX_TRACKED_USERS = 10000  # invalidation stamps kept
+    TTL = float(os.environ.get('IDENTITY_CACHE_TTL', '60'))  # seconds
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # user_id -> stamp of its last invalidation, oldest first; stamps come from one
+        # counter, and a user without an entry counts as invalidated at _base_stamp
+        self._versions = OrderedDict()
+        self._stamp = 0
+        self._base_stamp = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, user_id):
+        """The User for user_id, attached to the current session; None if it does not exist"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                values, loaded_at = entry
+                if time.monotonic() - loaded_at < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return self._attach(values)
+                del self._entries[user_id]
+            self.misses += 1
+            version = self._versions.get(user_id, self._base_stamp)
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        values = {attr.key: getattr(user, attr.key) for attr in sa_inspect(User).column_attrs}
+        with self._lock:
+            # An invalidation raced the load: serve this copy but don't cache it
+            if self._versions.get(user_id, self._base_stamp) == version:
+                self._entries[user_id] = (values, time.monotonic())
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    @staticmethod
+    def _attach(values):
+        user = User(**values)
+        make_transient_to_detached(user)
+        # load=False attaches the instance as persistent without a SELECT
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        """Drop a user here and in the other workers on this host"""
+        self.drop(user_id)
+        invalidation_log.publish('user', user_id)
+
+    def drop(self, user_id):
+        """Drop a user from this process only"""
+        with self._lock:
+            self._stamp += 1
+            self._versions[user_id] = self._stamp
+            self._versions.move_to_end(user_id)
+            # A load in flight for a pruned user is served but not cached
+            while len(self._versions) > self.MAX_TRACKED_USERS:
+                _, self._base_stamp = self._versions.popitem(last=False)
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._stamp += 1
+            self._base_stamp = self._stamp
+            self._versions.clear()
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+# Global instance
+identity_cache = IdentityCache()
+invalidation_log.subscribe('user', lambda key: identity_cache.drop(int(key)), identity_cache.clear)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    identity_cache.invalidate(target.id)
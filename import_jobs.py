@@ -0,0 +1,313 @@
+"""
+Background CSV import jobs so large uploads don't tie up request workers
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app import app
+
+logger = logging.getLogger(__name__)
+
+# Status records live on disk (like PersistentCache) so any worker process can answer a poll
+STAGING_DIR = "/tmp/podcast_imports"
+MAX_CONCURRENT_IMPORTS = 2
+STATUS_RETENTION_HOURS = 24
+STATUS_ERROR_LIMIT = 10
+# Owners touch their unfinished jobs' status files this often; a queued or
+# running job whose file has gone untouched for STALE_AFTER has lost its worker
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = timedelta(minutes=5)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Unfinished jobs owned by this process's executor
+_live_jobs = set()
+_heartbeat = None
+
+
+def _owner():
+    """Identifies the process running a job; read per call since forked workers get new pids"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _executor_lock:
+            job_ids = list(_live_jobs)
+        for job_id in job_ids:
+            try:
+                os.utime(ImportJobStore.status_path(job_id))
+            except OSError:
+                pass
+
+
+def _get_executor():
+    """Create the worker pool lazily so forked server processes each get their own"""
+    global _executor, _heartbeat
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_IMPORTS,
+                                           thread_name_prefix='csv-import')
+        if _heartbeat is None or not _heartbeat.is_alive():
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name='csv-import-heartbeat', daemon=True)
+            _heartbeat.start()
+        return _executor
+
+
+class ImportJobStore:
+    """File-backed job status records"""
+
+    @classmethod
+    def _ensure_dir(cls):
+        os.makedirs(STAGING_DIR, exist_ok=True)
+
+    @classmethod
+    def upload_path(cls, job_id):
+        return os.path.join(STAGING_DIR, f"{job_id}.csv")
+
+    @classmethod
+    def status_path(cls, job_id):
+        return os.path.join(STAGING_DIR, f"{job_id}.json")
+
+    @classmethod
+    def write(cls, job_id, status):
+        """Atomically replace a job's status record"""
+        cls._ensure_dir()
+        status['updated_at'] = datetime.utcnow().isoformat()
+        fd, tmp_path = tempfile.mkstemp(dir=STAGING_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp_path, cls.status_path(job_id))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def read(cls, job_id):
+        try:
+            with open(cls.status_path(job_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def age_seconds(cls, job_id):
+        try:
+            return time.time() - os.path.getmtime(cls.status_path(job_id))
+        except OSError:
+            return None
+
+    @classmethod
+    def clear_old(cls, max_age_hours=STATUS_RETENTION_HOURS):
+        """Remove status records and orphaned uploads older than the retention window"""
+        if not os.path.exists(STAGING_DIR):
+            return
+        cutoff = time.time() - timedelta(hours=max_age_hours).total_seconds()
+        removed_count = 0
+        for filename in os.listdir(STAGING_DIR):
+            filepath = os.path.join(STAGING_DIR, filename)
+            try:
+                if os.path.getmtime(filepath) < cutoff:
+                    os.remove(filepath)
+                    removed_count += 1
+            except OSError:
+                continue
+        if removed_count > 0:
+            logger.info(f"Cleaned up {removed_count} old import job files")
+
+
+class ImportJob:
+    """Runs one staged CSV import and publishes its progress"""
+
+    def __init__(self, job_id, feed_id, user_id, filename, mode='append'):
+        self.job_id = job_id
+        self.feed_id = feed_id
+        self.mode = mode
+        self.user_id = user_id
+        self.filename = filename
+        self.path = ImportJobStore.upload_path(job_id)
+        self.bytes_total = os.path.getsize(self.path)
+        self.started = None
+        self._upload = None
+        self._last_publish = 0.0
+
+    def status(self, state, report=None, error=None):
+        status = {
+            'job_id': self.job_id,
+            'feed_id': self.feed_id,
+            'user_id': self.user_id,
+            'filename': self.filename,
+            'mode': self.mode,
+            'state': state,
+            'rows_processed': 0,
+            'added': 0,
+            'updated': 0,
+            'skipped': 0,
+            'failed': 0,
+            'errors': [],
+            'progress': 0.0,
+            'eta_seconds': None,
+            'error': error,
+            'owner': _owner(),
+        }
+        if report is not None:
+            status.update({
+                'rows_processed': report.rows_processed,
+                'added': report.added,
+                'updated': report.updated,
+                'skipped': report.skipped,
+                'failed': report.failed,
+                'errors': [{'line': line, 'message': message}
+                           for line, message in report.errors[:STATUS_ERROR_LIMIT]],
+            })
+        if state == 'completed':
+            status['progress'] = 1.0
+            status['eta_seconds'] = 0
+        elif self._upload is not None and self.bytes_total and self.started:
+            # Progress is measured in bytes read, which also gives a cheap ETA
+            try:
+                bytes_read = min(self._upload.tell(), self.bytes_total)
+            except (OSError, ValueError):
+                bytes_read = 0
+            progress = bytes_read / self.bytes_total
+            status['progress'] = round(progress, 4)
+            if progress > 0:
+                elapsed = time.monotonic() - self.started
+                status['eta_seconds'] = round(elapsed * (1 - progress) / progress, 1)
+        return status
+
+    def _on_progress(self, report):
+        # Publishing is throttled; each batch would otherwise rewrite the file
+        now = time.monotonic()
+        if now - self._last_publish >= 1.0:
+            self._last_publish = now
+            ImportJobStore.write(self.job_id, self.status('running', report))
+
+    def run(self):
+        from csv_importer import EpisodeCSVImporter
+        from cache_manager import invalidate_feed_caches
+        from app import db
+
+        with app.app_context():
+            importer = EpisodeCSVImporter(self.feed_id, mode=self.mode, progress_callback=self._on_progress)
+            try:
+                self.started = time.monotonic()
+                with open(self.path, 'rb') as upload:
+                    self._upload = upload
+                    ImportJobStore.write(self.job_id, self.status('running', importer.report))
+                    report = importer.run(upload)
+
+                ImportJobStore.write(self.job_id, self.status('completed', report))
+                logger.info(f"Import job {self.job_id} for feed {self.feed_id} completed: "
+                            f"{report.added} added, {report.updated} updated, {report.skipped} skipped, "
+                            f"{report.failed} failed "
+                            f"in {time.monotonic() - self.started:.1f}s")
+            except Exception as e:
+                logger.error(f"Import job {self.job_id} for feed {self.feed_id} failed: {e}")
+                db.session.rollback()
+                ImportJobStore.write(self.job_id, self.status('failed', importer.report, error=str(e)))
+            finally:
+                self._upload = None
+                # Invalidate once per job; batches committed before a failure still changed the feed
+                invalidate_feed_caches(self.feed_id)
+                db.session.remove()
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+                with _executor_lock:
+                    _live_jobs.discard(self.job_id)
+
+
+def submit_import(feed_id, user_id, file_storage, mode='append'):
+    """Stage an uploaded CSV to disk and queue it for background import; returns the job id"""
+    ImportJobStore.clear_old()
+    ImportJobStore._ensure_dir()
+
+    job_id = uuid.uuid4().hex
+    file_storage.save(ImportJobStore.upload_path(job_id))
+
+    job = ImportJob(job_id, feed_id, user_id, file_storage.filename, mode=mode)
+    executor = _get_executor()
+    with _executor_lock:
+        _live_jobs.add(job_id)
+    ImportJobStore.write(job_id, job.status('queued'))
+    executor.submit(job.run)
+
+    logger.info(f"Queued import job {job_id} for feed {feed_id} ({job.bytes_total} bytes)")
+    return job_id
+
+
+def get_job_status(job_id, user_id):
+    """Return a job's status if it exists and belongs to the user"""
+    # Job ids are hex uuids; anything else could escape the staging directory
+    if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+        return None
+    status = ImportJobStore.read(job_id)
+    if status is None or status.get('user_id') != user_id:
+        return None
+    if status.get('state') in ('queued', 'running'):
+        status = _fail_if_orphaned(job_id, status)
+    return status
+
+
+def _fail_if_orphaned(job_id, status):
+    """Mark an unfinished job failed if no live executor will finish it; returns its current status"""
+    with _executor_lock:
+        if job_id in _live_jobs:
+            return status
+        # This process's jobs write their final state before leaving _live_jobs under
+        # this lock, so a job that finished since the first read shows it here
+        current = ImportJobStore.read(job_id)
+        if current is None or current.get('state') not in ('queued', 'running'):
+            return current or status
+        if not _is_orphaned(job_id, current):
+            return current
+        return _mark_orphaned(job_id, current)
+
+
+def _is_orphaned(job_id, status):
+    """True for an unfinished job not in this process's executor that no other one will finish"""
+    owner = status.get('owner') or ''
+    if owner == _owner():
+        # Written by this process, yet not in its executor: a reused pid, or the job never ran
+        return True
+    host, _, pid = owner.rpartition(':')
+    if host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid)):
+        return True
+    age = ImportJobStore.age_seconds(job_id)
+    return age is not None and age > STALE_AFTER.total_seconds()
+
+
+def _mark_orphaned(job_id, status):
+    logger.warning(f"Import job {job_id} for feed {status.get('feed_id')} lost its worker "
+                   f"({status.get('owner')}) while {status.get('state')}; marking it failed")
+    status.update(state='failed', eta_seconds=None,
+                  error='The import stopped when the server restarted; rows before that point were '
+                        'saved. Upload the file again to import the rest.')
+    ImportJobStore.write(job_id, status)
+    try:
+        os.remove(ImportJobStore.upload_path(job_id))
+    except OSError:
+        pass
+    return status
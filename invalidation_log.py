@@ -0,0 +1,126 @@
+"""
+Cross-process cache invalidation for the gunicorn workers on one host
+
+Each worker keeps its own feed, slug and identity caches. A process that
+invalidates an entry appends a line to a shared log file; every worker stats
+the file before each request and replays the lines it has not seen yet, so an
+edit handled by one worker (or by a background job) reaches the others before
+their next response. The stat is the only cost on a request when nothing
+changed, so cached RSS hits still skip the database.
+
+The log is rotated once it passes MAX_LOG_BYTES. A worker that finds the file
+replaced has missed whatever was appended to the old one, so it clears every
+subscribed cache instead.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_LOG_PATH = os.environ.get('INVALIDATION_LOG_PATH', '/tmp/podcastpal-invalidations.log')
+MAX_LOG_BYTES = int(os.environ.get('INVALIDATION_LOG_MAX_BYTES', str(1024 * 1024)))
+
+
+class InvalidationLog:
+    """Append-only file of "<pid> <kind> <key>" lines shared by the processes of one host"""
+
+    def __init__(self, path=INVALIDATION_LOG_PATH, max_bytes=MAX_LOG_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._handlers = {}  # kind -> (invalidate(key), clear())
+        self._lock = threading.Lock()
+        # Entries written before this process started concern caches it doesn't have yet
+        self._inode, self._offset = self._stat()
+        self.replayed = 0
+        self.resets = 0
+
+    def subscribe(self, kind, invalidate, clear):
+        """Replay `kind` entries from other processes with invalidate(key); clear() after a rotation"""
+        self._handlers[kind] = (invalidate, clear)
+
+    def publish(self, kind, key):
+        """Tell the other processes to drop `key` from their `kind` caches"""
+        line = f"{os.getpid()} {kind} {key}\n".encode()
+        try:
+            # O_APPEND writes this small are never interleaved with another process's
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            logger.warning(f"Could not publish {kind} {key} invalidation: {e}")
+
+    def poll(self):
+        """Apply entries appended by other processes since the last poll"""
+        inode, size = self._stat()
+        if inode == self._inode and size == self._offset:
+            return
+        with self._lock:
+            inode, size = self._stat()
+            if self._inode is None:
+                # The first entry created the file, so nothing was missed
+                self._inode, self._offset = inode, 0
+            elif inode != self._inode or size < self._offset:
+                self._reset(inode)
+            if size > self._offset:
+                self._replay()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _replay(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written is picked up by the next poll
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        # Our own entries were applied when they were published
+        own_pid = str(os.getpid())
+        for line in data[:end].decode(errors='replace').splitlines():
+            parts = line.split(' ', 2)
+            if len(parts) != 3 or parts[0] == own_pid:
+                continue
+            handlers = self._handlers.get(parts[1])
+            if handlers is None:
+                continue
+            try:
+                handlers[0](parts[2])
+                self.replayed += 1
+            except Exception as e:
+                logger.warning(f"Could not apply {parts[1]} {parts[2]} invalidation: {e}")
+
+    def _reset(self, inode):
+        """The log was rotated or removed: entries may have been missed, so start from empty caches"""
+        for _, clear in self._handlers.values():
+            clear()
+        self._inode, self._offset = inode, 0
+        self.resets += 1
+        logger.info(f"Invalidation log replaced; cleared local caches in process {os.getpid()}")
+
+    def _rotate(self):
+        # Renaming gives readers a new inode, which tells them to reset; a second
+        # process rotating at the same moment only moves the fresh file aside
+        try:
+            os.replace(self.path, f"{self.path}.old")
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {'path': self.path, 'offset': self._offset, 'replayed': self.replayed, 'resets': self.resets}
+
+
+# Global instance
+invalidation_log = InvalidationLog()
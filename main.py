@@ -1,5 +1,4 @@
 import os
-from app import app
 
 import logging
 
@@ -16,4 +15,7 @@ for var in pg_vars_to_clear:
 # Note: Database ping service removed - RSS feed access tracking keeps Supabase active
 
 if __name__ == "__main__":
+    # Imported under the guard: render pool workers are spawned processes that
+    # re-import this module, and they must not start the app
+    from app import app
     app.run(host="0.0.0.0", port=5000, debug=True)
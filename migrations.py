@@ -0,0 +1,242 @@
+"""
+Versioned schema migrations
+
+Applied versions are recorded in schema_migrations. On startup a single query
+reads them; when none is pending nothing else runs, not even db.create_all().
+A migration that needs data fixed first raises MigrationDeferred; later ones
+still apply, and the scheduler's deferred-migrations job retries it until it
+does, so startup never pays for the retry.
+"""
+import logging
+from collections import namedtuple
+from app import db
+from sqlalchemy import inspect as sa_inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple('Migration', ['version', 'name', 'apply'])
+
+
+class MigrationDeferred(Exception):
+    """Raised by a migration that cannot apply until data is fixed; it is retried in the background"""
+
+# Serialises each migration across processes that start at the same time (PostgreSQL only)
+MIGRATION_LOCK_KEY = 7201
+MAX_REPORTED_CONFLICTS = 20
+
+
+def _column_exists(table, column):
+    # A fresh inspector each time: its reflection cache would miss columns added since
+    return any(c['name'] == column for c in sa_inspect(db.session.connection()).get_columns(table))
+
+
+def _index_exists(table, name):
+    return any(i['name'] == name for i in sa_inspect(db.session.connection()).get_indexes(table))
+
+
+def _add_column(table, column, column_type):
+    """ALTER TABLE ADD COLUMN unless create_all already made it (works on PostgreSQL and SQLite)"""
+    if not _column_exists(table, column):
+        db.session.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {column_type}'))
+
+
+def _add_feed_last_rss_access():
+    _add_column('feed', 'last_rss_access', 'TIMESTAMP')
+
+
+def _add_feed_retention_period():
+    _add_column('feed', 'retention_period', 'INTEGER DEFAULT 90')
+
+
+def _add_episode_content_hash():
+    # Used by idempotent CSV re-imports
+    _add_column('episode', 'content_hash', 'VARCHAR(64)')
+
+
+def _add_episode_unique_audio_url():
+    # Enforce one episode per (feed_id, audio_url) for upsert imports. Distinct
+    # episodes can share a file, so existing duplicates are never deleted: they are
+    # reported and the index waits until their owners give them separate URLs
+    if _index_exists('episode', 'uq_episode_feed_audio_url'):
+        return
+    conflicts = db.session.execute(text("""
+        SELECT feed_id, audio_url, COUNT(*) AS episodes FROM episode
+        GROUP BY feed_id, audio_url HAVING COUNT(*) > 1
+        ORDER BY feed_id
+    """)).all()
+    if conflicts:
+        for row in conflicts[:MAX_REPORTED_CONFLICTS]:
+            logger.warning(f"Feed {row.feed_id} has {row.episodes} episodes with audio URL {row.audio_url}")
+        raise MigrationDeferred(f"{len(conflicts)} audio URLs are shared by several episodes of the same feed")
+    db.session.execute(text("CREATE UNIQUE INDEX uq_episode_feed_audio_url ON episode (feed_id, audio_url)"))
+
+
+def _add_user_api_token_hash():
+    # Batch episode API tokens
+    if _column_exists('user', 'api_token_hash'):
+        return
+    if db.engine.dialect.name == 'postgresql':
+        _add_column('user', 'api_token_hash', 'VARCHAR(64) UNIQUE')
+    else:
+        # SQLite cannot add a UNIQUE column; a unique index enforces the same thing
+        _add_column('user', 'api_token_hash', 'VARCHAR(64)')
+        db.session.execute(text('CREATE UNIQUE INDEX uq_user_api_token_hash ON "user" (api_token_hash)'))
+
+
+def _install_search_schema():
+    # Full-text search structures (tsvector/GIN or FTS5 depending on dialect)
+    from episode_search import install_search_schema
+    install_search_schema()
+
+
+def _create_episode_archive():
+    # Retention-driven archive tier (see archive.py)
+    from models import EpisodeArchive
+    EpisodeArchive.__table__.create(db.engine, checkfirst=True)
+
+
+def _add_resolved_urls():
+    # Direct links are resolved on write (url_resolvers.py); backfill existing rows once
+    for table, column in (('episode', 'resolved_audio_url'), ('episode_archive', 'resolved_audio_url'),
+                          ('feed', 'resolved_image_url')):
+        _add_column(table, column, 'VARCHAR(1000)')
+
+    from url_resolvers import normalize_url
+    for table, source, column in (('episode', 'audio_url', 'resolved_audio_url'),
+                                  ('episode_archive', 'audio_url', 'resolved_audio_url'),
+                                  ('feed', 'image_url', 'resolved_image_url')):
+        urls = db.session.execute(text(
+            f"SELECT DISTINCT {source} FROM {table} WHERE {source} IS NOT NULL AND {column} IS NULL"
+        )).scalars().all()
+        if urls:
+            db.session.execute(
+                text(f"UPDATE {table} SET {column} = :resolved WHERE {source} = :url AND {column} IS NULL"),
+                [{'url': url, 'resolved': normalize_url(url)} for url in urls]
+            )
+
+
+def _add_enclosure_metadata():
+    # Filled in by the audio-metadata-probe job (audio_probe.py)
+    columns = (('enclosure_length', 'BIGINT'), ('enclosure_type', 'VARCHAR(50)'),
+               ('duration_seconds', 'INTEGER'), ('bitrate', 'INTEGER'), ('probed_at', 'TIMESTAMP'))
+    for table in ('episode', 'episode_archive'):
+        for column, column_type in columns:
+            _add_column(table, column, column_type)
+
+
+def _redesign_episode_indexes():
+    # ix_feed_url_slug duplicated the url_slug unique constraint and ix_episode_feed_id
+    # was a prefix of ix_episode_feed_date; the replacement composite index carries
+    # id and is_recurring, and recurring episodes get a partial index of their own
+    include = ' INCLUDE (id, is_recurring)' if db.engine.dialect.name == 'postgresql' else ''
+    db.session.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_episode_feed_date_cover ON episode (feed_id, release_date){include}"
+    ))
+    db.session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_episode_feed_recurring ON episode (feed_id) WHERE is_recurring = true"
+    ))
+    for index in ('ix_episode_feed_date', 'ix_episode_feed_id', 'ix_feed_url_slug'):
+        db.session.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+
+# Append only: never renumber a migration or change what a shipped one does
+MIGRATIONS = [
+    Migration(1, 'feed_last_rss_access', _add_feed_last_rss_access),
+    Migration(2, 'feed_retention_period', _add_feed_retention_period),
+    Migration(3, 'episode_content_hash', _add_episode_content_hash),
+    Migration(4, 'episode_unique_audio_url', _add_episode_unique_audio_url),
+    Migration(5, 'user_api_token_hash', _add_user_api_token_hash),
+    Migration(6, 'episode_search_schema', _install_search_schema),
+    Migration(7, 'episode_archive', _create_episode_archive),
+    Migration(8, 'resolved_urls', _add_resolved_urls),
+    Migration(9, 'episode_enclosure_metadata', _add_enclosure_metadata),
+    Migration(10, 'episode_index_redesign', _redesign_episode_indexes),
+]
+
+def applied_versions():
+    """Versions recorded in schema_migrations; None when the table does not exist yet"""
+    try:
+        return set(db.session.execute(text("SELECT version FROM schema_migrations")).scalars())
+    except (ProgrammingError, OperationalError):
+        db.session.rollback()
+        return None
+
+
+def _create_version_table():
+    db.session.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    db.session.commit()
+
+
+def _apply(migration, is_postgres):
+    """Apply one migration in its own transaction; False if another process already did"""
+    if is_postgres:
+        # Transaction-scoped, so it also holds behind a transaction-mode pooler
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+    applied = db.session.execute(
+        text("SELECT 1 FROM schema_migrations WHERE version = :version"), {'version': migration.version}
+    ).first()
+    if applied:
+        db.session.commit()
+        return False
+
+    migration.apply()
+    db.session.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+        {'version': migration.version, 'name': migration.name}
+    )
+    db.session.commit()
+    return True
+
+
+def _run(migrations):
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    for migration in migrations:
+        try:
+            if _apply(migration, is_postgres):
+                logger.info(f"Applied migration {migration.version}: {migration.name}")
+        except MigrationDeferred as e:
+            # Nothing later depends on a deferrable migration; retry_deferred_migrations picks it up
+            logger.warning(f"Deferred migration {migration.version} ({migration.name}): {e}")
+            db.session.rollback()
+        except Exception as e:
+            logger.error(f"Error running migration {migration.version} ({migration.name}): {e}")
+            db.session.rollback()
+            # Later migrations may depend on this one
+            break
+
+
+def run_migrations():
+    """Bring the schema up to date; a single query when it already is
+
+    Only migrations newer than the newest applied one run here; deferred ones
+    left behind are retried by retry_deferred_migrations in the background.
+    """
+    applied = applied_versions()
+    newest = max(applied, default=0) if applied is not None else 0
+    pending = [migration for migration in MIGRATIONS if migration.version > newest]
+    if not pending:
+        logger.debug(f"Schema is at version {MIGRATIONS[-1].version}, no migrations to run")
+        return
+
+    # Fresh databases get every table from the models; migrations then fill in
+    # what create_all cannot change on existing tables
+    db.create_all()
+    _create_version_table()
+    _run(pending)
+
+
+def retry_deferred_migrations():
+    """Apply migrations that were deferred while later ones applied (a scheduled job)"""
+    applied = applied_versions()
+    if not applied:
+        return
+    deferred = [migration for migration in MIGRATIONS
+                if migration.version not in applied and migration.version < max(applied)]
+    _run(deferred)
@@ -2,7 +2,12 @@ from datetime import datetime
 from app import db
 from flask_login import UserMixin
 from slugify import slugify
+from sqlalchemy import text
+from sqlalchemy.orm import validates
+from url_resolvers import normalize_url
+import hashlib
 import random
+import secrets
 import string
 import logging
 
@@ -13,14 +18,33 @@ class User(UserMixin, db.Model):
     google_id = db.Column(db.String(100), unique=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
+    api_token_hash = db.Column(db.String(64), unique=True)  # sha256 of the user's batch API token
     feeds = db.relationship('Feed', backref='owner', lazy=True)
 
+    @staticmethod
+    def hash_api_token(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def issue_api_token(self):
+        """Generate a new API token, replacing any previous one; only its hash is stored"""
+        token = secrets.token_urlsafe(32)
+        self.api_token_hash = self.hash_api_token(token)
+        db.session.commit()
+        return token
+
+    @classmethod
+    def find_by_api_token(cls, token):
+        if not token:
+            return None
+        return cls.query.filter_by(api_token_hash=cls.hash_api_token(token)).first()
+
 class Feed(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     image_url = db.Column(db.String(500))  # New field for podcast image
+    resolved_image_url = db.Column(db.String(1000))  # Direct link for image_url, set on write
     website_url = db.Column(db.String(500))  # New field for optional website URL
     url_slug = db.Column(db.String(200), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -28,12 +52,17 @@ class Feed(db.Model):
     retention_period = db.Column(db.Integer, default=90)
     episodes = db.relationship('Episode', backref='feed', lazy='dynamic', cascade='all, delete-orphan')  # Use dynamic loading and cascade deletes
     
+    # url_slug lookups use the index behind its unique constraint
     __table_args__ = (
         db.Index('ix_feed_user_id', 'user_id'),
-        db.Index('ix_feed_url_slug', 'url_slug'),
         db.Index('ix_feed_user_created', 'user_id', 'created_at'),  # Composite index for dashboard queries
     )
 
+    @validates('image_url')
+    def _resolve_image_url(self, key, value):
+        self.resolved_image_url = normalize_url(value) if value else None
+        return value
+
     def regenerate_url_slug(self):
         """Regenerate the URL slug for the feed"""
         base_slug = slugify(self.name)
@@ -46,6 +75,10 @@ class Feed(db.Model):
         self.url_slug = new_slug
         db.session.commit()
 
+        # The old slug must stop resolving and cached XML embeds the old self link
+        from cache_manager import invalidate_feed_caches
+        invalidate_feed_caches(self.id)
+
         return new_slug
 
 class Episode(db.Model):
@@ -54,13 +87,81 @@ class Episode(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     audio_url = db.Column(db.String(500), nullable=False)
+    resolved_audio_url = db.Column(db.String(1000))  # Direct link for audio_url, set on write so renders never resolve
     release_date = db.Column(db.DateTime, nullable=False)
     is_recurring = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    content_hash = db.Column(db.String(64))  # Hash of importable fields, lets re-syncs skip unchanged rows
+    # Enclosure metadata from audio_probe (HTTP Range reads), filled in by a background job
+    enclosure_length = db.Column(db.BigInteger)
+    enclosure_type = db.Column(db.String(50))
+    duration_seconds = db.Column(db.Integer)
+    bitrate = db.Column(db.Integer)
+    probed_at = db.Column(db.DateTime)
 
+    # feed_id lookups and counts use the composite indexes that start with it (migration 10)
     __table_args__ = (
-        db.Index('ix_episode_feed_id', 'feed_id'),
         db.Index('ix_episode_release_date', 'release_date'),
-        db.Index('ix_episode_feed_date', 'feed_id', 'release_date'),  # Composite index for feed episode queries
+        # Feed pages, the RSS recent-episodes branch, counts and archival; the included
+        # columns let counts and archive selection skip the table
+        db.Index('ix_episode_feed_date_cover', 'feed_id', 'release_date',
+                 postgresql_include=['id', 'is_recurring']),
+        # The RSS recurring branch; only a handful of rows per feed
+        db.Index('ix_episode_feed_recurring', 'feed_id',
+                 postgresql_where=text('is_recurring = true'), sqlite_where=text('is_recurring = true')),
+        db.Index('uq_episode_feed_audio_url', 'feed_id', 'audio_url', unique=True),  # Upsert key for CSV imports
     )
 
+    @validates('audio_url')
+    def _resolve_audio_url(self, key, value):
+        if value != self.audio_url:
+            # New file: its metadata has to be probed again
+            self.enclosure_length = self.enclosure_type = None
+            self.duration_seconds = self.bitrate = self.probed_at = None
+        self.resolved_audio_url = normalize_url(value)
+        return value
+
+    @staticmethod
+    def compute_content_hash(title, description, release_date, is_recurring):
+        """Hash the fields an import can change, so re-importing an unchanged row is a no-op"""
+        payload = '\x1f'.join([
+            title or '',
+            description or '',
+            release_date.strftime('%Y-%m-%d %H:%M') if release_date else '',
+            '1' if is_recurring else '0',
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def refresh_content_hash(self):
+        """Recompute content_hash after the episode is edited"""
+        self.content_hash = self.compute_content_hash(
+            self.title, self.description, self.release_date, self.is_recurring
+        )
+
+
+class EpisodeArchive(db.Model):
+    """Episodes past their feed's retention window, moved out of the hot episode table.
+
+    Rows keep their original episode id so they can be restored unchanged."""
+    __tablename__ = 'episode_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    feed_id = db.Column(db.Integer, db.ForeignKey('feed.id'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    audio_url = db.Column(db.String(500), nullable=False)
+    resolved_audio_url = db.Column(db.String(1000))
+    release_date = db.Column(db.DateTime, nullable=False)
+    is_recurring = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime)
+    content_hash = db.Column(db.String(64))
+    enclosure_length = db.Column(db.BigInteger)
+    enclosure_type = db.Column(db.String(50))
+    duration_seconds = db.Column(db.Integer)
+    bitrate = db.Column(db.Integer)
+    probed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_episode_archive_feed_date', 'feed_id', 'release_date'),
+    )
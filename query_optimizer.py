@@ -5,11 +5,31 @@ import logging
 from functools import lru_cache
 from app import db
 from models import Feed, Episode, User
-from sqlalchemy import text, func
+from sqlalchemy import text, func, select
 from flask_login import current_user
 
 logger = logging.getLogger(__name__)
 
+# Recurring episodes plus non-recurring ones released within [window_start, window_end].
+# The limited branch is a derived table rather than a parenthesised UNION operand,
+# which SQLite does not accept
+RSS_EPISODES_QUERY = text("""
+    SELECT id, title, description, COALESCE(resolved_audio_url, audio_url) AS audio_url,
+           release_date, is_recurring, enclosure_length, enclosure_type, duration_seconds
+    FROM episode
+    WHERE feed_id = :feed_id AND is_recurring = true
+    UNION ALL
+    SELECT * FROM (
+        SELECT id, title, description, COALESCE(resolved_audio_url, audio_url) AS audio_url,
+               release_date, is_recurring, enclosure_length, enclosure_type, duration_seconds
+        FROM episode
+        WHERE feed_id = :feed_id AND is_recurring = false
+        AND release_date >= :window_start AND release_date <= :window_end
+        ORDER BY release_date DESC
+        LIMIT 100
+    ) AS recent
+""").columns(release_date=db.DateTime, is_recurring=db.Boolean)  # typed results on SQLite too
+
 class QueryOptimizer:
     """Optimizes database queries to reduce compute time"""
     
@@ -41,24 +61,46 @@ class QueryOptimizer:
         return {feed_id: count for feed_id, count in counts}
     
     @staticmethod
-    def optimize_rss_query(feed_id):
-        """Optimized query for RSS feed generation - recurring episodes plus recent non-recurring"""
-        query = text("""
-            (SELECT id, title, description, audio_url, release_date, is_recurring
-             FROM episode 
-             WHERE feed_id = :feed_id AND is_recurring = true)
-            UNION ALL
-            (SELECT id, title, description, audio_url, release_date, is_recurring
-             FROM episode 
-             WHERE feed_id = :feed_id AND is_recurring = false
-             AND release_date >= NOW() - INTERVAL '90 days' AND release_date <= NOW()
-             ORDER BY release_date DESC
-             LIMIT 100)
-        """)
-        
-        result = db.session.execute(query, {'feed_id': feed_id})
+    def optimize_rss_query(feed_id, window_start, window_end):
+        """Optimized query for RSS feed generation - recurring episodes plus non-recurring ones
+        released within [window_start, window_end]"""
+        result = db.session.execute(RSS_EPISODES_QUERY, {
+            'feed_id': feed_id,
+            'window_start': window_start,
+            'window_end': window_end,
+        })
         return result.fetchall()
     
+    # Statement builders for the hot page queries, shared with the plan checks in query_plans.py
+
+    @staticmethod
+    def dashboard_feeds_query(user_id):
+        """A user's feeds, newest first, each with its episode count"""
+        # Correlated count: evaluated only for the page of feeds returned, through
+        # the episode feed_id index, instead of grouping every episode in the table
+        episode_count = (select(func.count(Episode.id))
+                         .where(Episode.feed_id == Feed.id)
+                         .correlate(Feed)
+                         .scalar_subquery()
+                         .label('episode_count'))
+        return (db.session.query(Feed, episode_count)
+                .filter(Feed.user_id == user_id)
+                .order_by(Feed.created_at.desc()))
+
+    @staticmethod
+    def feed_episodes_query(feed_id):
+        """A feed's episodes, newest first, for the feed details pages"""
+        return Episode.query.filter_by(feed_id=feed_id).order_by(Episode.release_date.desc())
+
+    @staticmethod
+    def owned_episode_query(user_id, feed_id, episode_id):
+        """An episode, only if it belongs to the given feed and that feed to the user"""
+        return Episode.query.join(Feed).filter(
+            Episode.id == episode_id,
+            Episode.feed_id == feed_id,
+            Feed.user_id == user_id
+        )
+
     @staticmethod
     def cleanup_query_cache():
         """Clear the LRU cache to free memory"""
@@ -66,6 +108,15 @@ class QueryOptimizer:
         QueryOptimizer.get_feed_episode_count.cache_clear()
         logger.info("Cleared query cache")
 
+# Tables looked after by MaintenanceQueries.maintain_tables. A table is analyzed
+# once more than max(MIN, FRACTION * live rows) rows changed since its last ANALYZE,
+# and vacuumed once its dead rows pass the same kind of threshold.
+MAINTAINED_TABLES = ('user', 'feed', 'episode')
+ANALYZE_MIN_CHANGES = 50
+ANALYZE_CHANGE_FRACTION = 0.05
+VACUUM_MIN_DEAD_ROWS = 200
+VACUUM_DEAD_FRACTION = 0.1
+
 # Database maintenance queries
 class MaintenanceQueries:
     """Database maintenance to reduce ongoing compute costs"""
@@ -92,11 +143,75 @@ class MaintenanceQueries:
             db.session.commit()  # Ensure no active transaction
             
             # Run maintenance commands
-            with db.engine.connect().execution_options(autocommit=True) as conn:
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
                 conn.execute(text('VACUUM ANALYZE "user"'))
                 conn.execute(text("VACUUM ANALYZE feed"))
                 conn.execute(text("VACUUM ANALYZE episode"))
             
             logger.info("Database vacuum completed")
         except Exception as e:
-            logger.error(f"Error vacuuming tables: {e}")
\ No newline at end of file
+            logger.error(f"Error vacuuming tables: {e}")
+
+    @staticmethod
+    def table_stats():
+        """Change counters for the application tables from pg_stat_user_tables"""
+        rows = db.session.execute(text("""
+            SELECT relname, n_live_tup, n_dead_tup, n_mod_since_analyze,
+                   GREATEST(last_analyze, last_autoanalyze) AS last_analyzed,
+                   GREATEST(last_vacuum, last_autovacuum) AS last_vacuumed
+            FROM pg_stat_user_tables
+            WHERE schemaname = current_schema() AND relname = ANY(:tables)
+        """), {'tables': list(MAINTAINED_TABLES)})
+        return {row.relname: row._asdict() for row in rows}
+
+    @staticmethod
+    def index_stats():
+        """Size and scan count of every index on the application tables (PostgreSQL only)
+
+        Each index costs write amplification on every insert and update; one that
+        is never scanned is pure overhead.
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return {}
+        rows = db.session.execute(text("""
+            SELECT indexrelname, relname, pg_relation_size(indexrelid) AS bytes, idx_scan
+            FROM pg_stat_user_indexes
+            WHERE schemaname = current_schema() AND relname = ANY(:tables)
+            ORDER BY relname, indexrelname
+        """), {'tables': list(MAINTAINED_TABLES)})
+        return {row.indexrelname: {'table': row.relname, 'bytes': row.bytes, 'scans': row.idx_scan} for row in rows}
+
+    @staticmethod
+    def maintain_tables():
+        """ANALYZE or VACUUM only the tables whose statistics have drifted enough to matter"""
+        if db.engine.dialect.name != 'postgresql':
+            # SQLite decides for itself which statistics are stale
+            db.session.execute(text("PRAGMA optimize"))
+            db.session.commit()
+            # Readers holding old snapshots can stop autocheckpoints from shrinking the WAL
+            from sqlite_backend import checkpoint
+            checkpoint(db.session)
+            db.session.commit()
+            return {'analyzed': [], 'vacuumed': []}
+
+        stats = MaintenanceQueries.table_stats()
+        db.session.commit()  # VACUUM cannot run inside a transaction
+
+        to_vacuum, to_analyze = [], []
+        for table, row in stats.items():
+            live = row['n_live_tup'] or 0
+            if (row['n_dead_tup'] or 0) > max(VACUUM_MIN_DEAD_ROWS, VACUUM_DEAD_FRACTION * live):
+                to_vacuum.append(table)  # VACUUM ANALYZE refreshes statistics as well
+            elif (row['n_mod_since_analyze'] or 0) > max(ANALYZE_MIN_CHANGES, ANALYZE_CHANGE_FRACTION * live):
+                to_analyze.append(table)
+
+        if to_vacuum or to_analyze:
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                for table in to_vacuum:
+                    conn.execute(text(f'VACUUM ANALYZE "{table}"'))
+                for table in to_analyze:
+                    conn.execute(text(f'ANALYZE "{table}"'))
+            logger.info(f"Table maintenance: vacuumed {to_vacuum or 'none'}, analyzed {to_analyze or 'none'}")
+        else:
+            logger.debug("Table maintenance: statistics are current, nothing to do")
+        return {'analyzed': to_analyze, 'vacuumed': to_vacuum}
@@ -0,0 +1,341 @@
+"""
+Query-plan regression checks for the hot queries
+
+Runs EXPLAIN (FORMAT JSON) on each hot query against a PostgreSQL database
+seeded with realistic volume and fails when a plan scans the episode table
+sequentially or its estimated cost passes the query's bound. The statements come
+from the same builders the routes use, so a change to a query or to the indexes
+in models.py is checked as it ships.
+
+    python query_plans.py --database-url postgresql://localhost/podcastpal_plans --seed
+    python query_plans.py --database-url postgresql://localhost/podcastpal_plans
+
+Seeding refuses to touch a database that already has users. Exits with status 1
+when any plan regresses. --measure also reports read latency (EXPLAIN ANALYZE,
+median of several runs), write amplification (WAL bytes and time per inserted
+episode with the current indexes) and first-page search latency with full-text
+search against the ILIKE fallback; all of it rolls back, and --measure-output
+saves the numbers for comparing index designs.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# Relations that must never be read with a sequential scan by a hot query
+GUARDED_RELATIONS = ('episode',)
+
+# build(sample) returns the statement to explain; max_cost bounds the planner's total cost
+HotQuery = namedtuple('HotQuery', ['name', 'build', 'max_cost'])
+
+SEED_USERS = 200
+SEED_FEEDS_PER_USER = 5
+SEED_EPISODES_PER_FEED = 400  # feeds get between half and twice this many
+MEASURE_RUNS = 5
+# A common word, a prefix, a phrase and a word no episode contains
+SEARCH_TERMS = ('history', 'hist', 'episode 12', 'zebra')
+WRITE_SAMPLE_ROWS = 1000
+
+
+def _rss_episodes(sample):
+    from query_optimizer import RSS_EPISODES_QUERY
+    from feed_renderer import TIMEZONE
+
+    # Bound like build_feed_snapshot: release dates are naive Pacific wall-clock times
+    now = datetime.now(TIMEZONE).replace(tzinfo=None)
+    return RSS_EPISODES_QUERY.bindparams(feed_id=sample['feed_id'], window_start=now - timedelta(days=90),
+                                         window_end=now)
+
+
+def _dashboard_feeds(sample):
+    from query_optimizer import QueryOptimizer
+    return QueryOptimizer.dashboard_feeds_query(sample['user_id']).limit(10).statement
+
+
+def _feed_details_page(sample):
+    from query_optimizer import QueryOptimizer
+    return QueryOptimizer.feed_episodes_query(sample['feed_id']).offset(15).limit(15).statement
+
+
+def _search_ilike(sample):
+    from episode_search import ilike_query
+    return ilike_query(sample['user_id'], 'history').limit(20).statement
+
+
+def _search_fts(sample):
+    from episode_search import PostgresSearchBackend
+    from sqlalchemy import text
+    return text(PostgresSearchBackend.SEARCH_SQL).bindparams(
+        tsquery=PostgresSearchBackend.build_query(['history']),
+        headline_options=PostgresSearchBackend.HEADLINE_OPTIONS,
+        user_id=sample['user_id'], limit=20, offset=0)
+
+
+def _owned_episode(sample):
+    from query_optimizer import QueryOptimizer
+    return QueryOptimizer.owned_episode_query(sample['user_id'], sample['feed_id'], sample['episode_id']).statement
+
+
+def _delete_feed_episodes(sample):
+    from models import Episode
+    from sqlalchemy import delete
+    return delete(Episode).where(Episode.feed_id == sample['feed_id'])
+
+
+# Bounds are about three times each plan's cost on a default --seed database
+# (1,000 feeds, 500k episodes; PostgreSQL 16), and far below the cost of the same
+# query with index scans disabled. Comments give indexed / index-less cost there.
+# Use --cost-factor for databases seeded at other volumes.
+HOT_QUERIES = [
+    HotQuery('rss_episodes', _rss_episodes, 600),                  # 176 / 39,311
+    HotQuery('dashboard_feeds', _dashboard_feeds, 12000),          # 4,552 / 108,937
+    HotQuery('feed_details_page', _feed_details_page, 200),        # 54 / 19,137
+    HotQuery('search_ilike', _search_ilike, 8000),                 # 2,916 / 19,802
+    HotQuery('search_fts', _search_fts, 12000),                    # 4,520 / 19,275
+    HotQuery('owned_episode', _owned_episode, 60),                 # 17 / 19,680
+    HotQuery('delete_feed_episodes', _delete_feed_episodes, 2500), # 820 / 21,781
+]
+
+
+def seed(db, users=SEED_USERS, feeds_per_user=SEED_FEEDS_PER_USER, episodes=SEED_EPISODES_PER_FEED):
+    """Fill an empty database with generate_series and refresh planner statistics"""
+    from sqlalchemy import text
+
+    if db.session.execute(text('SELECT 1 FROM "user" LIMIT 1')).first() is not None:
+        raise SystemExit("Refusing to seed: the database already has users")
+
+    db.session.execute(text("""
+        INSERT INTO "user" (name, email, google_id)
+        SELECT 'Plan User ' || g, 'plan' || g || '@example.com', 'plan-' || g
+        FROM generate_series(1, :users) g
+    """), {'users': users})
+    db.session.execute(text("""
+        INSERT INTO feed (user_id, name, description, url_slug, created_at, retention_period)
+        SELECT u.id, 'Plan Feed ' || u.id || '-' || g, 'Query plan check feed', 'plan-feed-' || u.id || '-' || g,
+               now() - g * interval '1 day', 90
+        FROM "user" u CROSS JOIN generate_series(1, :feeds) g
+    """), {'feeds': feeds_per_user})
+    # Uneven feed sizes, a few recurring episodes and releases spread over the past year
+    db.session.execute(text("""
+        INSERT INTO episode (feed_id, title, description, audio_url, release_date, is_recurring, created_at)
+        SELECT f.id, 'Episode ' || g,
+               'Episode ' || g || ' of feed ' || f.id || ' about '
+                   || (ARRAY['news', 'history', 'science', 'sports', 'music'])[1 + g % 5],
+               'https://dl.dropboxusercontent.com/s/plan/' || f.id || '/' || g || '.mp3',
+               now() - g * interval '1 day' * 365 / :episodes, g % 50 = 0, now()
+        FROM feed f CROSS JOIN LATERAL generate_series(1, :episodes * (1 + f.id % 4) / 2) g
+    """), {'episodes': episodes})
+    db.session.execute(text('ANALYZE "user", feed, episode'))
+    db.session.commit()
+
+
+def sample_parameters(db):
+    """The largest feed, its owner and its newest episode"""
+    from sqlalchemy import text
+
+    row = db.session.execute(text("""
+        SELECT e.feed_id, f.user_id, max(e.id) AS episode_id
+        FROM episode e JOIN feed f ON f.id = e.feed_id
+        GROUP BY e.feed_id, f.user_id
+        ORDER BY count(*) DESC
+        LIMIT 1
+    """)).first()
+    if row is None:
+        raise SystemExit("No episodes to plan against; run with --seed first")
+    return {'feed_id': row.feed_id, 'user_id': row.user_id, 'episode_id': row.episode_id}
+
+
+def explain(db, statement, options='FORMAT JSON'):
+    """The JSON EXPLAIN output for a statement, with its bind parameters as PostgreSQL receives them"""
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    result = db.session.connection().exec_driver_sql(f"EXPLAIN ({options}) {compiled}", compiled.params)
+    document = result.scalar()
+    return (json.loads(document) if isinstance(document, str) else document)[0]
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from walk(child)
+
+
+def check_plan(hot_query, plan, cost_factor=1.0):
+    """Problems with a plan; empty when it passes"""
+    problems = []
+    for node in walk(plan):
+        if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') in GUARDED_RELATIONS:
+            problems.append(f"sequential scan on {node['Relation Name']}")
+    max_cost = hot_query.max_cost * cost_factor
+    if plan['Total Cost'] > max_cost:
+        problems.append(f"estimated cost {plan['Total Cost']:.0f} exceeds {max_cost:.0f}")
+    return problems
+
+
+def scans(plan):
+    """How each relation is read, e.g. episode: Index Scan (ix_episode_feed_date_cover)"""
+    found = []
+    for node in walk(plan):
+        if 'Relation Name' in node:
+            index = f" ({node['Index Name']})" if node.get('Index Name') else ''
+            found.append(f"{node['Relation Name']}: {node['Node Type']}{index}")
+    return found
+
+
+def run_checks(db, cost_factor=1.0, only=None):
+    """Explain every hot query; returns (hot query, plan, problems) for each"""
+    if db.engine.dialect.name != 'postgresql':
+        raise SystemExit("Query plan checks need PostgreSQL")
+    sample = sample_parameters(db)
+    results = []
+    for hot_query in HOT_QUERIES:
+        if only and hot_query.name not in only:
+            continue
+        plan = explain(db, hot_query.build(sample))['Plan']
+        results.append((hot_query, plan, check_plan(hot_query, plan, cost_factor)))
+    db.session.rollback()
+    return results
+
+
+def measure_reads(db, runs=MEASURE_RUNS, only=None):
+    """Median execution time and buffers touched per hot query, from EXPLAIN ANALYZE"""
+    sample = sample_parameters(db)
+    results = {}
+    for hot_query in HOT_QUERIES:
+        if only and hot_query.name not in only:
+            continue
+        timings = []
+        for _ in range(runs):
+            document = explain(db, hot_query.build(sample), 'ANALYZE, BUFFERS, FORMAT JSON')
+            db.session.rollback()  # ANALYZE really executes the statement, deletes included
+            timings.append(document['Execution Time'])
+        plan = document['Plan']
+        results[hot_query.name] = {
+            'median_ms': round(statistics.median(timings), 3),
+            'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+        }
+    return results
+
+
+def measure_search(db, runs=MEASURE_RUNS, terms=SEARCH_TERMS):
+    """Median time for the first page of results, full-text search against the ILIKE fallback"""
+    from episode_search import search_episodes, _ilike_search
+
+    user_id = sample_parameters(db)['user_id']
+    results = {}
+    for term in terms:
+        timings = {'full_text': [], 'ilike': []}
+        for _ in range(runs):
+            started = time.perf_counter()
+            total = search_episodes(user_id, term).total
+            timings['full_text'].append(time.perf_counter() - started)
+            db.session.rollback()
+            started = time.perf_counter()
+            _ilike_search(user_id, term, 1, 20)
+            timings['ilike'].append(time.perf_counter() - started)
+            db.session.rollback()
+        results[term] = {'matches': total,
+                         **{f'{name}_ms': round(statistics.median(samples) * 1000, 2)
+                            for name, samples in timings.items()}}
+    return results
+
+
+def measure_writes(db, rows=WRITE_SAMPLE_ROWS):
+    """WAL bytes and time per inserted episode with the current indexes; rolled back afterwards"""
+    from sqlalchemy import text
+
+    feed_id = sample_parameters(db)['feed_id']
+    start_lsn = db.session.execute(text("SELECT pg_current_wal_insert_lsn()")).scalar()
+    started = time.perf_counter()
+    db.session.execute(text("""
+        INSERT INTO episode (feed_id, title, description, audio_url, release_date, is_recurring, created_at)
+        SELECT :feed_id, 'Write sample ' || g, 'Write amplification sample',
+               'https://dl.dropboxusercontent.com/s/write-sample/' || g || '.mp3',
+               now() - g * interval '1 hour', g % 50 = 0, now()
+        FROM generate_series(1, :rows) g
+    """), {'feed_id': feed_id, 'rows': rows})
+    elapsed = time.perf_counter() - started
+    wal_bytes = db.session.execute(
+        text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), CAST(:start AS pg_lsn))"), {'start': start_lsn}
+    ).scalar()
+    db.session.rollback()
+    return {
+        'rows': rows,
+        'wal_bytes_per_row': round(float(wal_bytes) / rows, 1),
+        'ms_per_row': round(elapsed * 1000 / rows, 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN the hot queries and fail on plan regressions")
+    parser.add_argument('--database-url', required=True, help='PostgreSQL database to plan against')
+    parser.add_argument('--seed', action='store_true', help='create the schema and fill an empty database first')
+    parser.add_argument('--users', type=int, default=SEED_USERS)
+    parser.add_argument('--feeds-per-user', type=int, default=SEED_FEEDS_PER_USER)
+    parser.add_argument('--episodes', type=int, default=SEED_EPISODES_PER_FEED)
+    parser.add_argument('--cost-factor', type=float, default=1.0, help='scale every cost bound')
+    parser.add_argument('--query', action='append', help='check only this hot query (repeatable)')
+    parser.add_argument('--plans', help='write the JSON plans to this file')
+    parser.add_argument('--measure', action='store_true', help='also measure read latency and write amplification')
+    parser.add_argument('--measure-output', help='write the measurements to this JSON file')
+    args = parser.parse_args(argv)
+
+    # Point the app at the plan database only; never fall through to the Supabase settings
+    os.environ.pop('SUPABASE_DB_PASSWORD', None)
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from app import app, db
+
+    with app.app_context():
+        if args.seed:
+            seed(db, args.users, args.feeds_per_user, args.episodes)
+        results = run_checks(db, args.cost_factor, args.query)
+        measurements = None
+        if args.measure:
+            from query_optimizer import MaintenanceQueries
+            measurements = {
+                'reads': measure_reads(db, only=args.query),
+                'search': measure_search(db),
+                'writes': measure_writes(db),
+                'indexes': MaintenanceQueries.index_stats(),
+            }
+
+    failed = 0
+    for hot_query, plan, problems in results:
+        status = 'FAIL' if problems else 'ok'
+        failed += bool(problems)
+        print(f"{status:<5}{hot_query.name:<24}cost {plan['Total Cost']:>10.1f} / {hot_query.max_cost * args.cost_factor:.0f}")
+        for scan in scans(plan):
+            print(f"       {scan}")
+        for problem in problems:
+            print(f"       ! {problem}")
+
+    if args.plans:
+        with open(args.plans, 'w') as f:
+            json.dump({hot_query.name: plan for hot_query, plan, _ in results}, f, indent=2)
+
+    if measurements:
+        print("\nRead latency (EXPLAIN ANALYZE, median)")
+        for name, reads in measurements['reads'].items():
+            print(f"  {name:<24}{reads['median_ms']:>9.3f} ms{reads['buffers']:>8} buffers")
+        print("\nSearch, first page (median)")
+        for term, search in measurements['search'].items():
+            print(f"  {term!r:<24}{search['matches']:>8} matches{search['full_text_ms']:>10.2f} ms full-text"
+                  f"{search['ilike_ms']:>10.2f} ms ILIKE")
+        writes = measurements['writes']
+        print(f"\nWrites: {writes['wal_bytes_per_row']} WAL bytes and {writes['ms_per_row']} ms per inserted episode")
+        for name, index in measurements['indexes'].items():
+            print(f"  {name:<32}{index['bytes']:>12} bytes{index['scans']:>10} scans")
+        if args.measure_output:
+            with open(args.measure_output, 'w') as f:
+                json.dump(measurements, f, indent=2)
+
+    print(f"\n{len(results) - failed}/{len(results)} query plans passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Token-bucket rate limiting for the public, unauthenticated endpoints
+
+Buckets are keyed by client IP, by client IP and feed slug, and by client IP for
+requests that ended in 404, so a podcatcher polling one feed every few seconds or
+a scraper walking random slugs is answered with 429 and Retry-After before it
+reaches the database. Buckets live in process memory; with RATE_LIMIT_REDIS_URL
+set (and the redis package installed) they are shared by every worker and host,
+falling back to process memory whenever Redis is unreachable.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+
+logger = logging.getLogger(__name__)
+
+# rate is tokens per second, burst is the bucket size
+Limit = namedtuple('Limit', ['name', 'rate', 'burst'])
+
+
+def _limit(name, env_prefix, rate, burst):
+    return Limit(name, float(os.environ.get(f'{env_prefix}_RATE', rate)),
+                 int(os.environ.get(f'{env_prefix}_BURST', burst)))
+
+
+# Aggregators fetch many feeds from a few addresses, so the per-IP budget is generous;
+# the per-feed budget still allows a poll a minute with room for retries
+CLIENT_LIMIT = _limit('client', 'RATE_LIMIT_CLIENT', 10, 300)
+FEED_LIMIT = _limit('feed', 'RATE_LIMIT_FEED', 1 / 60, 10)
+NOT_FOUND_LIMIT = _limit('not_found', 'RATE_LIMIT_NOT_FOUND', 1 / 30, 20)
+TOOL_LIMIT = _limit('tool', 'RATE_LIMIT_TOOL', 0.5, 20)
+
+# Proxies in front of the app (Replit's router); the client address is this many
+# entries from the right of X-Forwarded-For
+PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1'))
+MAX_BUCKETS = 100000
+REDIS_RETRY_INTERVAL = 30  # seconds to stay on process memory after a Redis error
+
+
+class MemoryBackend:
+    """Token buckets in a bounded LRU; idle buckets are full, so evicting them loses nothing"""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, cost=1):
+        """Seconds until cost tokens are available; 0 means they were taken
+
+        A cost of 0 only checks that the bucket is not empty.
+        """
+        needed = max(cost, 1)
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            wait = 0.0
+            if tokens >= needed:
+                tokens -= cost
+            else:
+                wait = (needed - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def size(self):
+        return len(self._buckets)
+
+
+# Same arithmetic as MemoryBackend.take, run atomically inside Redis on its clock
+_REDIS_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local needed = math.max(cost, 1)
+local wait = 0
+if tokens >= needed then
+    tokens = tokens - cost
+else
+    wait = (needed - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Token buckets shared across processes through a Lua script"""
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed when RATE_LIMIT_REDIS_URL is set
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def take(self, key, limit, cost=1):
+        return float(self._take(keys=[f'podcastpal:rl:{key}'], args=[limit.rate, limit.burst, cost]))
+
+
+class RateLimiter:
+    """Checks requests against token buckets and counts what it allowed and refused"""
+
+    def __init__(self):
+        self.memory = MemoryBackend()
+        self.shared = None
+        self._shared_failed_at = None
+        self._counters = {}
+        self._lock = threading.Lock()
+
+        redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+        if redis_url:
+            try:
+                self.shared = RedisBackend(redis_url)
+                logger.info("Rate limits are shared through Redis")
+            except ImportError:
+                logger.warning("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; "
+                               "rate limits are per process")
+
+    def _take(self, key, limit, cost):
+        if self.shared is not None and (self._shared_failed_at is None
+                                        or time.monotonic() - self._shared_failed_at > REDIS_RETRY_INTERVAL):
+            try:
+                wait = self.shared.take(key, limit, cost)
+                self._shared_failed_at = None
+                return wait
+            except Exception as e:
+                # Fail over to per-process limits rather than refusing or blocking requests
+                logger.warning(f"Redis rate limit backend unavailable, using process memory: {e}")
+                self._shared_failed_at = time.monotonic()
+        return self.memory.take(key, limit, cost)
+
+    def _count(self, name, outcome):
+        with self._lock:
+            counts = self._counters.setdefault(name, {'allowed': 0, 'limited': 0})
+            counts[outcome] += 1
+
+    def check(self, checks):
+        """Take a token from each (key, limit, cost) bucket; seconds to wait if any is empty"""
+        for key, limit, cost in checks:
+            wait = self._take(f'{limit.name}:{key}', limit, cost)
+            if wait > 0:
+                self._count(limit.name, 'limited')
+                return wait
+            self._count(limit.name, 'allowed')
+        return 0.0
+
+    def charge(self, key, limit):
+        """Spend a token after the fact (a request that turned out to be a 404)"""
+        self._take(f'{limit.name}:{key}', limit, 1)
+
+    def stats(self):
+        with self._lock:
+            counters = {name: dict(counts) for name, counts in self._counters.items()}
+        return {
+            'backend': 'redis' if self.shared is not None and self._shared_failed_at is None else 'memory',
+            'buckets_in_memory': self.memory.size(),
+            'limits': counters,
+        }
+
+
+# Global instance
+rate_limiter = RateLimiter()
+
+
+def client_ip():
+    """Client address as seen by the outermost trusted proxy"""
+    if PROXY_HOPS > 0:
+        forwarded = [addr.strip() for addr in request.headers.get('X-Forwarded-For', '').split(',') if addr.strip()]
+        if len(forwarded) >= PROXY_HOPS:
+            return forwarded[-PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+
+
+def too_many_requests(wait):
+    response = current_app.response_class('Too many requests, please slow down',
+                                          status=429, mimetype='text/plain')
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def rate_limited(*limits, per_slug=None):
+    """Limit a view per client IP, optionally per client and slug view argument too
+
+    Requests that end in 404 also spend a token from the client's not-found
+    bucket, and a client with none left is refused before the view runs.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            ip = client_ip()
+            checks = [(ip, NOT_FOUND_LIMIT, 0)] + [(ip, limit, 1) for limit in limits]
+            if per_slug is not None:
+                checks.append((f'{ip}:{kwargs.get(per_slug)}', FEED_LIMIT, 1))
+
+            wait = rate_limiter.check(checks)
+            if wait:
+                return too_many_requests(wait)
+
+            try:
+                response = f(*args, **kwargs)
+            except NotFound:
+                rate_limiter.charge(ip, NOT_FOUND_LIMIT)
+                raise
+            if getattr(response, 'status_code', 200) == 404:
+                rate_limiter.charge(ip, NOT_FOUND_LIMIT)
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,296 @@
+"""
+Feed rendering service backed by a process pool
+
+The web tier builds a FeedSnapshot and submits it here; rendering and enclosure
+probing run in worker processes so regeneration bursts never tie up the threads
+serving the dashboard. Plain and gzip bytes go straight into the shared RSS cache.
+Nothing at module level imports Flask or the app, so spawned workers start clean.
+"""
+import gzip
+import hashlib
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import enclosure_probe
+from feed_renderer import TIMEZONE, visible_episodes, render_rss
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are rendered first
+PRIORITY_MANUAL = 0    # /feed/<id>/refresh
+PRIORITY_REQUEST = 1   # a subscriber hit a cold cache
+
+RENDER_TIMEOUT = 60  # seconds a caller waits for its render
+MAX_TRACKED_FEEDS = 10000  # invalidation stamps kept
+
+RenderedFeed = namedtuple('RenderedFeed', ['feed_id', 'xml', 'gzip', 'rendered_at', 'etag'])
+
+
+def rendered_feed(feed_id, xml, gzip_content):
+    # The ETag follows the bytes, so an unchanged re-render still answers conditional GETs with 304
+    etag = hashlib.blake2b(xml, digest_size=12).hexdigest()
+    return RenderedFeed(feed_id, xml, gzip_content, datetime.now(TIMEZONE), etag)
+
+
+class RenderQueueFull(Exception):
+    """Raised when the render queue has no room at the requested priority"""
+
+
+def render_snapshot(snapshot, known_sizes=None, now=None):
+    """Render a snapshot to (xml bytes, gzip bytes, newly probed sizes); runs in a worker process"""
+    now = now or datetime.now(TIMEZONE)
+    episodes = visible_episodes(snapshot, now)
+
+    # Probed lengths are already in the snapshot; only the rest need a size probe
+    urls = {episode.audio_url for episode in episodes if not episode.enclosure_length}
+    lengths = {url: size for url, size in (known_sizes or {}).items() if url in urls}
+    probed = enclosure_probe.fetch_file_sizes_concurrent(urls - lengths.keys())
+    lengths.update(probed)
+
+    xml = render_rss(snapshot, episodes, lengths, now).encode('utf-8')
+    # mtime=0 keeps the compressed bytes identical for identical feeds
+    return xml, gzip.compress(xml, compresslevel=6, mtime=0), probed
+
+
+class _Job:
+    __slots__ = ('feed_id', 'snapshot', 'priority', 'version', 'future', 'state')
+
+    def __init__(self, snapshot, priority, version):
+        self.feed_id = snapshot.id
+        self.snapshot = snapshot
+        self.priority = priority
+        self.version = version
+        self.future = Future()
+        self.state = 'queued'
+
+
+class RenderService:
+    """Bounded priority queue in front of a ProcessPoolExecutor.
+
+    Jobs for the same feed coalesce while queued (newest snapshot, most urgent
+    priority). At most max_workers jobs are handed to the pool at a time so the
+    ordering stays in our heap rather than the executor's FIFO.
+    """
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers if max_workers is not None else int(os.environ.get('RENDER_WORKERS', '2'))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('RENDER_QUEUE_SIZE', '100'))
+        self._heap = []
+        self._queued = {}      # feed_id -> _Job waiting for a worker
+        # feed_id -> stamp of its last invalidation, oldest first; stamps come from one
+        # counter, and a feed without an entry counts as invalidated at _base_stamp
+        self._versions = OrderedDict()
+        self._stamp = 0
+        self._base_stamp = 0
+        self._in_flight = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+        self.stats = {'submitted': 0, 'coalesced': 0, 'rejected': 0, 'dropped': 0,
+                      'rendered': 0, 'failed': 0, 'stale': 0}
+
+    def version(self, feed_id):
+        """Current version of a feed; read it before snapshotting and pass it to submit()"""
+        with self._cond:
+            return self._versions.get(feed_id, self._base_stamp)
+
+    def submit(self, snapshot, priority=PRIORITY_REQUEST, version=None):
+        """Queue a snapshot for rendering; returns a Future of RenderedFeed.
+
+        version is the feed's version() read before the snapshot was built, so
+        an invalidation that lands while the snapshot is being read makes the
+        render stale rather than cacheable. Without it the current version is
+        used, which is only safe when nothing can change the feed meanwhile.
+
+        Raises RenderQueueFull when the queue is full of work at least as urgent."""
+        if version is None:
+            version = self.version(snapshot.id)
+
+        if self.max_workers == 0:
+            # Rendering disabled in a pool (RENDER_WORKERS=0): render in the calling thread
+            job = _Job(snapshot, priority, version)
+            self._run_inline(job)
+            return job.future
+
+        with self._cond:
+            job = self._queued.get(snapshot.id)
+            if job is not None:
+                if version >= job.version:
+                    # Never swap in a snapshot older than the one already queued
+                    job.snapshot = snapshot
+                    job.version = version
+                if priority < job.priority:
+                    # The old heap entry is skipped once this one is dispatched
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+                self.stats['coalesced'] += 1
+                return job.future
+
+            if len(self._queued) >= self.max_queue:
+                self._make_room(priority)
+
+            job = _Job(snapshot, priority, version)
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._queued[job.feed_id] = job
+            self.stats['submitted'] += 1
+            self._ensure_dispatcher()
+            self._cond.notify_all()
+            return job.future
+
+    def render(self, snapshot, priority=PRIORITY_REQUEST, timeout=RENDER_TIMEOUT, version=None):
+        """Submit and wait for the rendered feed"""
+        return self.submit(snapshot, priority, version).result(timeout)
+
+    def invalidate(self, feed_id):
+        """Mark renders of older snapshots as stale so they are not cached"""
+        with self._cond:
+            self._stamp += 1
+            self._versions[feed_id] = self._stamp
+            self._versions.move_to_end(feed_id)
+            # Pruned feeds count as invalidated at the pruned stamp, so at worst a
+            # render in flight for one of them is discarded rather than cached stale
+            while len(self._versions) > MAX_TRACKED_FEEDS:
+                _, self._base_stamp = self._versions.popitem(last=False)
+
+    def invalidate_all(self):
+        """Mark every render in progress as stale"""
+        with self._cond:
+            self._stamp += 1
+            self._base_stamp = self._stamp
+            self._versions.clear()
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queued)
+
+    def _make_room(self, priority):
+        """Drop the least urgent queued job if it is less urgent than the newcomer"""
+        victim = max(self._queued.values(), key=lambda job: job.priority)
+        if victim.priority <= priority:
+            self.stats['rejected'] += 1
+            raise RenderQueueFull(f"Render queue full ({self.max_queue} feeds waiting)")
+        del self._queued[victim.feed_id]
+        victim.state = 'dropped'
+        victim.future.set_exception(RenderQueueFull("Dropped for more urgent renders"))
+        self.stats['dropped'] += 1
+        logger.warning(f"Render queue full, dropped queued render of feed {victim.feed_id}")
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='render-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: workers never inherit the web process's threads or database connections
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info(f"Started render pool with {self.max_workers} worker processes")
+        return self._executor
+
+    def _reset_executor(self, executor):
+        with self._cond:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.error("Render pool broke; a new pool will be started for the next job")
+
+    def _pop_next(self):
+        while self._heap:
+            _, _, job = heapq.heappop(self._heap)
+            if job.state == 'queued' and self._queued.get(job.feed_id) is job:
+                del self._queued[job.feed_id]
+                job.state = 'running'
+                return job
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    while not self._queued or self._in_flight >= self.max_workers:
+                        self._cond.wait()
+                    job = self._pop_next()
+                self._in_flight += 1
+                executor = self._get_executor()
+
+            known_sizes = enclosure_probe.cached_sizes(
+                episode.audio_url for episode in job.snapshot.episodes if not episode.enclosure_length
+            )
+            try:
+                task = executor.submit(render_snapshot, job.snapshot, known_sizes)
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._reset_executor(executor)
+                self._finish(job, error=e)
+                continue
+            task.add_done_callback(lambda task, job=job, executor=executor: self._on_done(job, task, executor))
+
+    def _on_done(self, job, task, executor):
+        try:
+            xml, gzip_content, probed = task.result()
+        except BrokenProcessPool as e:
+            self._reset_executor(executor)
+            self._finish(job, error=e)
+            return
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+
+        enclosure_probe.remember_sizes(probed)
+        self._finish(job, rendered=rendered_feed(job.feed_id, xml, gzip_content))
+
+    def _run_inline(self, job):
+        try:
+            xml, gzip_content, _ = render_snapshot(job.snapshot)
+        except Exception as e:
+            job.future.set_exception(e)
+            self.stats['failed'] += 1
+            return
+        rendered = rendered_feed(job.feed_id, xml, gzip_content)
+        self._store(job, rendered)
+        job.future.set_result(rendered)
+
+    def _finish(self, job, rendered=None, error=None):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+        if error is not None:
+            logger.error(f"Render of feed {job.feed_id} failed: {error}")
+            self.stats['failed'] += 1
+            job.future.set_exception(error)
+            return
+
+        self._store(job, rendered)
+        job.future.set_result(rendered)
+
+    def _store(self, job, rendered):
+        """Publish a render to the shared caches unless the feed changed meanwhile"""
+        with self._cond:
+            current = self._versions.get(job.feed_id, self._base_stamp) == job.version
+        if not current:
+            self.stats['stale'] += 1
+            logger.info(f"Discarded stale render of feed {job.feed_id}")
+            return
+
+        from cache_manager import RSSCacheManager
+        from feed_generator import cache_feed
+        RSSCacheManager.set_feed_cache(job.feed_id, rendered)
+        cache_feed(job.feed_id, rendered)
+        self.stats['rendered'] += 1
+        logger.info(f"Rendered feed {job.feed_id} ({len(rendered.xml)} bytes, {len(rendered.gzip)} gzipped)")
+
+
+# Global instance
+render_service = RenderService()
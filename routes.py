@@ -1,23 +1,55 @@
+import hmac
+import os
 import pytz
+from functools import wraps
 from flask import render_template, redirect, url_for, request, abort, flash
 from flask_login import login_required, current_user
 from app import app, db
-from models import Feed, Episode
-from feed_generator import generate_rss_feed, _feed_cache, TIMEZONE, get_next_refresh_time
+from models import Feed, Episode, EpisodeArchive
+from feed_generator import generate_rss_feed, _feed_cache, TIMEZONE, get_next_refresh_time, feed_cache_control
+from render_service import RenderQueueFull
 from datetime import datetime
 from slugify import slugify
 from utils import convert_url_to_dropbox_direct
-from cache_manager import cache_result, CacheManager, RSSCacheManager
+from cache_manager import CacheManager, RSSCacheManager, invalidate_feed_caches
 from extended_cache import long_term_cache, UltraLongCache
+from rate_limiter import rate_limited, CLIENT_LIMIT, TOOL_LIMIT
 import logging
 import csv
 from io import StringIO
 from werkzeug.utils import secure_filename
-from sqlalchemy import or_, func
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload, selectinload
 
 logger = logging.getLogger(__name__)
 
+# Operational status endpoints expose other users' activity and the app's internals
+ADMIN_EMAILS = frozenset(email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',')
+                         if email.strip())
+OPS_TOKEN = os.environ.get('OPS_TOKEN')
+
+def admin_required(view):
+    """Allow the OPS_TOKEN bearer token, or a logged-in user listed in ADMIN_EMAILS; nobody if neither is set"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        auth_header = request.headers.get('Authorization', '')
+        token = auth_header[7:].strip() if auth_header.startswith('Bearer ') else None
+        if OPS_TOKEN and token and hmac.compare_digest(token, OPS_TOKEN):
+            return view(*args, **kwargs)
+        if not current_user.is_authenticated:
+            return app.login_manager.unauthorized()
+        if (current_user.email or '').lower() not in ADMIN_EMAILS:
+            logger.warning(f"User {current_user.id} refused access to {request.path}: not an admin")
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
+def _is_duplicate_audio_url(error):
+    """True for a violation of the one-episode-per-audio-URL index (PostgreSQL or SQLite wording)"""
+    message = str(error.orig)
+    return 'uq_episode_feed_audio_url' in message or 'episode.feed_id, episode.audio_url' in message
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -33,23 +65,13 @@ def dashboard():
     
     # Use efficient session context manager
     with ConnectionManager.efficient_session():
-        # Single optimized query with subquery for episode counts
-        from sqlalchemy import select, func as sql_func
-        
-        # Create subquery for episode counts
-        episode_count_subquery = db.session.query(
-            Episode.feed_id,
-            sql_func.count(Episode.id).label('episode_count')
-        ).group_by(Episode.feed_id).subquery()
-        
-        # Main query with left join to get feeds and their episode counts
-        feeds_query = db.session.query(Feed, episode_count_subquery.c.episode_count) \
-            .outerjoin(episode_count_subquery, Feed.id == episode_count_subquery.c.feed_id) \
-            .filter(Feed.user_id == current_user.id) \
-            .order_by(Feed.created_at.desc())
-        
-        # Apply pagination by executing the query first
-        total = feeds_query.count()
+        from query_optimizer import QueryOptimizer
+
+        # Feeds with their episode counts in one query
+        feeds_query = QueryOptimizer.dashboard_feeds_query(current_user.id)
+
+        # Apply pagination by executing the query first; the total needs no counts
+        total = Feed.query.filter_by(user_id=current_user.id).count()
         offset = (page - 1) * per_page
         results = feeds_query.offset(offset).limit(per_page).all()
         
@@ -148,15 +170,22 @@ def new_episode(feed_id):
                 release_date=release_date,
                 is_recurring=bool(request.form.get('is_recurring'))
             )
+            episode.refresh_content_hash()
             db.session.add(episode)
+            db.session.commit()
 
-            if feed_id in _feed_cache:
-                del _feed_cache[feed_id]
-                logger.info(f"Cleared RSS feed cache for feed_id: {feed_id}")
+            # Only after the commit, so no render can snapshot the old rows under the new version
+            invalidate_feed_caches(feed_id)
 
-            db.session.commit()
             flash('Episode added successfully!', 'success')
             return redirect(url_for('feed_details', feed_id=feed_id))
+        except IntegrityError as e:
+            db.session.rollback()
+            if _is_duplicate_audio_url(e):
+                flash('That audio URL is already used by another episode in this feed.', 'error')
+            else:
+                logger.error(f"Error creating episode: {str(e)}")
+                flash('Error adding episode. Please try again.', 'error')
         except Exception as e:
             logger.error(f"Error creating episode: {str(e)}")
             db.session.rollback()
@@ -165,32 +194,48 @@ def new_episode(feed_id):
     return render_template('episode_form.html', feed=feed)
 
 @app.route('/feed/<string:url_slug>/rss')
-@cache_result(ttl_minutes=1440)  # Cache RSS responses for 24 hours to minimize requests
+@rate_limited(CLIENT_LIMIT, per_slug='url_slug')
 def rss_feed(url_slug):
-    from connection_manager import ConnectionManager
-    
+    from cdn_purge import purge_queue, surrogate_keys
+    from slug_index import slug_index
+
+    # Resolve the slug from the in-memory index; a cached hit touches the database
+    # only for the throttled last_rss_access write
+    header = slug_index.resolve(url_slug)
+    if header is None:
+        abort(404)
+
     try:
-        with ConnectionManager.efficient_session():
-            # Single query to get feed by slug
-            feed = Feed.query.filter_by(url_slug=url_slug).first_or_404()
-            
-            # Update last RSS access timestamp to show activity in Supabase
-            feed.last_rss_access = datetime.now(TIMEZONE)
-            db.session.commit()
-            
-            # Check RSS cache first
-            cached_xml = RSSCacheManager.get_feed_cache(feed.id)
-            if cached_xml:
-                xml_content = cached_xml
-            else:
-                xml_content = generate_rss_feed(feed)
-                RSSCacheManager.set_feed_cache(feed.id, xml_content)
-        
-        response = app.response_class(
-            xml_content,
-            mimetype='application/rss+xml'
-        )
-        
+        # Update last RSS access timestamp to show activity in Supabase
+        slug_index.record_access(header.id, datetime.now(TIMEZONE))
+
+        # Check RSS cache first
+        rendered = RSSCacheManager.get_feed_cache(header.id)
+        if rendered is None:
+            # The header already carries the channel fields; only the episodes are queried
+            rendered = generate_rss_feed(header)
+
+        if 'gzip' in request.accept_encodings:
+            response = app.response_class(rendered.gzip, mimetype='application/rss+xml')
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(f"{rendered.etag}-gz")
+        else:
+            response = app.response_class(rendered.xml, mimetype='application/rss+xml')
+            response.set_etag(rendered.etag)
+        response.vary.add('Accept-Encoding')
+
+        # Let edge caches and podcatchers absorb polling; edits purge by surrogate key
+        response.headers['Cache-Control'] = feed_cache_control(purgeable=bool(purge_queue.hooks))
+        response.headers['Surrogate-Key'] = surrogate_keys(header)
+        response.last_modified = rendered.rendered_at
+
+        return response.make_conditional(request)
+    except RenderQueueFull:
+        # Backpressure from the render pool: ask the client to come back shortly
+        response = app.response_class('Feed is being regenerated, please retry shortly',
+                                      status=503, mimetype='text/plain')
+        response.headers['Retry-After'] = '30'
+        response.headers['Cache-Control'] = 'no-store'
         return response
     except Exception as e:
         logger.error(f"Error generating RSS feed: {str(e)}")
@@ -208,6 +253,7 @@ def edit_feed(feed_id):
             feed.name = request.form['name']
             feed.description = request.form['description']
             image_url = request.form.get('image_url', '').strip()
+            previous_retention = feed.retention_period
             feed.retention_period = int(request.form.get('retention_period', 90))
 
             if image_url:
@@ -215,13 +261,16 @@ def edit_feed(feed_id):
 
             feed.image_url = image_url if image_url else None
 
+            db.session.commit()
+
+            # A wider retention window brings archived episodes back into the feed
+            if feed.retention_period > (previous_retention or 0):
+                from archive import EpisodeArchiver
+                EpisodeArchiver.restore_feed(feed_id, feed.retention_period)
+
             # Clear the cache when feed is updated
-            RSSCacheManager.invalidate_feed(feed_id)
-            if feed_id in _feed_cache:
-                del _feed_cache[feed_id]
-                logger.info(f"Cleared RSS feed cache for feed_id: {feed_id}")
+            invalidate_feed_caches(feed_id)
 
-            db.session.commit()
             logger.info(f"Updated feed: {feed.name} with image: {feed.image_url}, retention_period: {feed.retention_period}")
             flash('Feed updated successfully!', 'success')
             return redirect(url_for('dashboard'))
@@ -255,10 +304,19 @@ def edit_episode(feed_id, episode_id):
 
             episode.release_date = datetime.strptime(request.form['release_date'], '%Y-%m-%dT%H:%M')
             episode.is_recurring = bool(request.form.get('is_recurring'))
+            episode.refresh_content_hash()
 
             db.session.commit()
+            invalidate_feed_caches(feed_id)
             flash('Episode updated successfully!', 'success')
             return redirect(url_for('feed_details', feed_id=feed_id))
+        except IntegrityError as e:
+            db.session.rollback()
+            if _is_duplicate_audio_url(e):
+                flash('That audio URL is already used by another episode in this feed.', 'error')
+            else:
+                logger.error(f"Error updating episode: {str(e)}")
+                flash('Error updating episode. Please try again.', 'error')
         except Exception as e:
             logger.error(f"Error updating episode: {str(e)}")
             db.session.rollback()
@@ -269,23 +327,18 @@ def edit_episode(feed_id, episode_id):
 @app.route('/feed/<int:feed_id>/episode/<int:episode_id>/delete', methods=['POST'])
 @login_required
 def delete_episode(feed_id, episode_id):
+    from query_optimizer import QueryOptimizer
+
     # Single query to verify ownership and get episode
-    episode = Episode.query.join(Feed).filter(
-        Episode.id == episode_id,
-        Episode.feed_id == feed_id,
-        Feed.user_id == current_user.id
-    ).first_or_404()
+    episode = QueryOptimizer.owned_episode_query(current_user.id, feed_id, episode_id).first_or_404()
 
     try:
         db.session.delete(episode)
-        
-        # Clear RSS cache for this feed
-        RSSCacheManager.invalidate_feed(feed_id)
-        if feed_id in _feed_cache:
-            del _feed_cache[feed_id]
-            logger.info(f"Cleared RSS feed cache for feed_id: {feed_id}")
-        
         db.session.commit()
+
+        # Clear RSS cache for this feed
+        invalidate_feed_caches(feed_id)
+
         flash('Episode deleted successfully!', 'success')
     except Exception as e:
         logger.error(f"Error deleting episode: {str(e)}")
@@ -308,17 +361,22 @@ def feed_details(feed_id):
         per_page = 15  # Number of episodes per page
         
         # Get episodes with pagination - using single query with all needed data
-        episodes_pagination = Episode.query.filter_by(feed_id=feed_id) \
-                                   .order_by(Episode.release_date.desc()) \
+        from query_optimizer import QueryOptimizer
+        episodes_pagination = QueryOptimizer.feed_episodes_query(feed_id) \
                                    .paginate(page=page, per_page=per_page, error_out=False)
         
         episodes = episodes_pagination.items
+
+        from archive import EpisodeArchiver
+        archived_count = EpisodeArchiver.archived_count(feed_id)
     
     return render_template('feed_details.html', 
                          feed=feed, 
                          episodes=episodes,
                          pagination=episodes_pagination,
+                         archived_count=archived_count,
                          _feed_cache=_feed_cache,
+                         import_job=request.args.get('import_job'),
                          now=datetime.now(TIMEZONE),
                          TIMEZONE=TIMEZONE,
                          get_next_refresh_time=get_next_refresh_time)
@@ -332,15 +390,13 @@ def delete_feed(feed_id):
     try:
         # Use bulk delete for episodes (more efficient than individual deletes)
         Episode.query.filter_by(feed_id=feed.id).delete()
-        
-        # Clear RSS cache before deleting feed
-        RSSCacheManager.invalidate_feed(feed_id)
-        if feed_id in _feed_cache:
-            del _feed_cache[feed_id]
-            logger.info(f"Cleared RSS feed cache for feed_id: {feed_id}")
-        
+        EpisodeArchive.query.filter_by(feed_id=feed.id).delete()
         db.session.delete(feed)
         db.session.commit()
+
+        # Clear RSS cache once the feed is gone
+        invalidate_feed_caches(feed_id)
+
         flash('Feed deleted successfully!', 'success')
     except Exception as e:
         logger.error(f"Error deleting feed: {str(e)}")
@@ -350,6 +406,7 @@ def delete_feed(feed_id):
     return redirect(url_for('dashboard'))
 
 @app.route('/test_url', methods=['GET', 'POST'])
+@rate_limited(TOOL_LIMIT)
 def test_url():
     if request.method == 'POST':
         original_url = request.form.get('url', '').strip()
@@ -392,90 +449,15 @@ def upload_episodes_csv(feed_id):
         return redirect(url_for('feed_details', feed_id=feed_id))
 
     try:
-        # Try multiple encodings to handle different CSV file formats
-        file_content = file.stream.read()
-        encodings = ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1']
-        
-        # Try each encoding until one works
-        best_encoding = None
-        for encoding in encodings:
-            try:
-                decoded_content = file_content.decode(encoding)
-                stream = StringIO(decoded_content, newline=None)
-                # Test if we can read it as CSV
-                test_reader = csv.DictReader(stream)
-                # Read one row to test if it's valid
-                next(test_reader, None)
-                # Found a working encoding
-                best_encoding = encoding
-                logger.info(f"Successfully decoded CSV with {encoding} encoding")
-                break
-            except UnicodeDecodeError:
-                logger.debug(f"Failed to decode with {encoding}, trying next encoding")
-                continue
-            except Exception as e:
-                logger.debug(f"Error with {encoding}: {str(e)}")
-                continue
-        
-        if best_encoding:
-            # Process the file with the best encoding found
-            try:
-                stream = StringIO(file_content.decode(best_encoding, errors='replace'), newline=None)
-                csv_reader = csv.DictReader(stream)
-            except Exception as e:
-                logger.error(f"Error creating CSV reader with {best_encoding}: {str(e)}")
-                raise
-        else:
-            # If no encoding worked completely, try error-replacement mode with UTF-8
-            logger.warning("No perfect encoding found, using UTF-8 with replacement")
-            stream = StringIO(file_content.decode('utf-8', errors='replace'), newline=None)
-            csv_reader = csv.DictReader(stream)
-
-        episodes_added = 0
-        episodes_failed = 0
-
-        for row in csv_reader:
-            try:
-                # Try multiple date formats
-                date_str = row['release_date'].strip()
-                release_date = None
-                date_formats = ['%Y-%m-%d %H:%M', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M']
-
-                for date_format in date_formats:
-                    try:
-                        release_date = datetime.strptime(date_str, date_format)
-                        break
-                    except ValueError:
-                        continue
-
-                if release_date is None:
-                    raise ValueError(f"Could not parse date: {date_str}")
-
-                is_recurring = row['is_recurring'].strip().upper() == 'TRUE'
-                audio_url = convert_url_to_dropbox_direct(row['audio_url'].strip())
-
-                episode = Episode(
-                    feed_id=feed_id,
-                    title=row['title'].strip(),
-                    description=row['description'].strip(),
-                    audio_url=audio_url,
-                    release_date=release_date,
-                    is_recurring=is_recurring
-                )
-                db.session.add(episode)
-                episodes_added += 1
-
-            except Exception as e:
-                logger.error(f"Error adding episode from CSV: {str(e)}")
-                episodes_failed += 1
-                continue
-
-        db.session.commit()
+        from import_jobs import submit_import
 
-        if episodes_failed > 0:
-            flash(f'Added {episodes_added} episodes, {episodes_failed} failed', 'warning')
-        else:
-            flash(f'Successfully added {episodes_added} episodes', 'success')
+        # Stage the upload to disk and import it in the background; the page polls for progress
+        mode = request.form.get('mode', 'append')
+        if mode not in ('append', 'upsert'):
+            mode = 'append'
+        job_id = submit_import(feed_id, current_user.id, file, mode=mode)
+        flash('CSV upload received. Episodes are being imported in the background.', 'info')
+        return redirect(url_for('feed_details', feed_id=feed_id, import_job=job_id))
 
     except Exception as e:
         logger.error(f"Error processing CSV file: {str(e)}")
@@ -484,6 +466,18 @@ def upload_episodes_csv(feed_id):
 
     return redirect(url_for('feed_details', feed_id=feed_id))
 
+@app.route('/feed/<int:feed_id>/import/<string:job_id>/status')
+@login_required
+def import_job_status(feed_id, job_id):
+    """JSON progress for a background CSV import"""
+    from flask import jsonify
+    from import_jobs import get_job_status
+
+    status = get_job_status(job_id, current_user.id)
+    if status is None or status.get('feed_id') != feed_id:
+        abort(404)
+    return jsonify(status)
+
 # Add new route for URL regeneration
 @app.route('/feed/<int:feed_id>/regenerate-url', methods=['POST'])
 @login_required
@@ -513,14 +507,15 @@ def refresh_feed(feed_id):
 
     try:
         # Force clear the cache for this feed (manual refresh)
-        if feed_id in _feed_cache:
-            del _feed_cache[feed_id]
-            logger.info(f"Manually cleared RSS feed cache for feed_id: {feed_id}")
+        invalidate_feed_caches(feed_id)
 
         # Force regenerate feed content by bypassing cache check
         from feed_generator import generate_rss_feed_force
-        generate_rss_feed_force(feed)
+        from slug_index import slug_index
+        generate_rss_feed_force(slug_index.resolve(feed.url_slug))
         flash('Feed refreshed successfully! Changes will be visible immediately.', 'success')
+    except RenderQueueFull:
+        flash('The feed renderer is busy. Please try refreshing again in a minute.', 'warning')
     except Exception as e:
         logger.error(f"Error refreshing feed: {str(e)}")
         flash('Error refreshing feed. Please try again.', 'error')
@@ -537,34 +532,83 @@ def export_episodes(feed_id):
         abort(403)
 
     try:
-        # Create CSV in memory
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow(['title', 'description', 'audio_url', 'release_date', 'is_recurring'])
-
-        # Write episodes
-        for episode in feed.episodes:
-            writer.writerow([
-                episode.title,
-                episode.description,
-                episode.audio_url,
-                episode.release_date.strftime('%Y-%m-%d %H:%M'),
-                'TRUE' if episode.is_recurring else 'FALSE'
-            ])
-
-        # Prepare the response
-        output.seek(0)
-        return output.getvalue(), 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': f'attachment; filename={feed.url_slug}_episodes.csv'
-        }
+        from flask import Response, stream_with_context
+        from csv_exporter import generate_episode_csv, gzip_chunks
+
+        # Stream rows straight from a server-side cursor so memory stays flat for any feed size
+        include_archived = request.args.get('archived') == '1'
+        chunks = generate_episode_csv(feed_id, include_archived)
+        filename = f'{feed.url_slug}_episodes{"_with_archive" if include_archived else ""}.csv'
+        mimetype = 'text/csv'
+        if request.args.get('gzip') == '1':
+            chunks = gzip_chunks(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename={filename}'
+        })
     except Exception as e:
         logger.error(f"Error exporting episodes: {str(e)}")
         flash('Error exporting episodes. Please try again.', 'error')
         return redirect(url_for('feed_details', feed_id=feed_id))
 
+@app.route('/account/api-token', methods=['GET', 'POST'])
+@login_required
+def api_token():
+    """Issue a token for the batch episode API; it is shown once and only its hash is stored"""
+    token = None
+    if request.method == 'POST':
+        try:
+            token = current_user.issue_api_token()
+            logger.info(f"Issued new API token for user {current_user.id}")
+        except Exception as e:
+            logger.error(f"Error issuing API token: {str(e)}")
+            db.session.rollback()
+            flash('Error generating API token. Please try again.', 'error')
+    return render_template('api_token.html', token=token)
+
+@app.route('/api/feeds/<int:feed_id>/episodes/batch', methods=['POST'])
+def batch_episodes(feed_id):
+    """Create, update and delete many episodes of a feed in one transaction"""
+    from flask import jsonify
+    from models import User
+    from episode_batch import EpisodeBatch, BatchValidationError
+    from enclosure_probe import probe_enclosures_async
+
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[7:].strip() if auth_header.startswith('Bearer ') else None
+    user = User.find_by_api_token(token)
+    if user is None:
+        return jsonify({'error': 'invalid or missing API token'}), 401
+
+    feed = Feed.query.filter_by(id=feed_id, user_id=user.id).first()
+    if feed is None:
+        return jsonify({'error': 'feed not found'}), 404
+
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'request body must be a JSON object with an "operations" list'}), 400
+    batch = EpisodeBatch(feed_id, payload.get('operations'))
+    try:
+        batch.validate()
+        result = batch.apply()
+    except BatchValidationError as e:
+        db.session.rollback()
+        return jsonify({'error': 'validation failed', 'errors': e.errors}), 400
+    except Exception as e:
+        logger.error(f"Error applying episode batch for feed {feed_id}: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': 'batch could not be applied'}), 409
+
+    # One invalidation for the whole batch, then warm enclosure sizes off the request
+    invalidate_feed_caches(feed_id)
+    probe_enclosures_async(batch.new_audio_urls())
+
+    return jsonify(result)
+
 @app.route('/search', methods=['GET'])
 @login_required
 def search_episodes():
@@ -573,24 +617,23 @@ def search_episodes():
     per_page = 20  # Number of search results per page
     
     if query:
-        # Search through episodes in user's feeds with pagination
-        search_query = (Episode.query
-                      .join(Feed)
-                      .filter(Feed.user_id == current_user.id)
-                      .filter(or_(
-                          Episode.title.ilike(f'%{query}%'),
-                          Episode.description.ilike(f'%{query}%')
-                      ))
-                      .order_by(Episode.release_date.desc()))
-        
-        # Apply pagination
-        pagination = search_query.paginate(page=page, per_page=per_page, error_out=False)
+        from episode_search import search_episodes as run_search
+
+        pagination = run_search(current_user.id, query, page=page, per_page=per_page)
         results = pagination.items
-        
+
+        # The archive is only scanned when asked for, and only alongside the first page
+        include_archived = request.args.get('archived') == '1'
+        archived_results = []
+        if include_archived and page == 1:
+            from episode_search import search_archived_episodes
+            archived_results = search_archived_episodes(current_user.id, query)
+
         logger.info(f"Search query '{query}' returned {pagination.total} total results, showing page {page}")
-        
-        return render_template('search.html', query=query, results=results, pagination=pagination)
-    
+
+        return render_template('search.html', query=query, results=results, pagination=pagination,
+                               include_archived=include_archived, archived_results=archived_results)
+
     # If no query, just show the empty search page
     return render_template('search.html', query='', results=[])
 
@@ -620,6 +663,59 @@ def ping_status():
             'message': f'Could not check ping status: {str(e)}'
         }), 500
 
+@app.route('/scheduler/status')
+@admin_required
+def scheduler_status():
+    """Background job schedule, skipped leader-only runs and recent run history for this process"""
+    from scheduler import scheduler
+    from flask import jsonify
+
+    return jsonify(scheduler.status())
+
+@app.route('/db/status')
+@admin_required
+def db_status():
+    """Queries per request by endpoint, identity cache hit rates, index usage and SQLite file sizes"""
+    from db_monitor import RequestQueryStats
+    from identity_cache import identity_cache
+    from query_optimizer import MaintenanceQueries
+    from flask import jsonify
+
+    status = {'queries_per_request': RequestQueryStats.report(), 'identity_cache': identity_cache.stats(),
+              'indexes': MaintenanceQueries.index_stats()}
+    if db.engine.dialect.name == 'sqlite':
+        from sqlite_backend import stats as sqlite_stats
+        status['sqlite'] = sqlite_stats(db.session)
+    return jsonify(status)
+
+@app.route('/cache/status')
+@admin_required
+def cache_status():
+    """Entries, bytes, hit rates, evictions and admission rejections per in-process cache"""
+    from cache_engine import cache_stats
+    from flask import jsonify
+
+    return jsonify(cache_stats())
+
+@app.route('/ratelimit/status')
+@admin_required
+def rate_limit_status():
+    """Requests allowed and refused per rate limit, and negative slug cache hits, for this process"""
+    from rate_limiter import rate_limiter
+    from slug_index import slug_index
+    from flask import jsonify
+
+    return jsonify({'rate_limits': rate_limiter.stats(), 'slug_index': slug_index.stats()})
+
+@app.route('/http/status')
+@admin_required
+def http_status():
+    """Outbound HTTP metrics (requests, retries, connections opened) per host for this process"""
+    from http_client import http_client
+    from flask import jsonify
+
+    return jsonify(http_client.metrics())
+
 @app.route('/manual-ping')
 @login_required
 def manual_ping():
@@ -627,7 +723,7 @@ def manual_ping():
     from database_ping import database_pinger
     
     try:
-        database_pinger._perform_ping()
+        database_pinger.perform_ping()
         flash('Database pinged successfully! Supabase will stay active.', 'success')
         logger.info(f"Manual database ping triggered by user {current_user.id}")
     except Exception as e:
@@ -0,0 +1,296 @@
+"""
+Background job scheduler with database-wide leader election
+
+One scheduler thread per host runs all periodic work (it is started by
+app.start_background_services, which already elects one process per host).
+Each run of a job marked leader_only additionally holds that job's PostgreSQL
+advisory lock, so it never runs on two hosts at once.
+"""
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytz
+from app import app, db
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = pytz.timezone('America/Los_Angeles')  # Pacific Time
+
+# Arbitrary but fixed: namespace of the per-job advisory locks every process contends for
+LEADER_LOCK_KEY = 7202
+HISTORY_SIZE = 200
+
+JobRun = namedtuple('JobRun', ['job', 'started_at', 'duration', 'status', 'error'])
+
+
+class Every:
+    """Run at a fixed interval"""
+
+    def __init__(self, **interval):
+        self.interval = timedelta(**interval)
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+    def __str__(self):
+        return f"every {self.interval}"
+
+
+class DailyAt:
+    """Run once a day at a Pacific wall-clock time"""
+
+    def __init__(self, hour, minute=0):
+        self.hour = hour
+        self.minute = minute
+
+    def next_after(self, moment):
+        local = moment.astimezone(TIMEZONE)
+        candidate = TIMEZONE.localize(datetime(local.year, local.month, local.day, self.hour, self.minute))
+        if candidate <= local:
+            next_day = local.date() + timedelta(days=1)
+            candidate = TIMEZONE.localize(datetime(next_day.year, next_day.month, next_day.day, self.hour, self.minute))
+        return candidate
+
+    def __str__(self):
+        return f"daily at {self.hour:02d}:{self.minute:02d} PT"
+
+
+class Job:
+    """A scheduled callable plus its run statistics"""
+
+    def __init__(self, name, func, schedule, jitter_seconds=0, leader_only=False):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter_seconds = jitter_seconds
+        self.leader_only = leader_only
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.last_run = None
+        self.last_status = None
+        self.last_error = None
+
+    def plan_next(self, now):
+        """Schedule the next run; jitter spreads runs so nodes and jobs don't fire together"""
+        jitter = timedelta(seconds=random.uniform(0, self.jitter_seconds)) if self.jitter_seconds else timedelta(0)
+        self.next_run = self.schedule.next_after(now) + jitter
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'schedule': str(self.schedule),
+            'leader_only': self.leader_only,
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'avg_duration': round(self.total_duration / self.runs, 3) if self.runs else None,
+        }
+
+
+class JobLock:
+    """Transaction-scoped advisory lock held for one run of a leader_only job
+
+    pg_try_advisory_xact_lock is taken in a transaction on its own connection
+    and released when that transaction ends after the run. A transaction-mode
+    pooler (Supabase on port 6543) pins one server connection to a transaction,
+    so this works through it, unlike a session lock. Each job has its own key:
+    while one host runs it, the others skip that run. Runs are not otherwise
+    coordinated, so leader_only jobs must be safe to run again on another host
+    shortly after.
+    """
+
+    def __init__(self, namespace=LEADER_LOCK_KEY):
+        self.namespace = namespace
+
+    @staticmethod
+    def key(job_name):
+        # Stable across processes and hosts, unlike hash(); fits PostgreSQL's int4
+        return zlib.crc32(job_name.encode()) & 0x7FFFFFFF
+
+    @contextmanager
+    def hold(self, job_name):
+        """Yield True while this process holds the job's lock, False if another one does"""
+        if db.engine.dialect.name != 'postgresql':
+            # Single-node database: the per-host election in start_background_services is enough
+            yield True
+            return
+
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            acquired = connection.execute(
+                text("SELECT pg_try_advisory_xact_lock(:namespace, :key)"),
+                {'namespace': self.namespace, 'key': self.key(job_name)}
+            ).scalar()
+            yield bool(acquired)
+        finally:
+            # Ending the transaction releases the lock
+            try:
+                transaction.rollback()
+            except Exception as e:
+                logger.warning(f"Could not release the lock for job {job_name}: {e}")
+            connection.close()
+
+
+class Scheduler:
+    """Runs registered jobs from one thread, recording history and stats"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.job_lock = JobLock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def add_job(self, name, func, schedule, jitter_seconds=0, leader_only=False):
+        """Register a job; re-registering a name replaces it"""
+        job = Job(name, func, schedule, jitter_seconds, leader_only)
+        with self._lock:
+            self.jobs[name] = job
+        self._wake.set()
+        return job
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduler started with {len(self.jobs)} jobs")
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def run_job(self, name):
+        """Run a job now in the calling thread, regardless of its schedule"""
+        with self._lock:
+            job = self.jobs[name]
+        return self._run(job)
+
+    def _loop(self):
+        while self._running:
+            now = datetime.now(TIMEZONE)
+            with self._lock:
+                for job in self.jobs.values():
+                    if job.next_run is None:
+                        job.plan_next(now)
+                due = [job for job in self.jobs.values() if job.next_run <= now]
+                upcoming = min((job.next_run for job in self.jobs.values()), default=None)
+
+            for job in due:
+                self._run(job)
+                job.plan_next(datetime.now(TIMEZONE))
+
+            if not due:
+                wait = (upcoming - now).total_seconds() if upcoming else 60
+                # Capped so leadership and newly added jobs are picked up reasonably soon
+                self._wake.wait(timeout=min(max(wait, 0.1), 300))
+                self._wake.clear()
+
+    def _run(self, job):
+        started_at = datetime.now(TIMEZONE)
+        start = time.perf_counter()
+        status, error = 'success', None
+        try:
+            with app.app_context():
+                if job.leader_only:
+                    with self.job_lock.hold(job.name) as acquired:
+                        if acquired:
+                            job.func()
+                        else:
+                            job.skipped += 1
+                            status = 'skipped'
+                else:
+                    job.func()
+        except Exception as e:
+            status, error = 'failed', str(e)
+            logger.error(f"Scheduled job {job.name} failed: {e}", exc_info=True)
+
+        duration = time.perf_counter() - start
+        if status != 'skipped':
+            job.runs += 1
+            job.total_duration += duration
+            job.last_run = started_at
+            job.last_error = error
+            if status == 'failed':
+                job.failures += 1
+        job.last_status = status
+        run = JobRun(job.name, started_at, duration, status, error)
+        self.history.append(run)
+        if status != 'skipped':
+            logger.info(f"Scheduled job {job.name} {status} in {duration:.2f}s")
+        return run
+
+    def status(self):
+        with self._lock:
+            jobs = [job.to_dict() for job in self.jobs.values()]
+        return {
+            'pid': os.getpid(),
+            'running': self._running,
+            'jobs': jobs,
+            'history': [
+                {
+                    'job': run.job,
+                    'started_at': run.started_at.isoformat(),
+                    'duration': round(run.duration, 3),
+                    'status': run.status,
+                    'error': run.error,
+                }
+                for run in reversed(self.history)
+            ][:50],
+        }
+
+
+def register_default_jobs(scheduler):
+    """The application's periodic work"""
+    from query_optimizer import MaintenanceQueries
+    from session_manager import SessionManager
+    from import_jobs import ImportJobStore
+    from archive import EpisodeArchiver
+    from audio_probe import probe_pending_episodes
+    from migrations import retry_deferred_migrations
+
+    # Statistics-driven: only tables that changed enough are analyzed or vacuumed
+    scheduler.add_job('table-maintenance', MaintenanceQueries.maintain_tables,
+                      Every(hours=1), jitter_seconds=300, leader_only=True)
+    # Episodes past retention leave the hot table; the next maintenance run vacuums it
+    scheduler.add_job('episode-archival', EpisodeArchiver.archive_all,
+                      DailyAt(3, 30), jitter_seconds=600, leader_only=True)
+    # Range-reads new enclosures for duration and MIME type; one node is enough
+    scheduler.add_job('audio-metadata-probe', probe_pending_episodes,
+                      Every(minutes=15), jitter_seconds=120, leader_only=True)
+    # A migration waiting on data fixes (duplicate audio URLs) applies once they are made
+    scheduler.add_job('deferred-migrations', retry_deferred_migrations,
+                      Every(hours=6), jitter_seconds=600, leader_only=True)
+    # Per-host resources, so every host runs these
+    scheduler.add_job('connection-cleanup', SessionManager.cleanup_connections,
+                      Every(minutes=30), jitter_seconds=60)
+    scheduler.add_job('import-job-cleanup', ImportJobStore.clear_old,
+                      Every(hours=6), jitter_seconds=600)
+
+    # RSS access tracking normally keeps Supabase active; the daily ping is opt-in
+    if os.environ.get('DATABASE_PING_ENABLED') == '1':
+        from database_ping import database_pinger
+        scheduler.add_job('database-ping', database_pinger.perform_ping,
+                          DailyAt(4, 0), jitter_seconds=900, leader_only=True)
+
+
+# Global instance
+scheduler = Scheduler()
@@ -21,10 +21,11 @@ class SessionManager:
         start_time = time.time()
         
         try:
-            # Configure session for optimal performance
-            session.execute(text("SET SESSION statement_timeout = '30s'"))
-            session.execute(text("SET SESSION lock_timeout = '10s'"))
-            session.execute(text("SET SESSION idle_in_transaction_session_timeout = '60s'"))
+            # Configure session for optimal performance (SQLite has busy_timeout instead)
+            if db.engine.dialect.name == 'postgresql':
+                session.execute(text("SET SESSION statement_timeout = '30s'"))
+                session.execute(text("SET SESSION lock_timeout = '10s'"))
+                session.execute(text("SET SESSION idle_in_transaction_session_timeout = '60s'"))
             
             yield session
             session.commit()
@@ -65,22 +66,3 @@ class SessionManager:
             
         except Exception as e:
             logger.error(f"Error cleaning up connections: {e}")
-
-# Background cleanup task
-def periodic_cleanup():
-    """Periodic cleanup of database resources"""
-    import threading
-    import time
-    
-    def cleanup_worker():
-        while True:
-            time.sleep(1800)  # Every 30 minutes
-            try:
-                with app.app_context():
-                    SessionManager.cleanup_connections()
-            except Exception as e:
-                logger.error(f"Periodic cleanup error: {e}")
-    
-    cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-    cleanup_thread.start()
-    return cleanup_thread
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Process-local slug-to-feed index so cached RSS hits need no database queries
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from app import db
+from invalidation_log import invalidation_log
+from models import Feed, User
+from sqlalchemy import event, inspect, select, update
+
+logger = logging.getLogger(__name__)
+
+# Everything the RSS channel header needs, resolved once per slug
+FeedHeader = namedtuple('FeedHeader', [
+    'id', 'user_id', 'url_slug', 'name', 'description', 'image_url', 'resolved_image_url',
+    'website_url', 'owner_name', 'retention_period', 'version'
+])
+
+
+class SlugIndex:
+    """Bounded LRU map of url_slug -> (FeedHeader, loaded_at), kept in sync by explicit invalidation"""
+
+    MAX_ENTRIES = 1000
+    # Workers on this host share invalidations (invalidation_log.py); the TTL bounds
+    # staleness when another host edits a feed
+    HEADER_TTL = timedelta(minutes=10)
+    # last_rss_access is activity tracking, so one write per feed per interval is enough
+    ACCESS_WRITE_INTERVAL = timedelta(minutes=15)
+    # Unknown slugs are remembered briefly so repeated 404s skip the database;
+    # creating a feed clears its slug in every worker, the TTL covers other hosts
+    MISSING_TTL = timedelta(seconds=60)
+    MAX_MISSING = 10000
+    # Invalidation stamps and access-write times are kept for at most this many feeds
+    MAX_TRACKED_FEEDS = 10000
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._headers = OrderedDict()
+        self._slug_by_feed = {}
+        # feed_id -> stamp of its last invalidation, oldest first; stamps come from one
+        # counter, and a feed pruned from here counts as invalidated at _pruned_stamp
+        self._versions = OrderedDict()
+        self._stamp = 0
+        self._pruned_stamp = 0
+        self._last_access_write = OrderedDict()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+        self.negative_hits = 0
+
+    def resolve(self, url_slug):
+        """Return the FeedHeader for a slug, loading it on a miss; None if no such feed"""
+        with self._lock:
+            entry = self._headers.get(url_slug)
+            if entry is not None:
+                header, loaded_at = entry
+                if time.monotonic() - loaded_at < self.HEADER_TTL.total_seconds():
+                    self._headers.move_to_end(url_slug)
+                    return header
+                del self._headers[url_slug]
+            missing_since = self._missing.get(url_slug)
+            if missing_since is not None:
+                if time.monotonic() - missing_since < self.MISSING_TTL.total_seconds():
+                    self.negative_hits += 1
+                    return None
+                del self._missing[url_slug]
+            # Any invalidation of the feed after this point gets a later stamp
+            stamp_before = self._stamp
+
+        header = self._load(url_slug, stamp_before)
+        if header is None:
+            with self._lock:
+                self._missing[url_slug] = time.monotonic()
+                while len(self._missing) > self.MAX_MISSING:
+                    self._missing.popitem(last=False)
+            return None
+
+        with self._lock:
+            # A concurrent invalidation (or a pruned one that may have been) raced the load: don't cache
+            if self._versions.get(header.id, self._pruned_stamp) <= header.version:
+                self._headers[url_slug] = (header, time.monotonic())
+                self._slug_by_feed[header.id] = url_slug
+                while len(self._headers) > self.max_entries:
+                    _, (evicted, _) = self._headers.popitem(last=False)
+                    self._slug_by_feed.pop(evicted.id, None)
+        return header
+
+    def _load(self, url_slug, stamp):
+        """Single query for the feed and its owner's name"""
+        row = db.session.execute(
+            select(Feed.id, Feed.user_id, Feed.url_slug, Feed.name, Feed.description,
+                   Feed.image_url, Feed.resolved_image_url, Feed.website_url, User.name,
+                   Feed.retention_period)
+            .join(User, User.id == Feed.user_id)
+            .where(Feed.url_slug == url_slug)
+        ).first()
+        if row is None:
+            return None
+        return FeedHeader(*row, stamp)
+
+    def invalidate_feed(self, feed_id):
+        """Forget a feed's header after it is edited, deleted or its slug changes"""
+        with self._lock:
+            self._stamp += 1
+            self._versions[feed_id] = self._stamp
+            self._versions.move_to_end(feed_id)
+            while len(self._versions) > self.MAX_TRACKED_FEEDS:
+                _, self._pruned_stamp = self._versions.popitem(last=False)
+            url_slug = self._slug_by_feed.pop(feed_id, None)
+            if url_slug is not None:
+                self._headers.pop(url_slug, None)
+
+    def forget_missing(self, url_slug):
+        """A slug that now belongs to a feed must stop resolving to 404"""
+        with self._lock:
+            self._missing.pop(url_slug, None)
+
+    def invalidate_all(self):
+        """Forget every header and unknown slug, including loads in progress"""
+        with self._lock:
+            self._stamp += 1
+            self._pruned_stamp = self._stamp
+            self._versions.clear()
+            self._headers.clear()
+            self._slug_by_feed.clear()
+            self._missing.clear()
+
+    def should_record_access(self, feed_id, now=None):
+        """True at most once per ACCESS_WRITE_INTERVAL per feed"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            last = self._last_access_write.get(feed_id)
+            if last is not None and now - last < self.ACCESS_WRITE_INTERVAL:
+                return False
+            self._last_access_write[feed_id] = now
+            self._last_access_write.move_to_end(feed_id)
+            # Oldest first: drop entries past the interval, which no longer throttle anything
+            while self._last_access_write:
+                oldest_feed, oldest = next(iter(self._last_access_write.items()))
+                if (now - oldest < self.ACCESS_WRITE_INTERVAL
+                        and len(self._last_access_write) <= self.MAX_TRACKED_FEEDS):
+                    break
+                del self._last_access_write[oldest_feed]
+            return True
+
+    def record_access(self, feed_id, accessed_at):
+        """Persist last_rss_access, throttled so most RSS hits skip the write"""
+        if not self.should_record_access(feed_id):
+            return
+        try:
+            db.session.execute(update(Feed).where(Feed.id == feed_id).values(last_rss_access=accessed_at))
+            db.session.commit()
+        except Exception as e:
+            logger.warning(f"Could not record RSS access for feed {feed_id}: {e}")
+            db.session.rollback()
+
+    def clear(self):
+        with self._lock:
+            self._headers.clear()
+            self._slug_by_feed.clear()
+            self._missing.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'headers': len(self._headers), 'missing': len(self._missing),
+                    'negative_hits': self.negative_hits, 'tracked_versions': len(self._versions),
+                    'tracked_access_writes': len(self._last_access_write)}
+
+
+# Global instance
+slug_index = SlugIndex()
+invalidation_log.subscribe('slug', slug_index.forget_missing, slug_index.invalidate_all)
+
+
+@event.listens_for(Feed, 'after_insert')
+@event.listens_for(Feed, 'after_update')
+def _forget_missing_slug(mapper, connection, target):
+    slug_index.forget_missing(target.url_slug)
+    if inspect(target).attrs.url_slug.history.has_changes():
+        invalidation_log.publish('slug', target.url_slug)
@@ -0,0 +1,88 @@
+"""
+Embedded SQLite backend for single-node deployments
+
+With DATABASE_URL=sqlite:////var/lib/podcastpal/podcastpal.db the app reads and
+writes a local file instead of crossing the network to the Postgres pooler.
+Every connection runs in WAL mode, so feed reads never wait on the writer, and
+is tuned with the pragmas below. Only one host can use the file; run gunicorn
+with as many workers as you like on that host.
+"""
+import logging
+import os
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '65536'))  # page cache per connection
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))  # per process; gunicorn threads share it
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),  # readers and the single writer don't block each other
+    ('synchronous', 'NORMAL'),  # fsync at checkpoints; a crash can lose the last commits, never consistency
+    ('busy_timeout', BUSY_TIMEOUT_MS),  # writers queue for the lock instead of failing with "database is locked"
+    ('foreign_keys', 'ON'),  # enforced by Postgres, off by default in SQLite
+    ('cache_size', -CACHE_SIZE_KB),  # negative means KiB rather than pages
+    ('mmap_size', MMAP_SIZE),  # reads come straight from the page cache without a copy
+    ('temp_store', 'MEMORY'),
+)
+
+
+def is_sqlite_url(url):
+    return (url or '').startswith('sqlite')
+
+
+def engine_options(url):
+    """Engine options for a SQLite file: a pool of long-lived connections
+
+    Opening a SQLite connection is cheap but each one re-runs the pragmas and
+    starts with a cold page cache, so connections are pooled rather than NullPool'd.
+    """
+    path = make_url(url).database
+    if path and path != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': POOL_SIZE,
+        'pool_pre_ping': False,  # nothing between the app and the file can drop a connection
+        'connect_args': {'check_same_thread': False},
+    }
+
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in PRAGMAS:
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def install(engine):
+    """Apply the pragmas to every new connection of engine"""
+    event.listen(engine, 'connect', _apply_pragmas)
+    with engine.connect() as connection:
+        mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+    if str(mode).lower() != 'wal':
+        # In-memory databases and some network filesystems can't use WAL
+        logger.warning(f"SQLite is using journal_mode={mode}, not WAL; reads will block on writes")
+    logger.info(f"Using embedded SQLite database {engine.url.database} (journal_mode={mode})")
+
+
+def checkpoint(session):
+    """Copy the WAL back into the database file and truncate it; returns (busy, wal_pages, checkpointed)"""
+    return tuple(session.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).one())
+
+
+def stats(session):
+    """File sizes and journal mode of the SQLite database"""
+    path = session.get_bind().url.database
+    wal_path = f'{path}-wal'
+    return {
+        'path': path,
+        'journal_mode': session.execute(text("PRAGMA journal_mode")).scalar(),
+        'database_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+    }
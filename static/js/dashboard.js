@@ -16,6 +16,53 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Poll background CSV import progress
+    const importProgress = document.getElementById('importProgress');
+    if (importProgress) {
+        const statusUrl = importProgress.dataset.statusUrl;
+        const bar = importProgress.querySelector('.progress-bar');
+        const state = importProgress.querySelector('.import-state');
+        const eta = importProgress.querySelector('.import-eta');
+        const counts = importProgress.querySelector('.import-counts');
+        const errors = importProgress.querySelector('.import-errors');
+
+        const poll = async () => {
+            try {
+                const response = await fetch(statusUrl, { credentials: 'same-origin' });
+                if (!response.ok) {
+                    state.textContent = 'status unavailable';
+                    return;
+                }
+                const job = await response.json();
+                state.textContent = job.state;
+                bar.style.width = `${Math.round(job.progress * 100)}%`;
+                counts.textContent = `${job.rows_processed} rows processed, ${job.added} added, ${job.updated} updated, ${job.skipped} unchanged, ${job.failed} failed`;
+                eta.textContent = job.eta_seconds ? `about ${Math.ceil(job.eta_seconds)}s remaining` : '';
+                errors.innerHTML = '';
+                job.errors.forEach(err => {
+                    const li = document.createElement('li');
+                    li.textContent = `Row ${err.line}: ${err.message}`;
+                    errors.appendChild(li);
+                });
+
+                if (job.state === 'completed' || job.state === 'failed') {
+                    importProgress.classList.remove('alert-secondary');
+                    importProgress.classList.add(job.state === 'completed' && job.failed === 0 ? 'alert-success' : 'alert-warning');
+                    if (job.error) {
+                        counts.textContent += ` (${job.error})`;
+                    }
+                    // Reload without the job parameter so the new episodes are listed
+                    setTimeout(() => { window.location.href = window.location.pathname; }, 3000);
+                    return;
+                }
+            } catch (err) {
+                console.error('Failed to fetch import status: ', err);
+            }
+            setTimeout(poll, 2000);
+        };
+        poll();
+    }
+
     // Initialize Bootstrap modal
     const deleteModal = document.getElementById('deleteEpisodeModal');
     if (deleteModal) {
@@ -0,0 +1,259 @@
+"""
+audio_probe against enclosure files served by a local stub server
+
+The fixture files are built byte by byte below (MP3 with ID3v2/ID3v1 tags and
+Xing/VBRI headers, MP4 with moov before and after mdat, Ogg Vorbis and Opus),
+written to a temporary directory and served with or without Range support.
+"""
+import re
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import audio_probe
+import enclosure_probe
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 144 * 128000 / 44100 bytes per frame
+MP3_FRAME_BYTES = 417
+MP3_SAMPLES_PER_FRAME = 1152
+ID3V2_BYTES = 3000
+MP4_TIMESCALE = 44100
+
+
+def mp3_header():
+    return bytes([0xFF, 0xFB, 0x90, 0x00])
+
+
+def mp3_frame(payload=b''):
+    frame = mp3_header() + payload
+    return frame + bytes(MP3_FRAME_BYTES - len(frame))
+
+
+def id3v2_tag(total):
+    size = total - 10
+    syncsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x03\x00\x00' + syncsafe + bytes(size)
+
+
+def cbr_mp3(frames):
+    return id3v2_tag(ID3V2_BYTES) + mp3_frame() * frames + b'TAG' + bytes(125)
+
+
+def xing_mp3(declared_frames, frames):
+    # Stereo MPEG-1 puts 32 bytes of side information between the header and the Xing tag
+    xing = bytes(32) + b'Xing' + struct.pack('>II', 1, declared_frames)
+    return mp3_frame(xing) + mp3_frame() * (frames - 1)
+
+
+def vbri_mp3(declared_frames, frames):
+    vbri = bytes(32) + b'VBRI' + struct.pack('>HHHII', 1, 0, 75, 0, declared_frames)
+    return mp3_frame(vbri) + mp3_frame() * (frames - 1)
+
+
+def atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def mvhd(duration_seconds, version=0):
+    duration = int(duration_seconds * MP4_TIMESCALE)
+    if version == 1:
+        payload = bytes([1, 0, 0, 0]) + struct.pack('>QQIQ', 0, 0, MP4_TIMESCALE, duration)
+    else:
+        payload = bytes(4) + struct.pack('>IIII', 0, 0, MP4_TIMESCALE, duration)
+    return atom(b'mvhd', payload + bytes(80))
+
+
+def m4a(duration_seconds, mdat_bytes, fast_start, mvhd_version=0):
+    ftyp = atom(b'ftyp', b'M4A ' + bytes(4) + b'isomM4A ')
+    moov = atom(b'moov', mvhd(duration_seconds, mvhd_version) + atom(b'trak', bytes(64)))
+    mdat = atom(b'mdat', bytes(mdat_bytes))
+    return ftyp + moov + mdat if fast_start else ftyp + mdat + moov
+
+
+def ogg_page(payload, granule, sequence):
+    return (b'OggS' + bytes([0, 0]) + struct.pack('<qIII', granule, 1, sequence, 0)
+            + bytes([1, len(payload)]) + payload)
+
+
+def vorbis_ogg(duration_seconds, filler_bytes, sample_rate=44100):
+    ident = b'\x01vorbis' + struct.pack('<IBI', 0, 2, sample_rate) + bytes(15)
+    return (ogg_page(ident, 0, 0) + bytes(filler_bytes)
+            + ogg_page(bytes(32), int(duration_seconds * sample_rate), 1))
+
+
+def opus_ogg(duration_seconds, filler_bytes, pre_skip=312):
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 2, pre_skip, 44100, 0, 0)
+    return (ogg_page(head, 0, 0) + bytes(filler_bytes)
+            + ogg_page(bytes(32), int(duration_seconds * 48000) + pre_skip, 1))
+
+
+FIXTURES = {
+    'cbr.mp3': cbr_mp3(300),
+    'xing.mp3': xing_mp3(500, 120),
+    'vbri.mp3': vbri_mp3(250, 120),
+    'fast-start.m4a': m4a(42.5, 50000, fast_start=True),
+    'moov-at-end.m4a': m4a(1800, 100000, fast_start=False, mvhd_version=1),
+    'vorbis.ogg': vorbis_ogg(30, 60000),
+    'opus.ogg': opus_ogg(20, 60000),
+    'truncated.mp3': cbr_mp3(300)[:ID3V2_BYTES + 40 * MP3_FRAME_BYTES + 200],
+    'truncated.m4a': m4a(1800, 100000, fast_start=False)[:30000],
+    'truncated.ogg': vorbis_ogg(30, 60000)[:20000],
+    'silence.mp3': bytes(5000),
+}
+CONTENT_TYPES = {'.mp3': 'audio/mpeg', '.m4a': 'audio/mp4', '.ogg': 'audio/ogg'}
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+class EnclosureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = self.server.files.get(self.path.rsplit('/', 1)[-1])
+        if body is None:
+            self.send_error(404)
+            return
+        self.server.requests.append((self.path, self.headers.get('Range')))
+
+        status, start, end = 200, 0, len(body)
+        match = _RANGE.match(self.headers.get('Range') or '')
+        if match and self.server.honour_range:
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(len(body), int(last) + 1 if last else len(body))
+            else:
+                start = max(0, len(body) - int(last))
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPES[self.path[self.path.rfind('.'):]])
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(body)}')
+        self.end_headers()
+        try:
+            self.wfile.write(body[start:end])
+        except (BrokenPipeError, ConnectionResetError):
+            # The probe stops reading once it has the bytes it asked for
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def fixture_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('enclosures')
+    for name, data in FIXTURES.items():
+        (directory / name).write_bytes(data)
+    return directory
+
+
+@pytest.fixture(params=[True, False], ids=['range', 'no-range'])
+def server(request, fixture_dir, monkeypatch):
+    """Serves the fixture files, honouring Range or ignoring it like some static hosts"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), EnclosureHandler)
+    httpd.files = {path.name: path.read_bytes() for path in fixture_dir.iterdir()}
+    httpd.honour_range = request.param
+    httpd.requests = []
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    monkeypatch.setattr(enclosure_probe, '_self_hosted', re.compile(r'127\.0\.0\.1'))
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def probe(server, name):
+    return audio_probe.probe_audio(f'http://127.0.0.1:{server.server_port}/{name}')
+
+
+def test_cbr_mp3_skips_id3_tags(server):
+    metadata = probe(server, 'cbr.mp3')
+    audio_bytes = len(FIXTURES['cbr.mp3']) - ID3V2_BYTES
+    if server.honour_range:
+        # The ID3v1 tag is only seen in the tail read
+        audio_bytes -= 128
+    assert metadata.mime_type == 'audio/mpeg'
+    assert metadata.length == len(FIXTURES['cbr.mp3'])
+    assert metadata.bitrate == 128000
+    assert metadata.duration_seconds == pytest.approx(audio_bytes * 8 / 128000)
+
+
+@pytest.mark.parametrize('name', ['xing.mp3', 'vbri.mp3'])
+def test_vbr_mp3_uses_declared_frame_count(server, name):
+    declared = 500 if name == 'xing.mp3' else 250
+    metadata = probe(server, name)
+    duration = declared * MP3_SAMPLES_PER_FRAME / 44100
+    assert metadata.duration_seconds == pytest.approx(duration)
+    assert metadata.bitrate == int(len(FIXTURES[name]) * 8 / duration)
+
+
+def test_fast_start_mp4(server):
+    metadata = probe(server, 'fast-start.m4a')
+    assert metadata.mime_type == 'audio/x-m4a'
+    assert metadata.duration_seconds == pytest.approx(42.5)
+    assert metadata.length == len(FIXTURES['fast-start.m4a'])
+
+
+def test_mp4_with_moov_after_mdat(server):
+    metadata = probe(server, 'moov-at-end.m4a')
+    if not server.honour_range:
+        # Reaching moov would mean downloading mdat, so the probe gives up
+        assert metadata is None
+        assert len(server.requests) == 2
+        return
+    assert metadata.duration_seconds == pytest.approx(1800)
+    data = FIXTURES['moov-at-end.m4a']
+    moov = data.rfind(b'moov') - 4
+    # The first 16 KB, the header of the atom after mdat, then moov itself
+    assert [header for _, header in server.requests] == [
+        f'bytes=0-{audio_probe.HEAD_BYTES - 1}', f'bytes={moov}-{moov + 15}', f'bytes={moov}-{len(data) - 1}']
+
+
+@pytest.mark.parametrize('name, duration', [('vorbis.ogg', 30), ('opus.ogg', 20)])
+def test_ogg_duration_from_last_granule(server, name, duration):
+    metadata = probe(server, name)
+    assert metadata.mime_type == 'audio/ogg'
+    assert metadata.length == len(FIXTURES[name])
+    if server.honour_range:
+        assert metadata.duration_seconds == pytest.approx(duration)
+    else:
+        # Without a tail read there is no last page to take the granule from
+        assert metadata.duration_seconds is None
+
+
+def test_truncated_mp3_falls_back_to_bitrate(server):
+    metadata = probe(server, 'truncated.mp3')
+    audio_bytes = len(FIXTURES['truncated.mp3']) - ID3V2_BYTES
+    assert metadata.bitrate == 128000
+    assert metadata.duration_seconds == pytest.approx(audio_bytes * 8 / 128000)
+
+
+def test_truncated_mp4_without_moov(server):
+    assert probe(server, 'truncated.m4a') is None
+
+
+def test_truncated_ogg_without_final_page(server):
+    metadata = probe(server, 'truncated.ogg')
+    assert metadata.mime_type == 'audio/ogg'
+    assert metadata.duration_seconds is None
+    assert metadata.length == len(FIXTURES['truncated.ogg'])
+
+
+def test_unrecognised_audio_keeps_content_type(server):
+    metadata = probe(server, 'silence.mp3')
+    assert metadata == audio_probe.AudioMetadata('audio/mpeg', None, None, len(FIXTURES['silence.mp3']))
+
+
+def test_reads_are_bounded(server):
+    probe(server, 'vorbis.ogg')
+    ranges = [header for _, header in server.requests]
+    assert ranges == [f'bytes=0-{audio_probe.HEAD_BYTES - 1}', f'bytes=-{audio_probe.TAIL_BYTES}']
+
+
+def test_disallowed_host_is_not_fetched(server):
+    assert audio_probe.probe_audio(f'http://localhost:{server.server_port}/cbr.mp3') is None
+    assert server.requests == []
@@ -0,0 +1,231 @@
+"""
+The Google login flow against a local fake OpenID Connect provider
+
+The provider serves a discovery document (with an ETag and max-age), a token
+endpoint that checks the client credentials and authorization code, and a
+userinfo endpoint that checks the bearer token. The app runs on a scratch
+SQLite database, with its background services left stopped.
+"""
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix='podcastpal-login-test-')
+os.environ.pop('SUPABASE_DB_PASSWORD', None)
+os.environ['DATABASE_URL'] = f'sqlite:///{_scratch}/app.db'
+os.environ['INVALIDATION_LOG_PATH'] = f'{_scratch}/invalidations.log'
+
+import app as app_module  # noqa: E402
+import google_auth  # noqa: E402
+from models import User  # noqa: E402
+
+CLIENT_ID = 'test-client.apps.example.com'
+CLIENT_SECRET = 'test-secret'
+DISCOVERY_ETAG = '"discovery-v1"'
+CALLBACK_URL = 'http://localhost/google_login/callback'
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        self.server.requests.append(('GET', path, dict(self.headers)))
+        if path == '/.well-known/openid-configuration':
+            if self.headers.get('If-None-Match') == DISCOVERY_ETAG:
+                self._send(304, None)
+                return
+            base = f'http://127.0.0.1:{self.server.server_port}'
+            self._send(200, {
+                'issuer': base,
+                'authorization_endpoint': f'{base}/authorize',
+                'token_endpoint': f'{base}/token',
+                'userinfo_endpoint': f'{base}/userinfo',
+            })
+        elif path == '/userinfo':
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            profile = self.server.tokens.get(token)
+            self._send(200, profile) if profile else self._send(401, {'error': 'invalid_token'})
+        else:
+            self._send(404, {'error': 'not_found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        form = dict(urllib.parse.parse_qsl(body))
+        self.server.requests.append(('POST', self.path, dict(self.headers), form))
+        expected_auth = 'Basic ' + base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
+        if self.path != '/token' or self.headers.get('Authorization') != expected_auth:
+            self._send(401, {'error': 'invalid_client'})
+            return
+        # Codes are single use, as a real provider's are
+        profile = self.server.codes.pop(form.get('code'), None)
+        if (profile is None or form.get('grant_type') != 'authorization_code'
+                or form.get('redirect_uri') != CALLBACK_URL):
+            self._send(400, {'error': 'invalid_grant'})
+            return
+        token = f'token-{len(self.server.tokens)}'
+        self.server.tokens[token] = profile
+        self._send(200, {'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+    def _send(self, status, document):
+        body = json.dumps(document).encode() if document is not None else b''
+        self.send_response(status)
+        if status in (200, 304) and self.path.startswith('/.well-known/'):
+            self.send_header('ETag', DISCOVERY_ETAG)
+            self.send_header('Cache-Control', 'public, max-age=3600')
+        if document is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ProviderHandler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.codes = {}
+    httpd.tokens = {}
+    threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    url = f'http://127.0.0.1:{httpd.server_port}/.well-known/openid-configuration'
+    monkeypatch.setattr(google_auth, 'discovery_cache', google_auth.DiscoveryCache(url))
+    monkeypatch.setenv('GOOGLE_OAUTH_CLIENT_ID', CLIENT_ID)
+    monkeypatch.setenv('GOOGLE_OAUTH_CLIENT_SECRET', CLIENT_SECRET)
+    monkeypatch.setenv('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # The scheduler would otherwise start in the test process on the first request
+    monkeypatch.setattr(app_module, '_deferred_started', True)
+    return app_module.app.test_client()
+
+
+def requests_to(provider, path):
+    return [entry for entry in provider.requests if entry[1] == path]
+
+
+def log_in(client, provider, code, profile):
+    """Run the whole flow: redirect to the provider, consent there, come back with the code"""
+    response = client.get('/google_login')
+    assert response.status_code == 302
+    location = urllib.parse.urlsplit(response.headers['Location'])
+    assert f'{location.scheme}://{location.netloc}{location.path}' == \
+        f'http://127.0.0.1:{provider.server_port}/authorize'
+    params = dict(urllib.parse.parse_qsl(location.query))
+    assert params['client_id'] == CLIENT_ID
+    assert params['redirect_uri'] == CALLBACK_URL
+    assert params['response_type'] == 'code'
+    assert params['scope'].split() == ['openid', 'email', 'profile']
+
+    provider.codes[code] = profile
+    return client.get(f'/google_login/callback?code={code}&state={params["state"]}')
+
+
+def stored_user(google_id):
+    with app_module.app.app_context():
+        return app_module.db.session.execute(
+            app_module.db.select(User).filter_by(google_id=google_id)).scalar_one_or_none()
+
+
+def logged_in_user_id(client):
+    with client.session_transaction() as session:
+        return session.get('_user_id')
+
+
+def test_login_creates_user_and_session(client, provider):
+    response = log_in(client, provider, 'code-new', {
+        'sub': 'google-new', 'email': 'new@example.com', 'email_verified': True, 'name': 'New User'})
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/dashboard'
+
+    user = stored_user('google-new')
+    assert (user.email, user.name) == ('new@example.com', 'New User')
+    assert logged_in_user_id(client) == str(user.id)
+    assert client.get('/dashboard').status_code == 200
+
+    (_, _, headers, form), = requests_to(provider, '/token')
+    assert form['code'] == 'code-new'
+    (_, _, headers, *_), = requests_to(provider, '/userinfo')
+    assert headers['Authorization'] == 'Bearer token-0'
+
+
+def test_repeat_login_refreshes_profile_and_reuses_discovery(client, provider):
+    log_in(client, provider, 'code-1', {
+        'sub': 'google-repeat', 'email': 'old@example.com', 'email_verified': True, 'name': 'Old Name'})
+    first = stored_user('google-repeat')
+    client.get('/logout')
+    assert logged_in_user_id(client) is None
+
+    response = log_in(client, provider, 'code-2', {
+        'sub': 'google-repeat', 'email': 'renamed@example.com', 'email_verified': True})
+    assert response.status_code == 302
+    user = stored_user('google-repeat')
+    assert user.id == first.id
+    # Without a name the local part of the email is used
+    assert (user.email, user.name) == ('renamed@example.com', 'renamed')
+    assert logged_in_user_id(client) == str(user.id)
+    # Both logins were served from the pinned discovery document
+    assert len(requests_to(provider, '/.well-known/openid-configuration')) == 1
+
+
+def test_state_mismatch_is_rejected_before_token_exchange(client, provider):
+    client.get('/google_login')
+    provider.codes['code-forged'] = {'sub': 'google-forged', 'email': 'x@example.com', 'email_verified': True}
+    response = client.get('/google_login/callback?code=code-forged&state=forged')
+    assert response.status_code == 400
+    assert requests_to(provider, '/token') == []
+    assert logged_in_user_id(client) is None
+
+
+def test_unverified_email_is_rejected(client, provider):
+    response = log_in(client, provider, 'code-unverified', {
+        'sub': 'google-unverified', 'email': 'unverified@example.com', 'email_verified': False})
+    assert response.status_code == 400
+    assert stored_user('google-unverified') is None
+    assert logged_in_user_id(client) is None
+
+
+def test_rejected_code_fails_login(client, provider):
+    response = client.get('/google_login')
+    state = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(response.headers['Location']).query))['state']
+    response = client.get(f'/google_login/callback?code=never-issued&state={state}')
+    assert response.status_code == 400
+    assert requests_to(provider, '/userinfo') == []
+    assert logged_in_user_id(client) is None
+
+
+def test_stale_discovery_document_is_revalidated_in_background(client, provider):
+    log_in(client, provider, 'code-a', {
+        'sub': 'google-stale', 'email': 'stale@example.com', 'email_verified': True, 'name': 'Stale'})
+    google_auth.discovery_cache._expires_at = 0.0
+
+    # The stale endpoints are served at once while a background thread revalidates
+    response = log_in(client, provider, 'code-b', {
+        'sub': 'google-stale', 'email': 'stale@example.com', 'email_verified': True, 'name': 'Stale'})
+    assert response.status_code == 302
+    deadline = time.monotonic() + 5
+    while len(requests_to(provider, '/.well-known/openid-configuration')) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    _, _, headers = requests_to(provider, '/.well-known/openid-configuration')[1]
+    assert headers['If-None-Match'] == DISCOVERY_ETAG
+    while google_auth.discovery_cache._expires_at == 0.0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # 304: the pinned endpoints are kept and fresh for another max-age
+    assert google_auth.discovery_cache._expires_at > time.monotonic() + 3000
+    assert google_auth.discovery_cache.endpoints.token_endpoint.endswith('/token')
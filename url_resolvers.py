@@ -0,0 +1,139 @@
+"""
+Registry of share-link resolvers that turn hosting pages into direct download URLs
+
+Each resolver owns a precompiled host pattern and rewrites URLs for that host.
+normalize_url is memoized. The registry only rewrites links; which hosts may be
+fetched server-side is decided by enclosure_probe's own allow-list. Free of
+Flask and database imports so render worker processes can use it.
+"""
+import base64
+import logging
+import re
+import threading
+import urllib.parse
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+NORMALIZE_CACHE_SIZE = 4096
+
+
+class UrlResolver:
+    """Rewrites share links on matching hosts into direct download links"""
+
+    def __init__(self, name, host_pattern, resolve, schemes=()):
+        self.name = name
+        self.host_pattern = re.compile(host_pattern, re.IGNORECASE)
+        self.resolve = resolve
+        self.schemes = schemes
+
+    def matches(self, parts):
+        if parts.scheme in self.schemes:
+            return True
+        return bool(parts.hostname) and self.host_pattern.fullmatch(parts.hostname) is not None
+
+
+_resolvers = []
+_registry_lock = threading.Lock()
+
+
+def register_resolver(name, host_pattern, resolve, schemes=()):
+    """Add a resolver (or replace one with the same name); resolve(parts) returns a URL or None"""
+    resolver = UrlResolver(name, host_pattern, resolve, schemes)
+    with _registry_lock:
+        _resolvers[:] = [existing for existing in _resolvers if existing.name != name]
+        _resolvers.append(resolver)
+    normalize_url.cache_clear()
+    return resolver
+
+
+def find_resolver(parts):
+    for resolver in _resolvers:
+        if resolver.matches(parts):
+            return resolver
+    return None
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_url(url):
+    """Direct download URL for a share link; unknown hosts are returned unchanged"""
+    if not url:
+        return url
+    try:
+        parts = urllib.parse.urlsplit(url)
+    except ValueError:
+        return url
+
+    resolver = find_resolver(parts)
+    if resolver is None:
+        return url
+    try:
+        return resolver.resolve(parts) or url
+    except Exception as e:
+        logger.warning(f"{resolver.name} resolver failed for {url}: {e}")
+        return url
+
+
+def _without_params(query, *names):
+    # Parameters are kept verbatim, so signed values survive untouched
+    return '&'.join(param for param in query.split('&') if param and param.split('=', 1)[0] not in names)
+
+
+def _resolve_dropbox(parts):
+    # Keep rlkey, st and other parameters; dl=0 would serve the preview page
+    host = parts.netloc
+    if parts.hostname.lower() in ('www.dropbox.com', 'dropbox.com'):
+        host = 'dl.dropboxusercontent.com'
+    return urllib.parse.urlunsplit(('https', host, parts.path, _without_params(parts.query, 'dl'), ''))
+
+
+_DRIVE_FILE_PATH = re.compile(r'/file/d/([a-zA-Z0-9_-]+)')
+_DRIVE_ID_PARAM = re.compile(r'(?:^|&)id=([a-zA-Z0-9_-]+)')
+
+
+def _resolve_google_drive(parts):
+    match = _DRIVE_FILE_PATH.search(parts.path) or _DRIVE_ID_PARAM.search(parts.query)
+    if match is None:
+        return None
+    return f"https://drive.google.com/uc?export=download&id={match.group(1)}"
+
+
+def _resolve_onedrive(parts):
+    host = parts.hostname.lower()
+    if host == '1drv.ms':
+        # Short share links go through the shares API, which redirects to the file itself
+        encoded = base64.urlsafe_b64encode(urllib.parse.urlunsplit(parts).encode('utf-8')).decode('ascii').rstrip('=')
+        return f"https://api.onedrive.com/v1.0/shares/u!{encoded}/root/content"
+    if host == 'onedrive.live.com':
+        path = re.sub(r'^/(?:redir|embed)\b', '/download', parts.path)
+        return urllib.parse.urlunsplit(('https', parts.netloc, path, parts.query, ''))
+    if host.endswith('.sharepoint.com'):
+        query = _without_params(parts.query, 'download')
+        query = f"{query}&download=1" if query else 'download=1'
+        return urllib.parse.urlunsplit(('https', parts.netloc, parts.path, query, ''))
+    return None
+
+
+_BOX_SHARE_PATH = re.compile(r'^/s/([a-zA-Z0-9]+)/?$')
+
+
+def _resolve_box(parts):
+    match = _BOX_SHARE_PATH.match(parts.path)
+    if match is None:
+        return None
+    return f"https://{parts.netloc}/shared/static/{match.group(1)}"
+
+
+def _resolve_s3(parts):
+    # Object URLs are already direct; only the console-style s3:// form needs rewriting
+    if parts.scheme == 's3':
+        return f"https://{parts.netloc}.s3.amazonaws.com{parts.path}"
+    return None
+
+
+register_resolver('dropbox', r'(?:www\.)?dropbox\.com|dl\.dropboxusercontent\.com', _resolve_dropbox)
+register_resolver('google-drive', r'drive\.google\.com|drive\.usercontent\.google\.com', _resolve_google_drive)
+register_resolver('onedrive', r'1drv\.ms|onedrive\.live\.com|api\.onedrive\.com|[a-z0-9-]+\.sharepoint\.com',
+                  _resolve_onedrive)
+register_resolver('box', r'(?:[a-z0-9-]+\.)?(?:app\.)?box\.com|dl\.boxcloud\.com', _resolve_box)
+register_resolver('s3', r'(?:[a-z0-9.-]+\.)?s3(?:[.-][a-z0-9-]+)?\.amazonaws\.com', _resolve_s3, schemes=('s3',))